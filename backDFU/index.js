@@ -165,6 +165,7 @@ app.post('/api/detect-ulcers', upload.single('file'), async (req, res) => {
         const response = await axios.post(urlDetection, formData, {
             headers: {
                 ...formData.getHeaders(),
+                'X-Deadline-Ms': '240000', // server-py descarta o trabalho se passar do nosso timeout
             },
             timeout: 240000, // 240 segundos
             maxContentLength: Infinity,
@@ -225,7 +226,7 @@ app.post('/api/detect-ulcers', upload.single('file'), async (req, res) => {
 
 app.post('/api/classify-regions', express.json(), async (req, res) => {
     try {
-        const { imagem_redimensionada, boxes_finais, medico_id, paciente_id } = req.body;
+        const { imagem_redimensionada, image_id, boxes_finais, medico_id, paciente_id } = req.body;
 
         if (!imagem_redimensionada || !boxes_finais) {
             return res.status(400).json({
@@ -237,29 +238,51 @@ app.post('/api/classify-regions', express.json(), async (req, res) => {
         console.log('--- Etapa 2: Classificação das Regiões ---');
         console.log(`📤 Classificando ${boxes_finais.length} regiões...`);
 
-        // Converter base64 para buffer
-        const imageBuffer = Buffer.from(imagem_redimensionada, 'base64');
-
-        const formClassification = new FormData();
-        formClassification.append('file', stream.Readable.from(imageBuffer), {
-            filename: 'ulcera_analise.jpg',
-            contentType: 'image/jpeg'
-        });
-        formClassification.append('deteccoes_json', JSON.stringify(boxes_finais));
+        // ⭐ MONTA O FORM: POR image_id (SEM REENVIAR A IMAGEM) OU COM O ARQUIVO
+        const montarFormClassificacao = (usarImageId) => {
+            const form = new FormData();
+            if (usarImageId) {
+                form.append('image_id', image_id);
+            } else {
+                // Converter base64 para buffer
+                const imageBuffer = Buffer.from(imagem_redimensionada, 'base64');
+                form.append('file', stream.Readable.from(imageBuffer), {
+                    filename: 'ulcera_analise.jpg',
+                    contentType: 'image/jpeg'
+                });
+            }
+            form.append('deteccoes_json', JSON.stringify(boxes_finais));
+            return form;
+        };
 
         const urlClassification = `${PYTHON_API_BASE_URL}/predict/classification`;
         console.log('🔗 URL classificação:', urlClassification);
 
         // ⭐ MELHORAR CONFIGURAÇÃO DO AXIOS
-        const responseClassification = await axios.post(urlClassification, formClassification, {
+        const enviarClassificacao = (form) => axios.post(urlClassification, form, {
             headers: {
-                ...formClassification.getHeaders(),
+                ...form.getHeaders(),
+                'X-Deadline-Ms': '60000',
             },
             timeout: 60000,
             maxContentLength: Infinity,
             maxBodyLength: Infinity
         });
 
+        let responseClassification;
+        if (image_id) {
+            try {
+                responseClassification = await enviarClassificacao(montarFormClassificacao(true));
+            } catch (error) {
+                // image_id expirou no cache do server-py: reenvia a imagem
+                if (error.response?.status !== 404) throw error;
+                console.log('⚠️ image_id expirado, reenviando a imagem...');
+                responseClassification = await enviarClassificacao(montarFormClassificacao(false));
+            }
+        } else {
+            responseClassification = await enviarClassificacao(montarFormClassificacao(false));
+        }
+
         console.log(`✅ Classificação concluída. Status: ${responseClassification.status}`);
 
         // ⭐ VERIFICAR SE TEM RESULTADOS
@@ -23,6 +23,7 @@ export default function EditRegionsScreen() {
   const params = useLocalSearchParams();
   const pacienteId = params.id;
   const detectedImageBase64 = params.imageBase64;
+  const imageId = params.imageId;
   const initialBoxes = params.boxes ? JSON.parse(params.boxes) : [];
   const imageInfo = params.imageInfo ? JSON.parse(params.imageInfo) : {};
   const originalImageSize = imageInfo.original_size || { width: SOURCE_IMAGE_DIM, height: SOURCE_IMAGE_DIM };
@@ -192,7 +193,7 @@ export default function EditRegionsScreen() {
     }));
     router.push({
       pathname: `/paciente/${pacienteId}/nova-analise/results`,
-      params: { id: pacienteId, imageBase64: detectedImageBase64, boxes: JSON.stringify(unscaledBoxes), imageInfo: JSON.stringify(imageInfo), originalUri },
+      params: { id: pacienteId, imageBase64: detectedImageBase64, imageId, boxes: JSON.stringify(unscaledBoxes), imageInfo: JSON.stringify(imageInfo), originalUri },
     });
   };
 
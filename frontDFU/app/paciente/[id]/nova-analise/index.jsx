@@ -132,6 +132,7 @@ export default function NovaAnaliseIndex() {
             params: {
               id: pacienteId,
               imageBase64: data.imagem_redimensionada,
+              imageId: data.image_id,
               boxes: JSON.stringify(data.boxes),
               imageInfo: JSON.stringify(data.dimensoes || {}),
               originalUri: originalImageUri,
@@ -24,6 +24,7 @@ export default function ResultsScreen() {
   const params = useLocalSearchParams();
   const pacienteId = params.id;
   const detectedImageBase64 = params.imageBase64;
+  const imageId = params.imageId;
   const boxes = JSON.parse(params.boxes);
   const imageInfo = JSON.parse(params.imageInfo);
   const originalUri = params.originalUri;
@@ -49,6 +50,7 @@ export default function ResultsScreen() {
     try {
       const classificacaoData = {
         imagem_redimensionada: detectedImageBase64,
+        image_id: imageId,
         boxes_finais: boxes,
         medico_id: auth.currentUser?.uid,
         paciente_id: pacienteId,
@@ -1,20 +1,40 @@
 import os
-import torch
+import ast
 import pathlib
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
+import cv2
 import io
 from PIL import Image
 import base64
 import json
-from typing import Dict, List
+from typing import Dict, List, Optional
 import sys
 import logging
 import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+import warnings
+import weakref
+import gc
+import hmac
+import shutil
+import contextvars
+import cProfile
+import pstats
+import tempfile
+from datetime import datetime, timezone
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
 import gdown
 from pathlib import Path
 import requests
@@ -27,6 +47,123 @@ import io
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Frameworks pesados: importados sob demanda (importar_torch / importar_tensorflow)
+# para o servidor abrir a porta imediatamente e carregar os modelos em segundo plano
+torch = None
+tf = None
+
+# Threads de cada framework (0 = padrão do framework, que usa todos os núcleos).
+# O servir.py define estes valores por worker para não sobrecarregar a CPU.
+THREADS_INTRA_OP = int(os.getenv("THREADS_INTRA_OP", "0"))
+THREADS_INTER_OP = int(os.getenv("THREADS_INTER_OP", "0"))
+
+# Tempos de cada fase da inicialização (imports, carga dos pesos, warmup), em segundos
+INICIO_PROCESSO = time.monotonic()
+TEMPOS_INICIALIZACAO = {}
+modelos_prontos = False
+erro_inicializacao = None
+tarefa_inicializacao = None
+# Até os modelos estarem carregados, compilados e aquecidos, /health responde 503 e os
+# endpoints de predição e de jobs recusam com 503 + Retry-After
+INICIALIZACAO_RETRY_AFTER = int(os.getenv("INICIALIZACAO_RETRY_AFTER", "5"))
+
+@contextmanager
+def medir_fase(nome):
+    """Registra em TEMPOS_INICIALIZACAO quanto tempo a fase levou"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        TEMPOS_INICIALIZACAO[nome] = round(time.perf_counter() - inicio, 3)
+
+def importar_torch():
+    """Importa o PyTorch (e o pacote yolov5, se instalado) na primeira chamada"""
+    global torch
+    if torch is None:
+        with medir_fase("import_torch"):
+            import torch as _torch
+            try:
+                import yolov5  # noqa: F401
+            except ImportError:
+                pass
+            torch = _torch
+            configurar_threads()
+    return torch
+
+def importar_tensorflow():
+    """Importa o TensorFlow na primeira chamada"""
+    global tf
+    if tf is None:
+        with medir_fase("import_tensorflow"):
+            import tensorflow as _tf
+            if THREADS_INTRA_OP:
+                _tf.config.threading.set_intra_op_parallelism_threads(THREADS_INTRA_OP)
+            if THREADS_INTER_OP:
+                _tf.config.threading.set_inter_op_parallelism_threads(THREADS_INTER_OP)
+            tf = _tf
+    return tf
+
+def configurar_threads():
+    """Aplica THREADS_INTRA_OP / THREADS_INTER_OP ao OpenCV e ao PyTorch (se já importado)"""
+    if THREADS_INTRA_OP:
+        cv2.setNumThreads(THREADS_INTRA_OP)
+    if torch is None:
+        return
+    if THREADS_INTRA_OP:
+        torch.set_num_threads(THREADS_INTRA_OP)
+    if THREADS_INTER_OP:
+        try:
+            torch.set_num_interop_threads(THREADS_INTER_OP)
+        except RuntimeError:
+            pass  # só pode ser definido uma vez, antes de qualquer trabalho paralelo
+
+def memoria_processo(pid="self"):
+    """
+    Memória de um processo em MB (Linux). PSS divide as páginas compartilhadas
+    entre os processos que as usam: a soma do PSS dos workers é o consumo real.
+    """
+    memoria = {"pid": os.getpid() if pid == "self" else pid}
+    campos = {"Rss": "rss_mb", "Pss": "pss_mb", "Private_Clean": "privado_mb", "Private_Dirty": "privado_mb",
+              "Shared_Clean": "compartilhado_mb", "Shared_Dirty": "compartilhado_mb"}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for linha in f:
+                chave, _, valor = linha.partition(":")
+                if chave in campos:
+                    memoria[campos[chave]] = memoria.get(campos[chave], 0) + int(valor.split()[0]) / 1024
+    except OSError:
+        return memoria
+    return {chave: round(valor, 1) if isinstance(valor, float) else valor for chave, valor in memoria.items()}
+
+def memoria_disponivel():
+    """
+    Bytes que ainda podem ser alocados: MemAvailable do sistema, limitado pelo que resta
+    do limite do cgroup (container), ou None se nenhum dos dois puder ser lido
+    """
+    limites = []
+    try:
+        with open("/proc/meminfo") as f:
+            for linha in f:
+                if linha.startswith("MemAvailable:"):
+                    limites.append(int(linha.split()[1]) * 1024)
+    except (OSError, ValueError):
+        pass
+    for limite_path, uso_path in (("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+                                  ("/sys/fs/cgroup/memory/memory.limit_in_bytes",
+                                   "/sys/fs/cgroup/memory/memory.usage_in_bytes")):
+        try:
+            with open(limite_path) as f:
+                limite = f.read().strip()
+            with open(uso_path) as f:
+                uso = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        if limite.isdigit() and int(limite) < 1 << 60:  # "max" / valor gigante = sem limite
+            limites.append(int(limite) - uso)
+        break
+    return min(limites) if limites else None
+
+
 # CONFIGURAR AMBIENTE HEADLESS 
 os.environ['DISPLAY'] = ':99'
 os.environ['QT_QPA_PLATFORM'] = 'offscreen'
@@ -52,7 +189,95 @@ def fix_yolo_deployment():
 # Aplica o fix ANTES de qualquer coisa do YOLOv5
 fix_yolo_deployment()
 
-app = FastAPI(title="Medical AI Classification API", version="1.0.0")
+# Serializador JSON rápido (orjson) quando disponível (o ORJSONResponse do FastAPI está obsoleto)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Compressão das respostas: brotli (com fallback gzip) se disponível, senão gzip
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+# Métricas Prometheus (GET /metrics). As etapas de cada requisição são rotuladas com o
+# endpoint corrente, propagado por contextvar até as threads do executor.
+BUCKETS_ETAPAS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_CONTAGEM = (0, 1, 2, 3, 5, 10, 20, 50, 100, 300, 1000)
+
+METRICA_REQUISICOES = Counter("dfu_requisicoes_total", "Requisições atendidas", ["endpoint", "status"])
+METRICA_ERROS = Counter("dfu_erros_total", "Requisições que terminaram em erro 5xx", ["endpoint"])
+# Com vários workers (servir.py), cada um grava suas métricas em PROMETHEUS_MULTIPROC_DIR
+# e o /metrics de qualquer worker agrega todos
+METRICAS_MULTIPROCESSO = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+METRICA_EM_ANDAMENTO = Gauge(
+    "dfu_requisicoes_em_andamento", "Requisições em processamento", ["endpoint"], multiprocess_mode="livesum"
+)
+METRICA_DURACAO = Histogram(
+    "dfu_requisicao_segundos", "Duração total da requisição", ["endpoint"], buckets=BUCKETS_ETAPAS
+)
+METRICA_ETAPAS = Histogram(
+    "dfu_etapa_segundos", "Duração de cada etapa do pipeline por endpoint", ["endpoint", "etapa"], buckets=BUCKETS_ETAPAS
+)
+METRICA_FORWARD = Histogram(
+    "dfu_forward_segundos", "Duração de um forward (lote) de cada modelo", ["modelo"], buckets=BUCKETS_ETAPAS
+)
+METRICA_LOTE = Histogram("dfu_lote_itens", "Itens por forward de cada modelo", ["modelo"], buckets=BUCKETS_CONTAGEM)
+METRICA_BOXES = Histogram("dfu_boxes_por_imagem", "Detecções por imagem", ["endpoint"], buckets=BUCKETS_CONTAGEM)
+METRICA_RECORTES = Histogram(
+    "dfu_recortes_por_classificacao", "Recortes por chamada do classificador", ["endpoint"], buckets=BUCKETS_CONTAGEM
+)
+METRICA_CACHE_RESULTADOS = Counter(
+    "dfu_cache_resultados_total", "Consultas ao cache de resultados", ["endpoint", "resultado"]
+)
+METRICA_RECORTES_REAPROVEITADOS = Counter(
+    "dfu_recortes_reaproveitados_total", "Boxes cuja classificação veio do cache incremental"
+)
+METRICA_COMPILACOES = Counter(
+    "dfu_compilacoes_total", "Grafos traçados por modelo (depois do warmup, deve ficar constante)", ["modelo"]
+)
+METRICA_ABANDONADAS = Counter(
+    "dfu_requisicoes_abandonadas_total",
+    "Requisições descartadas por prazo vencido ou cliente desconectado, pela etapa em que pararam",
+    ["endpoint", "motivo", "etapa"]
+)
+METRICA_JOBS = Counter("dfu_jobs_total", "Jobs assíncronos por tipo e desfecho", ["tipo", "resultado"])
+METRICA_RSS = Gauge("dfu_processo_rss_bytes", "Memória residente (RSS) do processo", multiprocess_mode="liveall")
+
+endpoint_atual = contextvars.ContextVar("endpoint_atual", default="nenhum")
+
+def rss_processo():
+    """RSS atual do processo em bytes (Linux), ou 0 se indisponível"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+if not METRICAS_MULTIPROCESSO:
+    METRICA_RSS.set_function(rss_processo)  # set_function não existe no modo multiprocesso
+
+@contextmanager
+def medir_etapa(etapa):
+    """Observa a duração da etapa no histograma, rotulada com o endpoint corrente"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICA_ETAPAS.labels(endpoint_atual.get(), etapa).observe(time.perf_counter() - inicio)
+
+class RespostaJSON(JSONResponse):
+    """Resposta JSON padrão (orjson se disponível) com a serialização medida"""
+    
+    def render(self, content):
+        with medir_etapa("serializacao_json"):
+            if orjson is None:
+                return super().render(content)
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+app = FastAPI(title="Medical AI Classification API", version="1.0.0", default_response_class=RespostaJSON)
 
 # Configuração CORS para permitir requests do Node.js
 app.add_middleware(
@@ -63,6 +288,133 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=1000, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+_rotas_conhecidas = None
+
+def rotulo_endpoint(path):
+    """Rótulo de baixa cardinalidade para o path (rotas com parâmetro viram o template)"""
+    global _rotas_conhecidas
+    if _rotas_conhecidas is None:
+        _rotas_conhecidas = {rota.path for rota in app.routes}
+    if path in _rotas_conhecidas:
+        return path
+    if path.startswith("/images/"):
+        return "/images/{image_id}"
+    if path.startswith("/jobs/"):
+        return "/jobs/{job_id}/eventos" if path.endswith("/eventos") else "/jobs/{job_id}"
+    if path.startswith("/admin/perfil/"):
+        return "/admin/perfil/{perfil_id}"
+    if path.startswith("/admin/modelos/"):
+        return "/admin/modelos/{tipo}/rollback" if path.endswith("/rollback") else "/admin/modelos/{tipo}"
+    return "outros"
+
+@app.middleware("http")
+async def medir_requisicoes(request: Request, call_next):
+    """Conta requisições, erros e em andamento, e mede a duração total por endpoint"""
+    endpoint = rotulo_endpoint(request.url.path)
+    if endpoint == "/metrics":
+        return await call_next(request)
+    
+    token = endpoint_atual.set(endpoint)
+    request.state.chegada = time.monotonic()  # o prazo do cliente conta desde a chegada, não desde o fim do upload
+    em_andamento = METRICA_EM_ANDAMENTO.labels(endpoint)
+    em_andamento.inc()
+    inicio = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        em_andamento.dec()
+        METRICA_DURACAO.labels(endpoint).observe(time.perf_counter() - inicio)
+        METRICA_REQUISICOES.labels(endpoint, str(status)).inc()
+        if status >= 500:
+            METRICA_ERROS.labels(endpoint).inc()
+        if METRICAS_MULTIPROCESSO:
+            METRICA_RSS.set(rss_processo())
+        if sessao_perfil is not None and endpoint.startswith("/predict/"):
+            sessao_perfil.requisicao_concluida()
+        endpoint_atual.reset(token)
+
+def limite_corpo_mb(path):
+    """Limite de upload (MB) do endpoint"""
+    if path == "/predict/lote":
+        return LOTE_MAX_MB
+    if path.startswith("/admin/modelos/"):
+        return MODELOS_UPLOAD_MAX_MB
+    return UPLOAD_MAX_MB
+
+def limite_corpo_bytes(limite_mb):
+    # Folga de 64 KB para os outros campos e os delimitadores do multipart
+    return limite_mb * 1024 * 1024 + 64 * 1024
+
+@app.middleware("http")
+async def limitar_tamanho_requisicao(request: Request, call_next):
+    """Rejeita com 413, sem ler o corpo, requisições cujo Content-Length passa do limite de upload"""
+    tamanho = request.headers.get("content-length")
+    limite_mb = limite_corpo_mb(request.url.path)
+    if tamanho and tamanho.isdigit() and int(tamanho) > limite_corpo_bytes(limite_mb):
+        return RespostaJSON(
+            status_code=413, content={"detail": f"Upload maior que o limite de {limite_mb:g} MB"}
+        )
+    return await call_next(request)
+
+class LimitarCorpoStream:
+    """
+    Middleware ASGI que conta os bytes do corpo enquanto chegam e responde 413 ao passar
+    do limite: cobre uploads sem Content-Length (chunked), que o parser de multipart
+    gravaria inteiros no arquivo temporário antes de ler_upload ver o tamanho.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        limite_mb = limite_corpo_mb(scope["path"])
+        limite = limite_corpo_bytes(limite_mb)
+        recebidos = 0
+        excedido = iniciado = False
+        
+        async def receber():
+            nonlocal recebidos, excedido
+            if excedido:
+                return {"type": "http.disconnect"}
+            mensagem = await receive()
+            if mensagem["type"] == "http.request":
+                recebidos += len(mensagem.get("body", b""))
+                if recebidos > limite:
+                    # Para de ler: para a aplicação o corpo termina como se o cliente tivesse saído
+                    excedido = True
+                    return {"type": "http.disconnect"}
+            return mensagem
+        
+        async def enviar(mensagem):
+            nonlocal iniciado
+            if excedido and not iniciado:
+                return  # a resposta da aplicação ao corpo cortado é trocada pelo 413
+            iniciado = iniciado or mensagem["type"] == "http.response.start"
+            await send(mensagem)
+        
+        try:
+            await self.app(scope, receber, enviar)
+        except Exception:
+            if not excedido:
+                raise
+        if excedido and not iniciado:
+            logger.warning(f"⚠️ Upload em {scope['path']} passou de {limite_mb:g} MB durante o envio; respondendo 413")
+            resposta = RespostaJSON(status_code=413, content={"detail": f"Upload maior que o limite de {limite_mb:g} MB"})
+            await resposta(scope, receive, send)
+
+app.add_middleware(LimitarCorpoStream)
+
 # Variáveis globais para os modelos
 modelo_classificacao = None
 modelo_yolo = None
@@ -72,14 +424,333 @@ LABEL_COLS = ['none', 'infection', 'ischaemia', 'both']
 MODELO_CLASSIFICACAO_URL = os.getenv("MODELO_CLASSIFICACAO_URL", "")
 MODELO_YOLO_URL = os.getenv("MODELO_YOLO_URL", "")
 
+# Downloads: sha256 esperado de cada modelo (vazio = sem verificação), segmentos paralelos
+# via HTTP Range quando o servidor aceita e retomada a partir do .part após falhas
+MODELO_CLASSIFICACAO_SHA256 = os.getenv("MODELO_CLASSIFICACAO_SHA256", "").lower()
+MODELO_YOLO_SHA256 = os.getenv("MODELO_YOLO_SHA256", "").lower()
+DOWNLOAD_SEGMENTOS = int(os.getenv("DOWNLOAD_SEGMENTOS", "4"))
+DOWNLOAD_SEGMENTO_MIN_MB = float(os.getenv("DOWNLOAD_SEGMENTO_MIN_MB", "8"))
+DOWNLOAD_TENTATIVAS = int(os.getenv("DOWNLOAD_TENTATIVAS", "5"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "30"))
+DOWNLOAD_BUFFER = 1024 * 1024  # escritas de 1 MB
+
+# Limiares do YOLO (confiança mínima e IoU do NMS)
+YOLO_CONF = float(os.getenv("YOLO_CONF", "0.25"))
+YOLO_IOU = float(os.getenv("YOLO_IOU", "0.45"))
+
+# Máximo de recortes por chamada ao classificador (listas maiores são divididas)
+CLASSIFICACAO_MAX_BATCH = int(os.getenv("CLASSIFICACAO_MAX_BATCH", "32"))
+
+# Micro-batching entre requisições: junta até MAX_BATCH_SIZE itens ou espera até MAX_WAIT_MS
+YOLO_MAX_BATCH_SIZE = int(os.getenv("YOLO_MAX_BATCH_SIZE", "4"))
+YOLO_MAX_WAIT_MS = float(os.getenv("YOLO_MAX_WAIT_MS", "10"))
+CLASSIFICACAO_MAX_BATCH_SIZE = int(os.getenv("CLASSIFICACAO_MAX_BATCH_SIZE", str(CLASSIFICACAO_MAX_BATCH)))
+CLASSIFICACAO_MAX_WAIT_MS = float(os.getenv("CLASSIFICACAO_MAX_WAIT_MS", "10"))
+
+# Pré-processamento do YOLO: "opencv" (letterbox único em numpy) ou "pil" (redimensionar_imagem)
+YOLO_PREPROCESSAMENTO = os.getenv("YOLO_PREPROCESSAMENTO", "opencv")
+
+# Detecção em mosaico (opt-in, mosaico=true): tiles 640x640 sobrepostos da imagem em
+# resolução total, em lotes de MOSAICO_LOTE, mesclados por NMS nas coordenadas originais.
+# MOSAICO_MAX_TILES limita o custo: acima dele a imagem é reduzida até a grade caber.
+MOSAICO_SOBREPOSICAO = float(os.getenv("MOSAICO_SOBREPOSICAO", "0.2"))
+MOSAICO_MAX_TILES = int(os.getenv("MOSAICO_MAX_TILES", "24"))
+MOSAICO_LOTE = int(os.getenv("MOSAICO_LOTE", os.getenv("YOLO_MAX_BATCH_SIZE", "4")))
+MOSAICO_IOS = float(os.getenv("MOSAICO_IOS", "0.8"))  # interseção / área da menor caixa para fundir cortes de borda
+MOSAICO_TRIAGEM_MARGEM = int(os.getenv("MOSAICO_TRIAGEM_MARGEM", "32"))  # px em volta das caixas da triagem
+# Confiança da passada global da triagem (bem abaixo do YOLO_CONF): uma lesão que quase some
+# no 640 ainda deixa uma caixa fraca que abre o tile; as caixas finais seguem o YOLO_CONF.
+# A triagem só refina o que a passada global vê, mesmo que fraco: o que ela não vê é pulado.
+MOSAICO_TRIAGEM_CONF = float(os.getenv("MOSAICO_TRIAGEM_CONF", "0.01"))
+
+# Executor dedicado para trabalho bloqueante (decode, resize, modelos, base64)
+INFERENCIA_WORKERS = int(os.getenv("INFERENCIA_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Requisições que podem aguardar além das que estão executando; acima disso respondemos 503
+INFERENCIA_FILA_MAX = int(os.getenv("INFERENCIA_FILA_MAX", "16"))
+INFERENCIA_RETRY_AFTER = int(os.getenv("INFERENCIA_RETRY_AFTER", "2"))
+
+executor_inferencia = ThreadPoolExecutor(max_workers=INFERENCIA_WORKERS, thread_name_prefix="inferencia")
+inferencia_admitidas = 0
+inferencia_em_execucao = 0
+inferencia_rejeitadas = 0
+_lock_inferencia = threading.Lock()
+
+# Prazo das requisições de predição: o cliente informa em PRAZO_HEADER quantos ms ainda
+# espera pela resposta (ex.: o timeout do axios no backend Node). Trabalho na fila cujo
+# prazo venceu, ou cujo cliente desconectou, é descartado antes de chegar ao modelo.
+# PRAZO_PADRAO_MS vale para requisições sem o cabeçalho (0 = sem prazo).
+PRAZO_HEADER = os.getenv("PRAZO_HEADER", "X-Deadline-Ms")
+PRAZO_PADRAO_MS = float(os.getenv("PRAZO_PADRAO_MS", "0"))
+requisicoes_abandonadas = {"prazo": {}, "desconexao": {}}
+
+# Limites de ingestão: tamanho do upload (rejeitado antes de ler o corpo quando declarado)
+# e pixels da imagem (conferidos no cabeçalho, antes de decodificar)
+UPLOAD_MAX_MB = float(os.getenv("UPLOAD_MAX_MB", "25"))
+UPLOAD_MAX_BYTES = int(UPLOAD_MAX_MB * 1024 * 1024)
+IMAGEM_MAX_MEGAPIXELS = float(os.getenv("IMAGEM_MAX_MEGAPIXELS", "60"))
+IMAGEM_MAX_PIXELS = int(IMAGEM_MAX_MEGAPIXELS * 1_000_000)
+Image.MAX_IMAGE_PIXELS = IMAGEM_MAX_PIXELS  # proteção do próprio PIL contra decompression bombs
+# Análise em lote (/predict/lote): limites do corpo inteiro, de itens e de imagens em processamento
+LOTE_MAX_MB = float(os.getenv("LOTE_MAX_MB", "1024"))
+LOTE_MAX_ITENS = int(os.getenv("LOTE_MAX_ITENS", "5000"))
+LOTE_CONCORRENCIA = int(os.getenv("LOTE_CONCORRENCIA", "8"))
+LOTE_MAX_CONCORRENCIA = int(os.getenv("LOTE_MAX_CONCORRENCIA", "32"))
+# 1 = JPEGs decodificados já reduzidos (escala na DCT do libjpeg) quando só o 640 é necessário
+DECODIFICACAO_REDUZIDA = os.getenv("DECODIFICACAO_REDUZIDA", "1") == "1"
+
+# Cache de sessão das imagens letterboxed (a classificação referencia a detecção por image_id)
+CACHE_IMAGENS_MAX_MB = float(os.getenv("CACHE_IMAGENS_MAX_MB", "256"))
+CACHE_IMAGENS_TTL = float(os.getenv("CACHE_IMAGENS_TTL", "900"))
+
+# Cache de resultados endereçado por conteúdo (sha256 dos bytes + versões dos modelos + limiares).
+# CACHE_RESULTADOS_SQLITE aponta para um banco em disco que sobrevive a restarts e é
+# compartilhado entre os workers; vazio = só memória. CACHE_RESULTADOS_MAX_MB=0 desliga.
+CACHE_RESULTADOS_MAX_MB = float(os.getenv("CACHE_RESULTADOS_MAX_MB", "64"))
+CACHE_RESULTADOS_TTL = float(os.getenv("CACHE_RESULTADOS_TTL", "3600"))
+CACHE_RESULTADOS_SQLITE = os.getenv("CACHE_RESULTADOS_SQLITE", "")
+
+# Reclassificação incremental: por imagem, memoriza as boxes já classificadas e suas
+# probabilidades; uma box reenviada com IoU >= CLASSIFICACAO_INCREMENTAL_IOU contra uma
+# já vista (ajustes de poucos pixels) reaproveita o resultado sem rodar o modelo.
+CLASSIFICACAO_INCREMENTAL = os.getenv("CLASSIFICACAO_INCREMENTAL", "1") == "1"
+CLASSIFICACAO_INCREMENTAL_IOU = float(os.getenv("CLASSIFICACAO_INCREMENTAL_IOU", "0.9"))
+CLASSIFICACAO_INCREMENTAL_MAX_BOXES = int(os.getenv("CLASSIFICACAO_INCREMENTAL_MAX_BOXES", "512"))
+CACHE_RECORTES_MAX_MB = float(os.getenv("CACHE_RECORTES_MAX_MB", "16"))
+
+# Jobs assíncronos (POST /jobs): fila e resultados em SQLite (WAL, compartilhado entre os
+# workers do servir.py e preservado entre restarts), executados por JOBS_WORKERS tarefas
+# por processo. Um job "executando" sem batimento há JOBS_ORFAO segundos (processo morto)
+# volta para a fila, até JOBS_MAX_TENTATIVAS vezes. Jobs terminados expiram após JOBS_TTL.
+JOBS_SQLITE = os.getenv("JOBS_SQLITE", "jobs.db")
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOBS_MAX_PENDENTES = int(os.getenv("JOBS_MAX_PENDENTES", "1000"))
+JOBS_TTL = float(os.getenv("JOBS_TTL", "86400"))
+JOBS_BATIMENTO = float(os.getenv("JOBS_BATIMENTO", "10"))
+JOBS_ORFAO = float(os.getenv("JOBS_ORFAO", "60"))
+JOBS_MAX_TENTATIVAS = int(os.getenv("JOBS_MAX_TENTATIVAS", "3"))
+JOBS_INTERVALO = float(os.getenv("JOBS_INTERVALO", "1"))  # espera por jobs de outros processos e polling do SSE
+
+# Imagem devolvida pela detecção: "base64" (padrão), "nenhum" ou "url" (GET /images/{image_id})
+FORMATOS_IMAGEM = ("base64", "nenhum", "url")
+TIPOS_IMAGEM = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+IMAGEM_QUALIDADE_PADRAO = int(os.getenv("IMAGEM_QUALIDADE_PADRAO", "90"))
+
+# Agendadores de lote (criados no startup, pois dependem do event loop)
+agendador_yolo = None
+agendador_classificacao = None
+
 # Diretório para modelos
-MODELS_DIR = Path("models")
+MODELS_DIR = Path(os.getenv("MODELS_DIR", "models"))
 MODELS_DIR.mkdir(exist_ok=True)
 
-async def baixar_google_drive_direto(file_id: str, destino: Path, descricao: str):
-    """Estratégia melhorada para download do Google Drive"""
+# Registro local dos modelos: manifest.json com arquivo, versão e sha256 de cada artefato.
+# Com os artefatos presentes e íntegros, a carga nunca acessa a rede.
+MANIFESTO_MODELOS = MODELS_DIR / "manifest.json"
+ARQUIVOS_MODELOS = {
+    "yolo": "bestYolov5_test.pt",
+    "classificacao": "modeloClassificacao.h5",
+    # Artefatos gerados por exportar_modelos.py
+    "yolo_onnx": "bestYolov5_test.onnx",
+    "yolo_torchscript": "bestYolov5_test.torchscript",
+    "classificacao_onnx": "modeloClassificacao.onnx",
+    "yolo_onnx_int8": "bestYolov5_test.int8.onnx",
+    "classificacao_onnx_int8": "modeloClassificacao.int8.onnx"
+}
+VERSOES_MODELOS_ENV = {
+    "yolo": os.getenv("MODELO_YOLO_VERSAO", ""),
+    "classificacao": os.getenv("MODELO_CLASSIFICACAO_VERSAO", "")
+}
+# MODELOS_OFFLINE=1 desativa qualquer estratégia que dependa de rede (downloads, torch.hub)
+MODELOS_OFFLINE = os.getenv("MODELOS_OFFLINE", "0") == "1"
+
+# Backend de inferência: "nativo" (PyTorch/Keras), "onnx" (ONNX Runtime), "onnx_int8" (ONNX
+# quantizado em INT8) ou "torchscript" (só YOLO).
+# Com um backend ONNX, o framework de treino correspondente nem é importado.
+BACKENDS_ONNX = ("onnx", "onnx_int8")
+BACKEND_INFERENCIA = os.getenv("BACKEND_INFERENCIA", "nativo")
+BACKEND_YOLO = os.getenv("BACKEND_YOLO", BACKEND_INFERENCIA)
+BACKEND_CLASSIFICACAO = os.getenv(
+    "BACKEND_CLASSIFICACAO", BACKEND_INFERENCIA if BACKEND_INFERENCIA in BACKENDS_ONNX else "nativo"
+)
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", str(THREADS_INTRA_OP)))  # 0 = padrão do ONNX Runtime
+
+# Caminho compilado dos backends nativos: classificador Keras por um tf.function cujos lotes
+# são preenchidos até o menor bucket de CLASSIFICACAO_BUCKETS (só esses shapes são traçados,
+# todos no warmup) e YOLO PyTorch traçado com torch.jit.trace (entrada 640, lote dinâmico)
+CLASSIFICACAO_COMPILADA = os.getenv("CLASSIFICACAO_COMPILADA", "1") == "1"
+CLASSIFICACAO_BUCKETS = sorted({int(b) for b in os.getenv("CLASSIFICACAO_BUCKETS", "1,2,4,8,16,32").split(",") if b.strip()})
+YOLO_TRACADO = os.getenv("YOLO_TRACADO", "1") == "1"
+
+# Troca de modelos a quente (POST /admin/modelos/{tipo}, exige ADMIN_TOKEN): cada versão fica
+# em MODELS_DIR/slots/<tipo>/<versao>/ e o manifesto guarda as MODELOS_HISTORICO últimas
+# (rollback). A nova versão é carregada e aquecida em segundo plano e assume no lugar da
+# atual, que é liberada quando os forwards em andamento nela terminam. Antes de carregar,
+# exige MODELOS_FATOR_MEMORIA x o tamanho do artefato de memória livre, vezes o nº de workers
+# do servir.py: os outros seguem o manifesto a cada MODELOS_VIGIA_INTERVALO segundos (0 desliga)
+# e cada um carrega a sua cópia (a versão do mestre, compartilhada copy-on-write, só volta a
+# ser compartilhada num restart). Worker que não conseguir trocar aparece em /health e /models/info.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+MODELOS_UPLOAD_MAX_MB = float(os.getenv("MODELOS_UPLOAD_MAX_MB", "2048"))
+MODELOS_HISTORICO = max(2, int(os.getenv("MODELOS_HISTORICO", "5")))
+MODELOS_FATOR_MEMORIA = float(os.getenv("MODELOS_FATOR_MEMORIA", "3"))
+MODELOS_DRENAGEM_TIMEOUT = float(os.getenv("MODELOS_DRENAGEM_TIMEOUT", "60"))
+MODELOS_VIGIA_INTERVALO = float(os.getenv("MODELOS_VIGIA_INTERVALO", "30"))
+
+# Perfilamento sob demanda (POST /admin/perfil, exige ADMIN_TOKEN) das próximas N requisições
+# de predição ou de uma janela de T segundos: cProfile no event loop e nas threads de inferência,
+# amostragem das pilhas de todas as threads e, opcionalmente, os profilers do PyTorch (forwards
+# do YOLO) e do TensorFlow. Inativo custa só a leitura de sessao_perfil. Os artefatos (.zip)
+# ficam em PERFIL_DIR, visível a todos os workers do servir.py (os PERFIL_HISTORICO últimos).
+PERFIL_DIR = Path(os.getenv("PERFIL_DIR", os.path.join(tempfile.gettempdir(), "dfu-perfis")))
+PERFIL_MAX_SEGUNDOS = float(os.getenv("PERFIL_MAX_SEGUNDOS", "300"))
+PERFIL_AMOSTRAGEM_MS = float(os.getenv("PERFIL_AMOSTRAGEM_MS", "5"))
+PERFIL_HISTORICO = max(1, int(os.getenv("PERFIL_HISTORICO", "10")))
+sessao_perfil = None
+
+# Versão ativa de cada modelo (do manifesto, ou "mock" para os fallbacks)
+versoes_modelos = {"yolo": None, "classificacao": None}
+
+def calcular_sha256(caminho, tamanho_bloco=1024 * 1024):
+    """Calcula o sha256 de um arquivo em blocos de 1 MB"""
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+def ler_manifesto():
+    """Lê o manifesto de modelos (vazio se não existir ou estiver corrompido)"""
+    try:
+        with open(MANIFESTO_MODELOS) as f:
+            manifesto = json.load(f)
+        manifesto.setdefault("modelos", {})
+        return manifesto
+    except FileNotFoundError:
+        return {"modelos": {}}
+    except (OSError, ValueError) as e:
+        logger.warning(f"⚠️ Manifesto de modelos inválido, ignorando: {e}")
+        return {"modelos": {}}
+
+def caminho_no_registro(caminho):
+    """Caminho do artefato relativo a MODELS_DIR (slots ficam em subpastas)"""
+    try:
+        return Path(caminho).resolve().relative_to(MODELS_DIR.resolve()).as_posix()
+    except ValueError:
+        return Path(caminho).name
+
+VERSAO_VALIDA = re.compile(r"[A-Za-z0-9_][\w.\-]*")
+
+def diretorio_slot(tipo, versao):
+    """
+    Pasta MODELS_DIR/slots/<tipo>/<versao>/ de uma versão; ValueError se a versão não for
+    um nome de pasta simples (".." ou "." apontariam para fora do slot)
+    """
+    if not VERSAO_VALIDA.fullmatch(versao or ""):
+        raise ValueError(f"versão inválida para slot: {versao!r}")
+    raiz = (MODELS_DIR / "slots" / tipo).resolve()
+    pasta = (raiz / versao).resolve()
+    if pasta.parent != raiz:
+        raise ValueError(f"slot fora de {raiz}: {pasta}")
+    return pasta
+
+def apagar_slot(tipo, arquivo):
+    """Apaga só a pasta do slot de um artefato registrado (slots/<tipo>/<versao>/<arquivo>)"""
+    partes = Path(arquivo).parts
+    if len(partes) != 4 or partes[:2] != ("slots", tipo):
+        logger.warning(f"⚠️ Artefato fora de um slot de '{tipo}', não apagado: {arquivo}")
+        return
+    try:
+        pasta = diretorio_slot(tipo, partes[2])
+    except ValueError as e:
+        logger.warning(f"⚠️ {e}; nada apagado")
+        return
+    shutil.rmtree(pasta, ignore_errors=True)
+
+def registrar_modelo(tipo, caminho, versao=None, reordenar_historico=True):
+    """
+    Registra (ou atualiza) um artefato no manifesto com seu sha256, como versão ativa
+    do tipo e no fim do histórico (rollback). Slots que saem do histórico são apagados.
+    Sem reordenar_historico (rollback), uma versão já no histórico fica na mesma posição.
+    """
+    sha256 = calcular_sha256(caminho)
+    manifesto = ler_manifesto()
+    entrada = {
+        "arquivo": caminho_no_registro(caminho),
+        "versao": versao or VERSOES_MODELOS_ENV.get(tipo) or sha256[:12],
+        "sha256": sha256
+    }
+    # Manifestos anteriores aos slots não têm histórico: a versão ativa até aqui é o ponto de rollback
+    anterior = manifesto["modelos"].get(tipo)
+    historico = manifesto.setdefault("historico", {}).get(tipo) or ([anterior] if anterior else [])
+    posicao = next((i for i, h in enumerate(historico) if h["versao"] == entrada["versao"]), None)
+    manifesto["modelos"][tipo] = entrada
+    if posicao is not None and not reordenar_historico:
+        historico[posicao] = entrada
+    else:
+        historico = [h for h in historico if h["versao"] != entrada["versao"]]
+        historico.append(entrada)
+    manifesto["historico"][tipo] = historico[-MODELOS_HISTORICO:]
+    mantidos = {h["arquivo"] for h in manifesto["historico"][tipo]}
+    for antigo in historico[:-MODELOS_HISTORICO]:
+        if antigo["arquivo"].startswith("slots/") and antigo["arquivo"] not in mantidos:
+            apagar_slot(tipo, antigo["arquivo"])
     
-    # URLs de download direto do Google Drive
+    # Escrita atômica para nunca deixar um manifesto pela metade
+    temporario = MANIFESTO_MODELOS.with_suffix(".json.tmp")
+    with open(temporario, 'w') as f:
+        json.dump(manifesto, f, indent=2)
+    os.replace(temporario, MANIFESTO_MODELOS)
+    
+    logger.info(f"🗂️ Modelo '{tipo}' registrado: {manifesto['modelos'][tipo]['versao']} ({sha256[:12]})")
+    return manifesto["modelos"][tipo]
+
+def modelo_registrado(tipo):
+    """
+    Retorna (caminho, entrada do manifesto) se o artefato registrado existe
+    localmente e o sha256 confere; caso contrário, None.
+    """
+    entrada = ler_manifesto()["modelos"].get(tipo)
+    if not entrada:
+        return None
+    
+    caminho = MODELS_DIR / entrada["arquivo"]
+    if not caminho.exists():
+        logger.warning(f"⚠️ Artefato registrado de '{tipo}' não encontrado: {caminho}")
+        return None
+    
+    with medir_fase(f"sha256_{tipo}"):
+        sha256 = calcular_sha256(caminho)
+    if sha256 != entrada.get("sha256"):
+        logger.warning(f"⚠️ sha256 de {caminho} não confere com o manifesto, ignorando o registro")
+        return None
+    
+    return caminho, entrada
+
+def obter_ou_registrar_modelo(tipo, caminho):
+    """Entrada do manifesto para um artefato local, registrando-o se ainda não estiver"""
+    registrado = modelo_registrado(tipo)
+    if registrado and registrado[0] == caminho:
+        return registrado[1]
+    return registrar_modelo(tipo, caminho)
+
+class ErroDownload(Exception):
+    """Falha de download que não adianta repetir (HTML no lugar do arquivo, tamanho ou sha256 errados)"""
+
+def id_google_drive(url):
+    """Extrai o ID do arquivo de uma URL do Google Drive (None se não for do Drive)"""
+    if "drive.google.com" not in url and "docs.google.com" not in url:
+        return None
+    for pattern in (r'/d/([a-zA-Z0-9-_]+)', r'id=([a-zA-Z0-9-_]+)', r'/file/d/([a-zA-Z0-9-_]+)'):
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+def resolver_google_drive(sessao, file_id):
+    """
+    Encontra uma URL do Google Drive que entrega o arquivo em si (e não a página
+    de aviso de vírus), usando o token de confirmação quando necessário.
+    """
     urls_download = [
         f"https://drive.google.com/uc?export=download&id={file_id}",
         f"https://drive.google.com/uc?id={file_id}&export=download",
@@ -89,58 +760,204 @@ async def baixar_google_drive_direto(file_id: str, destino: Path, descricao: str
     for i, url in enumerate(urls_download, 1):
         try:
             logger.info(f"🔄 Tentativa {i}: {url[:60]}...")
-            
-            session = requests.Session()
-            response = session.get(url, stream=True, allow_redirects=True)
-            
-            # Verifica se há redirecionamento para confirmação
-            if "confirm=" in response.url or "virus scan warning" in response.text.lower():
-                # Busca token de confirmação
-                for line in response.text.split('\n'):
-                    if 'confirm=' in line:
-                        token_match = re.search(r'confirm=([a-zA-Z0-9_-]+)', line)
-                        if token_match:
-                            confirm_token = token_match.group(1)
-                            confirm_url = f"{url}&confirm={confirm_token}"
-                            logger.info(f"🔄 Usando token de confirmação: {confirm_token[:10]}...")
-                            response = session.get(confirm_url, stream=True)
-                            break
-            
-            response.raise_for_status()
-            
-            # Verifica content-type
-            content_type = response.headers.get('content-type', '')
-            if 'text/html' in content_type and response.text and len(response.text) < 10000:
-                logger.warning(f"⚠️ Recebido HTML (provável erro): {len(response.text)} bytes")
-                continue
-            
-            # Salva o arquivo
-            with open(destino, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            # Verifica se o arquivo foi baixado corretamente
-            if destino.exists() and destino.stat().st_size > 10000:  # Pelo menos 10KB
-                logger.info(f"✅ Download bem-sucedido: {destino.stat().st_size} bytes")
-                return True
-            else:
-                logger.warning(f"⚠️ Arquivo muito pequeno: {destino.stat().st_size if destino.exists() else 0} bytes")
-                if destino.exists():
-                    destino.unlink()
-                    
+            with sessao.get(url, stream=True, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                if 'text/html' not in response.headers.get('content-type', ''):
+                    return url
+                
+                # Página de confirmação: busca o token (as páginas de erro são HTML pequeno)
+                pagina = response.text
+                token_match = re.search(r'confirm=([a-zA-Z0-9_-]+)', pagina)
+                if token_match:
+                    logger.info(f"🔄 Usando token de confirmação: {token_match.group(1)[:10]}...")
+                    return f"{url}&confirm={token_match.group(1)}"
+                logger.warning(f"⚠️ Recebido HTML (provável erro): {len(pagina)} bytes")
         except Exception as e:
             logger.warning(f"⚠️ Tentativa {i} falhou: {e}")
-            if destino.exists():
-                destino.unlink()
-            continue
     
-    return False
+    return None
+
+def sondar_download(sessao, url):
+    """
+    Pede só o primeiro byte para descobrir tamanho total e suporte a Range.
+    Retorna (tamanho ou None, aceita_range).
+    """
+    with sessao.get(url, headers={"Range": "bytes=0-0"}, stream=True, allow_redirects=True,
+                    timeout=DOWNLOAD_TIMEOUT) as resposta:
+        resposta.raise_for_status()
+        if 'text/html' in resposta.headers.get('content-type', ''):
+            raise ErroDownload("servidor respondeu HTML em vez do arquivo")
+        
+        if resposta.status_code == 206:
+            total = resposta.headers.get("content-range", "").rsplit("/", 1)[-1]
+            return (int(total) if total.isdigit() else None), True
+        
+        total = resposta.headers.get("content-length")
+        return (int(total) if total and total.isdigit() else None), False
+
+def ler_estado_download(caminho_estado, url, total):
+    """Progresso salvo de um download segmentado anterior do mesmo arquivo (ou None)"""
+    try:
+        with open(caminho_estado) as f:
+            estado = json.load(f)
+        if estado["url"] == url and estado["total"] == total:
+            return estado
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def baixar_segmentado(sessao, url, parcial, caminho_estado, total):
+    """
+    Baixa [0, total) em segmentos paralelos via HTTP Range, escrevendo cada um direto
+    na sua posição do .part. O progresso de cada segmento vai para um .json ao lado,
+    então tanto uma conexão caída quanto um restart retomam de onde pararam.
+    """
+    estado = ler_estado_download(caminho_estado, url, total) if parcial.exists() else None
+    if estado is None:
+        quantidade = max(1, min(DOWNLOAD_SEGMENTOS, int(total // (DOWNLOAD_SEGMENTO_MIN_MB * 1024 * 1024))))
+        limites = np.linspace(0, total, quantidade + 1, dtype=np.int64).tolist()
+        estado = {
+            "url": url,
+            "total": total,
+            "segmentos": [[inicio, fim - 1, 0] for inicio, fim in zip(limites[:-1], limites[1:])]
+        }
+        with open(parcial, 'wb') as f:
+            f.truncate(total)
+    else:
+        baixados = sum(s[2] for s in estado["segmentos"])
+        logger.info(f"⏯️ Retomando download: {baixados / 1024 / 1024:.1f} de {total / 1024 / 1024:.1f} MB já no disco")
+    
+    lock_estado = threading.Lock()
+    ultimo_salvamento = [0.0]
+    
+    def salvar_estado(forcar=False):
+        with lock_estado:
+            agora = time.monotonic()
+            if not forcar and agora - ultimo_salvamento[0] < 1:
+                return
+            ultimo_salvamento[0] = agora
+            temporario = caminho_estado.with_suffix(".tmp")
+            with open(temporario, 'w') as f:
+                json.dump(estado, f)
+            os.replace(temporario, caminho_estado)
+    
+    def registrar_progresso(f, segmento, posicao):
+        # Só avança o progresso salvo com os bytes já no disco: depois de um kill, o estado
+        # nunca aponta além do que o .part contém
+        f.flush()
+        os.fsync(f.fileno())
+        segmento[2] = posicao - segmento[0]
+        salvar_estado()
+    
+    def baixar_faixa(segmento):
+        inicio, fim, _ = segmento
+        sessao_segmento = requests.Session()
+        sessao_segmento.cookies.update(sessao.cookies)
+        
+        for tentativa in range(1, DOWNLOAD_TENTATIVAS + 1):
+            posicao = inicio + segmento[2]
+            if posicao > fim:
+                return
+            try:
+                with sessao_segmento.get(url, headers={"Range": f"bytes={posicao}-{fim}"}, stream=True,
+                                         timeout=DOWNLOAD_TIMEOUT) as resposta:
+                    if resposta.status_code != 206:
+                        raise ErroDownload(f"Range ignorado pelo servidor (HTTP {resposta.status_code})")
+                    with open(parcial, 'r+b', buffering=DOWNLOAD_BUFFER) as f:
+                        f.seek(posicao)
+                        ultimo_registro = time.monotonic()
+                        try:
+                            for bloco in resposta.iter_content(chunk_size=DOWNLOAD_BUFFER):
+                                f.write(bloco)
+                                posicao += len(bloco)
+                                if time.monotonic() - ultimo_registro >= 1:
+                                    registrar_progresso(f, segmento, posicao)
+                                    ultimo_registro = time.monotonic()
+                        finally:
+                            registrar_progresso(f, segmento, posicao)
+                if posicao > fim:
+                    return
+                raise IOError(f"conexão encerrada no byte {posicao} (segmento até {fim})")
+            except ErroDownload:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Segmento {inicio}-{fim}, tentativa {tentativa} falhou: {e}")
+                if tentativa < DOWNLOAD_TENTATIVAS:
+                    time.sleep(min(2 ** tentativa, 30))
+        
+        raise IOError(f"segmento {inicio}-{fim} falhou após {DOWNLOAD_TENTATIVAS} tentativas")
+    
+    try:
+        with ThreadPoolExecutor(max_workers=len(estado["segmentos"]), thread_name_prefix="download") as pool:
+            for futuro in [pool.submit(baixar_faixa, segmento) for segmento in estado["segmentos"]]:
+                futuro.result()
+    finally:
+        salvar_estado(forcar=True)
+    
+    caminho_estado.unlink()
+    return len(estado["segmentos"])
 
+def baixar_sequencial(sessao, url, parcial):
+    """Download em um único stream (servidor sem Range): cada tentativa recomeça do zero"""
+    for tentativa in range(1, DOWNLOAD_TENTATIVAS + 1):
+        try:
+            with sessao.get(url, stream=True, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT) as resposta:
+                resposta.raise_for_status()
+                with open(parcial, 'wb', buffering=DOWNLOAD_BUFFER) as f:
+                    for bloco in resposta.iter_content(chunk_size=DOWNLOAD_BUFFER):
+                        f.write(bloco)
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Download, tentativa {tentativa} falhou: {e}")
+            if tentativa == DOWNLOAD_TENTATIVAS:
+                raise
+            time.sleep(min(2 ** tentativa, 30))
 
+def baixar_arquivo_bloqueante(url, destino, sha256_esperado=""):
+    """
+    Baixa url para destino: .part (segmentado e retomável quando o servidor aceita
+    Range), confere tamanho e sha256 e só então renomeia atomicamente para destino.
+    """
+    sessao = requests.Session()
+    file_id = id_google_drive(url)
+    if file_id:
+        url = resolver_google_drive(sessao, file_id) or url
+    
+    parcial = destino.with_name(destino.name + ".part")
+    caminho_estado = destino.with_name(destino.name + ".part.json")
+    inicio = time.perf_counter()
+    
+    total, aceita_range = sondar_download(sessao, url)
+    if aceita_range and total:
+        segmentos = baixar_segmentado(sessao, url, parcial, caminho_estado, total)
+    else:
+        segmentos = 1
+        baixar_sequencial(sessao, url, parcial)
+    
+    tamanho = parcial.stat().st_size
+    if total is not None and tamanho != total:
+        parcial.unlink()
+        raise ErroDownload(f"tamanho {tamanho} difere do anunciado pelo servidor ({total})")
+    if tamanho < 1000:
+        parcial.unlink()
+        raise ErroDownload(f"arquivo muito pequeno: {tamanho} bytes")
+    
+    if sha256_esperado:
+        sha256 = calcular_sha256(parcial)
+        if sha256 != sha256_esperado:
+            parcial.unlink()
+            raise ErroDownload(f"sha256 {sha256[:12]} não confere com o esperado {sha256_esperado[:12]}")
+    
+    os.replace(parcial, destino)
+    
+    duracao = time.perf_counter() - inicio
+    logger.info(
+        f"✅ Download concluído: {tamanho / 1024 / 1024:.1f} MB em {duracao:.1f}s "
+        f"({segmentos} segmento(s){', sha256 verificado' if sha256_esperado else ''})"
+    )
 
-async def baixar_arquivo(url: str, destino: Path, descricao: str = "arquivo"):
-    """Baixa um arquivo de uma URL com estratégias múltiplas"""
+async def baixar_arquivo(url: str, destino: Path, descricao: str = "arquivo", sha256_esperado: str = ""):
+    """Baixa um arquivo em uma thread, sem bloquear o event loop (ver baixar_arquivo_bloqueante)"""
     if not url:
         raise ValueError(f"URL não configurada para {descricao}")
     
@@ -151,85 +968,97 @@ async def baixar_arquivo(url: str, destino: Path, descricao: str = "arquivo"):
     logger.info(f"📥 Baixando {descricao} de {url}")
     
     try:
-        # Extrai ID do Google Drive se necessário
-        file_id = None
-        if "drive.google.com" in url or "docs.google.com" in url:
-            patterns = [
-                r'/d/([a-zA-Z0-9-_]+)',
-                r'id=([a-zA-Z0-9-_]+)',
-                r'/file/d/([a-zA-Z0-9-_]+)'
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, url)
-                if match:
-                    file_id = match.group(1)
-                    break
-        
-        success = False
-        if file_id:
-            success = await baixar_google_drive_direto(file_id, destino, descricao)
-        
-        if not success:
-            # Fallback para download direto
-            response = requests.get(url, stream=True, allow_redirects=True)
-            response.raise_for_status()
-            
-            with open(destino, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            if destino.exists() and destino.stat().st_size > 1000:
-                success = True
-        
-        if success:
-            logger.info(f"✅ {descricao} baixado com sucesso: {destino}")
-        else:
-            raise Exception(f"Falha em todas as estratégias de download")
-        
+        await asyncio.to_thread(baixar_arquivo_bloqueante, url, destino, sha256_esperado)
+        logger.info(f"✅ {descricao} baixado com sucesso: {destino}")
     except Exception as e:
         logger.error(f"❌ Erro ao baixar {descricao}: {e}")
-        if destino.exists():
-            destino.unlink()  # Remove arquivo parcial
         raise
 
+async def baixar_modelos_pendentes():
+    """
+    Baixa em paralelo os modelos nativos que ainda não estão no disco, para os
+    downloads correrem junto com os imports dos frameworks. Falhas ficam a cargo
+    dos carregadores, que tentam de novo ou caem nos fallbacks.
+    """
+    if MODELOS_OFFLINE:
+        return
+    
+    pendentes = []
+    if BACKEND_CLASSIFICACAO == "nativo" and MODELO_CLASSIFICACAO_URL:
+        pendentes.append((MODELO_CLASSIFICACAO_URL, "classificacao", MODELO_CLASSIFICACAO_SHA256))
+    if BACKEND_YOLO == "nativo" and MODELO_YOLO_URL:
+        pendentes.append((MODELO_YOLO_URL, "yolo", MODELO_YOLO_SHA256))
+    
+    downloads = [
+        baixar_arquivo(url, MODELS_DIR / ARQUIVOS_MODELOS[tipo], f"modelo {tipo}", sha256)
+        for url, tipo, sha256 in pendentes
+        if not (MODELS_DIR / ARQUIVOS_MODELOS[tipo]).exists()
+    ]
+    if downloads:
+        with medir_fase("download_modelos"):
+            await asyncio.gather(*downloads, return_exceptions=True)
+
+
+def criar_classificador_mock():
+    """Cria um classificador simples para demonstração (mesmo formato de entrada/saída)"""
+    importar_tensorflow()
+    return tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(224, 224, 3)),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(len(LABEL_COLS), activation='softmax')
+    ])
+
 async def carregar_modelo_classificacao():
-    """Carrega o modelo de classificação"""
+    """Carrega o modelo de classificação (registro local primeiro, download só se necessário)"""
     global modelo_classificacao
     
     if modelo_classificacao is not None:
         return
     
-    modelo_path = MODELS_DIR / "modeloClassificacao.h5"
+    modelo_path = MODELS_DIR / ARQUIVOS_MODELOS["classificacao"]
     
-    try:
-        # Baixa o modelo se necessário
-        if MODELO_CLASSIFICACAO_URL:
-            await baixar_arquivo(MODELO_CLASSIFICACAO_URL, modelo_path, "modelo de classificação")
-        
-        if not modelo_path.exists():
-            logger.warning("⚠️ Modelo de classificação não encontrado. Usando modelo mockado.")
-            # Cria um modelo simples para demonstração
-            modelo_classificacao = tf.keras.Sequential([
-                tf.keras.layers.Input(shape=(224, 224, 3)),
-                tf.keras.layers.GlobalAveragePooling2D(),
-                tf.keras.layers.Dense(len(LABEL_COLS), activation='softmax')
-            ])
-            logger.info("✅ Modelo de classificação mockado criado")
+    if BACKEND_CLASSIFICACAO != "nativo":
+        try:
+            modelo_classificacao = await asyncio.to_thread(carregar_classificacao_exportada, BACKEND_CLASSIFICACAO)
             return
+        except Exception as e:
+            logger.warning(f"⚠️ Backend '{BACKEND_CLASSIFICACAO}' do classificador indisponível ({e}), usando o nativo")
+    
+    try:
+        await asyncio.to_thread(importar_tensorflow)
+        registrado = await asyncio.to_thread(modelo_registrado, "classificacao")
+        if registrado:
+            modelo_path, entrada = registrado
+            logger.info(f"🗂️ Modelo de classificação no registro local: {entrada['versao']}")
+        else:
+            # Baixa o modelo se necessário
+            if MODELO_CLASSIFICACAO_URL and not MODELOS_OFFLINE:
+                await baixar_arquivo(
+                    MODELO_CLASSIFICACAO_URL, modelo_path, "modelo de classificação", MODELO_CLASSIFICACAO_SHA256
+                )
+            
+            if not modelo_path.exists():
+                logger.warning("⚠️ Modelo de classificação não encontrado. Usando modelo mockado.")
+                # Cria um modelo simples para demonstração
+                modelo_classificacao = compilar_classificador(criar_classificador_mock())
+                versoes_modelos["classificacao"] = "mock"
+                logger.info("✅ Modelo de classificação mockado criado")
+                return
+            
+            entrada = await asyncio.to_thread(obter_ou_registrar_modelo, "classificacao", modelo_path)
         
         logger.info("📚 Carregando modelo de classificação...")
-        modelo_classificacao = tf.keras.models.load_model(str(modelo_path), compile=False)
+        with medir_fase("carga_classificacao"):
+            modelo = await asyncio.to_thread(tf.keras.models.load_model, str(modelo_path), compile=False)
+        modelo_classificacao = compilar_classificador(modelo)
+        versoes_modelos["classificacao"] = entrada["versao"]
         logger.info("✅ Modelo de classificação carregado com sucesso!")
         
     except Exception as e:
         logger.error(f"❌ Erro ao carregar modelo de classificação: {e}")
         # Fallback para modelo mockad
-        modelo_classificacao = tf.keras.Sequential([
-            tf.keras.layers.Input(shape=(224, 224, 3)),
-            tf.keras.layers.GlobalAveragePooling2D(),
-            tf.keras.layers.Dense(len(LABEL_COLS), activation='softmax')
-        ])
+        modelo_classificacao = compilar_classificador(criar_classificador_mock())
+        versoes_modelos["classificacao"] = "mock"
         logger.info("✅ Usando modelo de classificação mockado como fallback")
 
 async def carregar_modelo_yolo():
@@ -241,15 +1070,27 @@ async def carregar_modelo_yolo():
     
     logger.info("🎯 Iniciando carregamento do modelo YOLO...")
     
+    if BACKEND_YOLO != "nativo":
+        try:
+            with medir_fase("carga_yolo"):
+                modelo_yolo = await asyncio.to_thread(carregar_yolo_exportado, BACKEND_YOLO)
+            return
+        except Exception as e:
+            logger.warning(f"⚠️ Backend '{BACKEND_YOLO}' do YOLO indisponível ({e}), usando o nativo")
+    
+    await asyncio.to_thread(importar_torch)
+    
     # Lista de estratégias para carregar o YOLO
     estrategias = [
-        # 1. Tentar modelo customizado se disponível
+        # 1. Registro local (pacote pip yolov5, sem rede)
+        lambda: asyncio.to_thread(carregar_yolo_registro),
+        # 2. Tentar modelo customizado se disponível
         lambda: carregar_yolo_customizado(),
-        # 2. Usar YOLOv5s pré-treinado (fallback confiável)
-        lambda: carregar_yolo_pretrained('yolov5s'),
-        # 3. Usar YOLOv5n (mais leve)
-        lambda: carregar_yolo_pretrained('yolov5n'),
-        # 4. Último recurso: modelo mockado
+        # 3. Usar YOLOv5s pré-treinado (fallback confiável)
+        lambda: asyncio.to_thread(carregar_yolo_pretrained, 'yolov5s'),
+        # 4. Usar YOLOv5n (mais leve)
+        lambda: asyncio.to_thread(carregar_yolo_pretrained, 'yolov5n'),
+        # 5. Último recurso: modelo mockado
         lambda: carregar_yolo_mock()
     ]
     
@@ -259,17 +1100,17 @@ async def carregar_modelo_yolo():
             resultado = estrategia()
             
             # Se a estratégia retorna uma coroutine, aguarda
-            if hasattr(resultado, '__await__'):
-                modelo_yolo = await resultado
-            else:
-                modelo_yolo = resultado
+            with medir_fase("carga_yolo"):
+                if hasattr(resultado, '__await__'):
+                    resultado = await resultado
+            modelo_yolo = resultado
             
             if modelo_yolo is not None:
                 # Configura parâmetros
                 if hasattr(modelo_yolo, 'conf'):
-                    modelo_yolo.conf = 0.25
+                    modelo_yolo.conf = YOLO_CONF
                 if hasattr(modelo_yolo, 'iou'):
-                    modelo_yolo.iou = 0.45
+                    modelo_yolo.iou = YOLO_IOU
                 
                 logger.info(f"✅ Modelo YOLO carregado com sucesso na tentativa {i}!")
                 return
@@ -283,25 +1124,274 @@ async def carregar_modelo_yolo():
     # Cria modelo mockado para não quebrar a API
     modelo_yolo = carregar_yolo_mock()
 
+def nms_numpy(pred, conf_thres, iou_thres, classes=None, agnostic=False, max_det=1000):
+    """
+    NMS em NumPy para a saída crua do YOLOv5 (N, 5 + nc) no formato
+    [cx, cy, w, h, obj, cls...]. Retorna (n, 6) [x1, y1, x2, y2, conf, cls],
+    com a mesma lógica do non_max_suppression do yolov5 (single label).
+    """
+    x = pred[pred[:, 4] > conf_thres]
+    if not len(x):
+        return np.zeros((0, 6), dtype=np.float32)
+    
+    scores = x[:, 5:] * x[:, 4:5]
+    cls = scores.argmax(1)
+    conf = scores[np.arange(len(x)), cls]
+    manter = conf > conf_thres
+    if classes is not None:
+        manter &= np.isin(cls, classes)
+    x, cls, conf = x[manter], cls[manter], conf[manter]
+    if not len(x):
+        return np.zeros((0, 6), dtype=np.float32)
+    
+    boxes = np.empty((len(x), 4), dtype=np.float32)
+    boxes[:, :2] = x[:, :2] - x[:, 2:4] / 2
+    boxes[:, 2:] = x[:, :2] + x[:, 2:4] / 2
+    
+    mantidos = nms_caixas(boxes, conf, cls, iou_thres, agnostic=agnostic, max_det=max_det)
+    return np.concatenate([boxes[mantidos], conf[mantidos, None], cls[mantidos, None].astype(np.float32)], axis=1)
+
+def nms_caixas(boxes, conf, cls, iou_thres, ios_thres=None, agnostic=False, max_det=1000):
+    """
+    NMS guloso por classe sobre caixas xyxy; retorna os índices mantidos em ordem de confiança.
+    Com ios_thres, também suprime caixas cuja interseção cobre mais que ios_thres da menor
+    das duas (caixa cortada na borda de um tile contida na caixa inteira do tile vizinho).
+    """
+    # Desloca cada classe para uma região diferente, como o yolov5 (NMS por classe numa passada só)
+    deslocamento = 0 if agnostic else cls[:, None] * (float(boxes.max(initial=0)) + 7680.0)
+    deslocadas = boxes + deslocamento
+    areas = (deslocadas[:, 2] - deslocadas[:, 0]) * (deslocadas[:, 3] - deslocadas[:, 1])
+    ordem = np.argsort(-conf, kind="stable")[:30000]
+    
+    mantidos = []
+    while len(ordem) and len(mantidos) < max_det:
+        i = ordem[0]
+        mantidos.append(i)
+        resto = ordem[1:]
+        xx1 = np.maximum(deslocadas[i, 0], deslocadas[resto, 0])
+        yy1 = np.maximum(deslocadas[i, 1], deslocadas[resto, 1])
+        xx2 = np.minimum(deslocadas[i, 2], deslocadas[resto, 2])
+        yy2 = np.minimum(deslocadas[i, 3], deslocadas[resto, 3])
+        intersecao = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        suprimir = intersecao / (areas[i] + areas[resto] - intersecao + 1e-7) > iou_thres
+        if ios_thres is not None:
+            suprimir |= intersecao / (np.minimum(areas[i], areas[resto]) + 1e-7) > ios_thres
+        ordem = resto[~suprimir]
+    
+    return np.array(mantidos, dtype=np.int64)
+
+class BackendYoloExportado:
+    """
+    YOLOv5 exportado (ONNX Runtime ou TorchScript) com a mesma interface usada
+    pelo pipeline: atributos do AutoShape (names, conf, iou, ...) e inferir_lote().
+    """
+    
+    def __init__(self, caminho, tipo):
+        self.tipo = tipo
+        self.conf = YOLO_CONF
+        self.iou = YOLO_IOU
+        self.classes = None
+        self.agnostic = False
+        self.max_det = 1000
+        
+        if tipo in BACKENDS_ONNX:
+            import onnxruntime as ort
+            opcoes = ort.SessionOptions()
+            if ONNX_THREADS:
+                opcoes.intra_op_num_threads = ONNX_THREADS
+            self.sessao = ort.InferenceSession(str(caminho), opcoes, providers=["CPUExecutionProvider"])
+            self.entrada = self.sessao.get_inputs()[0].name
+            metadados = self.sessao.get_modelmeta().custom_metadata_map
+            self.names = ast.literal_eval(metadados.get("names", "{}"))
+        elif tipo == "torchscript":
+            importar_torch()
+            extras = {"config.txt": ""}
+            self.modelo = torch.jit.load(str(caminho), map_location="cpu", _extra_files=extras)
+            config = json.loads(extras["config.txt"] or "{}")
+            self.names = {int(k): v for k, v in config.get("names", {}).items()}
+        else:
+            raise ValueError(f"Backend de YOLO desconhecido: {tipo}")
+    
+    def inferir_lote(self, imagens, conf=None):
+        """Forward de um lote de imagens letterboxed (HWC uint8) + NMS (conf ou self.conf); retorna arrays (n, 6)"""
+        x = np.ascontiguousarray(np.stack(imagens).transpose(0, 3, 1, 2), dtype=np.float32)
+        x /= 255.0
+        
+        if self.tipo in BACKENDS_ONNX:
+            pred = self.sessao.run(None, {self.entrada: x})[0]
+        else:
+            with torch.inference_mode():
+                pred = self.modelo(torch.from_numpy(x))
+            pred = (pred[0] if isinstance(pred, (list, tuple)) else pred).numpy()
+        
+        h, w = imagens[0].shape[:2]
+        deteccoes = []
+        for p in pred:
+            det = nms_numpy(p, self.conf if conf is None else conf, self.iou, self.classes, self.agnostic, self.max_det)
+            det[:, [0, 2]] = det[:, [0, 2]].clip(0, w)
+            det[:, [1, 3]] = det[:, [1, 3]].clip(0, h)
+            deteccoes.append(det)
+        return deteccoes
+
+class BackendClassificacaoOnnx:
+    """Classificador exportado para ONNX com a mesma interface predict() do Keras"""
+    
+    def __init__(self, caminho):
+        import onnxruntime as ort
+        opcoes = ort.SessionOptions()
+        if ONNX_THREADS:
+            opcoes.intra_op_num_threads = ONNX_THREADS
+        self.sessao = ort.InferenceSession(str(caminho), opcoes, providers=["CPUExecutionProvider"])
+        self.entrada = self.sessao.get_inputs()[0].name
+    
+    def predict(self, x, batch_size=None, verbose=0):
+        return self.sessao.run(None, {self.entrada: np.asarray(x, dtype=np.float32)})[0]
+
+class ClassificadorCompilado:
+    """
+    Classificador Keras servido por um tf.function em vez do predict() (que monta um
+    data adapter e uma step function a cada chamada). Cada lote é preenchido com zeros
+    até o menor bucket que o comporta, então só existem len(buckets) grafos, todos
+    traçados em aquecer(). Mesma interface predict() do Keras; demais atributos vêm do modelo.
+    """
+    
+    def __init__(self, modelo, buckets):
+        self.modelo = modelo
+        maior = max(1, CLASSIFICACAO_MAX_BATCH)
+        self.buckets = sorted({b for b in buckets if 0 < b < maior} | {maior})
+        self.forma = tuple(modelo.input_shape[1:])
+        self.tracings = 0
+        self.aquecido = False
+        self._funcao = tf.function(self._forward)
+    
+    def _forward(self, x):
+        # O corpo Python só roda quando o tf.function traça um grafo novo
+        self.tracings += 1
+        METRICA_COMPILACOES.labels("classificacao").inc()
+        if self.aquecido:
+            logger.warning(f"⚠️ Classificador retraçado em produção para o shape {x.shape}")
+        return self.modelo(x, training=False)
+    
+    def __getattr__(self, nome):
+        if nome == "modelo":
+            raise AttributeError(nome)
+        return getattr(self.modelo, nome)
+    
+    def aquecer(self):
+        """Traça o grafo de cada bucket; se falhar, cai no predict() do Keras"""
+        # Um shape novo por bucket é o esperado aqui: silencia o aviso de retracing do TF
+        nivel = tf.get_logger().level
+        tf.get_logger().setLevel(logging.ERROR)
+        try:
+            for bucket in self.buckets:
+                self._funcao(tf.zeros((bucket, *self.forma), dtype=tf.float32))
+            self.aquecido = True
+            logger.info(f"🔥 Classificador compilado para os lotes {self.buckets} ({self.tracings} grafos)")
+        except Exception as e:
+            logger.warning(f"⚠️ tf.function do classificador falhou ({e}), usando predict() do Keras")
+            self._funcao = None
+        finally:
+            tf.get_logger().setLevel(nivel)
+    
+    def predict(self, x, batch_size=None, verbose=0):
+        if self._funcao is None:
+            return self.modelo.predict(x, batch_size=batch_size, verbose=verbose)
+        
+        x = np.asarray(x, dtype=np.float32)
+        maior = self.buckets[-1]
+        saidas = []
+        for inicio in range(0, len(x), maior):
+            bloco = x[inicio:inicio + maior]
+            n = len(bloco)
+            bucket = next(b for b in self.buckets if b >= n)
+            if bucket != n:
+                preenchido = np.zeros((bucket, *bloco.shape[1:]), dtype=np.float32)
+                preenchido[:n] = bloco
+                bloco = preenchido
+            saidas.append(self._funcao(tf.convert_to_tensor(bloco)).numpy()[:n])
+        return np.concatenate(saidas, axis=0)
+    
+    def estatisticas(self):
+        return {"compilado": self._funcao is not None, "buckets": self.buckets, "tracings": self.tracings}
+
+def compilar_classificador(modelo):
+    """Envolve o classificador Keras no ClassificadorCompilado (se CLASSIFICACAO_COMPILADA)"""
+    if not CLASSIFICACAO_COMPILADA:
+        return modelo
+    return ClassificadorCompilado(modelo, CLASSIFICACAO_BUCKETS)
+
+def carregar_yolo_exportado(backend):
+    """Carrega o YOLO exportado (registro local) para o backend escolhido"""
+    tipo = f"yolo_{backend}"
+    registrado = modelo_registrado(tipo)
+    if not registrado:
+        raise ValueError(f"'{ARQUIVOS_MODELOS.get(tipo, tipo)}' não está no registro; rode exportar_modelos.py")
+    
+    modelo_path, entrada = registrado
+    modelo = BackendYoloExportado(modelo_path, backend)
+    versoes_modelos["yolo"] = entrada["versao"]
+    logger.info(f"✅ Modelo YOLO carregado com backend {backend}: {entrada['versao']}")
+    return modelo
+
+def carregar_classificacao_exportada(backend):
+    """Carrega o classificador exportado (registro local) para o backend escolhido"""
+    tipo = f"classificacao_{backend}"
+    registrado = modelo_registrado(tipo)
+    if not registrado:
+        raise ValueError(f"'{ARQUIVOS_MODELOS.get(tipo, tipo)}' não está no registro; rode exportar_modelos.py")
+    
+    modelo_path, entrada = registrado
+    with medir_fase("carga_classificacao"):
+        modelo = BackendClassificacaoOnnx(modelo_path)
+    versoes_modelos["classificacao"] = entrada["versao"]
+    logger.info(f"✅ Modelo de classificação carregado com backend {backend}: {entrada['versao']}")
+    return modelo
+
+def carregar_yolo_local(modelo_path):
+    """Carrega o YOLOv5 do disco pelo pacote pip yolov5 (sem torch.hub, sem rede)"""
+    import yolov5
+    return yolov5.load(str(Path(modelo_path).resolve()), device='cpu')
+
+def carregar_yolo_registro():
+    """Carrega o YOLO registrado no manifesto local, se presente e íntegro"""
+    registrado = modelo_registrado("yolo")
+    if not registrado:
+        raise ValueError("Modelo YOLO não está no registro local")
+    
+    modelo_path, entrada = registrado
+    logger.info(f"🗂️ Modelo YOLO no registro local: {entrada['versao']}")
+    modelo = carregar_yolo_local(modelo_path)
+    versoes_modelos["yolo"] = entrada["versao"]
+    return modelo
+
 async def carregar_yolo_customizado():
     """Tenta carregar modelo YOLO customizado"""
-    if not MODELO_YOLO_URL:
-        raise ValueError("URL do modelo customizado não configurada")
+    modelo_path = MODELS_DIR / ARQUIVOS_MODELOS["yolo"]
     
-    modelo_path = MODELS_DIR / "bestYolov5_test.pt"
-    await baixar_arquivo(MODELO_YOLO_URL, modelo_path, "modelo YOLO customizado")
+    if not modelo_path.exists():
+        if not MODELO_YOLO_URL:
+            raise ValueError("URL do modelo customizado não configurada")
+        if MODELOS_OFFLINE:
+            raise ValueError("Modo offline: download do modelo customizado desativado")
+        await baixar_arquivo(MODELO_YOLO_URL, modelo_path, "modelo YOLO customizado", MODELO_YOLO_SHA256)
     
-    # Múltiplas tentativas de carregamento
-    tentativas = [
-        lambda: torch.hub.load('ultralytics/yolov5', 'custom', path=str(modelo_path), trust_repo=True),
-        lambda: torch.hub.load('ultralytics/yolov5', 'custom', path=str(modelo_path.resolve()), force_reload=True),
-        lambda: carregar_yolo_torch_direto(modelo_path)
-    ]
+    entrada = await asyncio.to_thread(obter_ou_registrar_modelo, "yolo", modelo_path)
+    
+    # Múltiplas tentativas de carregamento (pacote pip primeiro; torch.hub acessa o GitHub)
+    tentativas = [lambda: carregar_yolo_local(modelo_path)]
+    if not MODELOS_OFFLINE:
+        tentativas += [
+            lambda: torch.hub.load('ultralytics/yolov5', 'custom', path=str(modelo_path), trust_repo=True),
+            lambda: torch.hub.load('ultralytics/yolov5', 'custom', path=str(modelo_path.resolve()), force_reload=True)
+        ]
+    tentativas.append(lambda: carregar_yolo_torch_direto(modelo_path))
     
     for i, tentativa in enumerate(tentativas, 1):
         try:
-            logger.info(f"🔧 Tentativa de carregamento customizado {i}/3...")
-            return tentativa()
+            logger.info(f"🔧 Tentativa de carregamento customizado {i}/{len(tentativas)}...")
+            modelo = await asyncio.to_thread(tentativa)
+            versoes_modelos["yolo"] = entrada["versao"]
+            return modelo
         except Exception as e:
             logger.warning(f"Tentativa de carregamento customizado {i} falhou: {e}")
             continue
@@ -310,10 +1400,14 @@ async def carregar_yolo_customizado():
 
 def carregar_yolo_pretrained(model_name):
     """Carrega modelo YOLO pré-treinado"""
+    if MODELOS_OFFLINE:
+        raise ValueError("Modo offline: torch.hub desativado")
+    
     logger.info(f"📦 Carregando modelo pré-treinado: {model_name}")
     
     try:
         modelo = torch.hub.load('ultralytics/yolov5', model_name, pretrained=True, trust_repo=True)
+        versoes_modelos["yolo"] = model_name
         logger.info(f"✅ Modelo {model_name} carregado com sucesso")
         return modelo
     except Exception as e:
@@ -323,6 +1417,7 @@ def carregar_yolo_pretrained(model_name):
 def carregar_yolo_mock():
     """Cria um modelo YOLO mockado para demonstração"""
     logger.warning("🔧 Criando modelo YOLO mockado...")
+    versoes_modelos["yolo"] = "mock"
     
     class YOLOMock:
         def __init__(self):
@@ -331,11 +1426,11 @@ def carregar_yolo_mock():
             self.iou = 0.45
         
         def __call__(self, img):
-            # Retorna detecções vazias mas com estrutura correta
+            # Retorna detecções vazias mas com estrutura correta (uma por imagem do lote)
             class MockResult:
-                def __init__(self):
-                    self.xyxy = [torch.tensor([])]
-            return MockResult()
+                def __init__(self, n):
+                    self.xyxy = [np.zeros((0, 6), dtype=np.float32) for _ in range(n)]
+            return MockResult(len(img) if isinstance(img, list) else 1)
     
     return YOLOMock()
 
@@ -361,73 +1456,1194 @@ def carregar_yolo_torch_direto(modelo_path):
     else:
         raise Exception("Checkpoint não contém 'model'")
 
-@app.on_event("startup")
-async def startup_event():
-    """Carrega os modelos na inicialização"""
-    logger.info("🚀 Iniciando API de IA Médica...")
-    
+def _executar_contando(funcao, *args):
+    """Executa funcao em uma thread do executor mantendo a contagem de tarefas ativas"""
+    global inferencia_em_execucao
+    # Esperou na fila do executor: se o cliente já desistiu, não vale mais a pena executar
+    verificar_prazo(funcao.__name__)
+    with _lock_inferencia:
+        inferencia_em_execucao += 1
+    sessao = sessao_perfil
     try:
-        # Carrega os modelos em paralelo
-        results = await asyncio.gather(
-            carregar_modelo_classificacao(),
-            carregar_modelo_yolo(),
-            return_exceptions=True
-        )
-        
-        # Verifica se houve erros
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"❌ Erro ao carregar modelo {i}: {result}")
-        
-        logger.info("✅ API inicializada com sucesso!")
-        
-    except Exception as e:
-        logger.error(f"❌ Erro na inicialização: {e}")
-        # API ainda pode funcionar com modelos mockados
+        with sessao.perfilar_thread() if sessao is not None else nullcontext():
+            return funcao(*args)
+    finally:
+        with _lock_inferencia:
+            inferencia_em_execucao -= 1
 
-def processar_deteccoes_yolo(results):
+async def executar_inferencia(funcao, *args):
+    """Executa uma função bloqueante no executor de inferência, fora do event loop"""
+    loop = asyncio.get_running_loop()
+    # Copia o contexto para as métricas da thread saberem o endpoint da requisição
+    contexto = contextvars.copy_context()
+    return await loop.run_in_executor(executor_inferencia, contexto.run, _executar_contando, funcao, *args)
+
+def exigir_modelos_prontos():
+    """503 + Retry-After enquanto os modelos não estão carregados, compilados e aquecidos"""
+    if not modelos_prontos:
+        detalhe = ("Inicialização dos modelos falhou" if erro_inicializacao is not None
+                   else "Modelos ainda inicializando, tente novamente em instantes")
+        raise HTTPException(status_code=503, detail=detalhe, headers={"Retry-After": str(INICIALIZACAO_RETRY_AFTER)})
+
+async def admitir_inferencia():
+    """
+    Dependência de controle de admissão dos endpoints de predição.
+    Rejeita rapidamente com 503 + Retry-After antes dos modelos ficarem prontos ou quando a fila está cheia.
+    """
+    global inferencia_admitidas, inferencia_rejeitadas
+    
+    exigir_modelos_prontos()
+    if inferencia_admitidas >= INFERENCIA_WORKERS + INFERENCIA_FILA_MAX:
+        inferencia_rejeitadas += 1
+        logger.warning(f"⚠️ Fila de inferência cheia ({inferencia_admitidas}), rejeitando requisição")
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": str(INFERENCIA_RETRY_AFTER)}
+        )
+    
+    inferencia_admitidas += 1
+    try:
+        yield
+    finally:
+        inferencia_admitidas -= 1
+
+class RequisicaoAbandonada(HTTPException):
+    """Prazo do cliente vencido (504) ou cliente desconectado (499): o trabalho restante é descartado"""
+    
+    def __init__(self, motivo):
+        if motivo == "prazo":
+            super().__init__(status_code=504, detail="Prazo da requisição esgotado")
+        else:
+            super().__init__(status_code=499, detail="Cliente desconectado")
+        self.motivo = motivo
+
+class ControlePrazo:
+    """Prazo (monotônico) e desconexão de uma requisição, consultados também nas threads do executor"""
+    
+    def __init__(self, endpoint, prazo=None):
+        self.endpoint = endpoint
+        self.prazo = prazo
+        self.desconectado = threading.Event()
+    
+    def motivo(self):
+        """'desconexao', 'prazo' ou None se a requisição ainda vale"""
+        if self.desconectado.is_set():
+            return "desconexao"
+        if self.prazo is not None and time.monotonic() >= self.prazo:
+            return "prazo"
+        return None
+
+controle_prazo = contextvars.ContextVar("controle_prazo", default=None)
+
+def abandonar_requisicao(controle, motivo, etapa):
+    """Contabiliza o descarte e devolve a exceção a levantar"""
+    with _lock_inferencia:
+        por_etapa = requisicoes_abandonadas[motivo]
+        por_etapa[etapa] = por_etapa.get(etapa, 0) + 1
+    METRICA_ABANDONADAS.labels(controle.endpoint, motivo, etapa).inc()
+    logger.info(f"🗑️ Requisição {controle.endpoint} descartada em '{etapa}' ({motivo})")
+    return RequisicaoAbandonada(motivo)
+
+def verificar_prazo(etapa, controle=None):
+    """Levanta RequisicaoAbandonada se o prazo venceu ou o cliente foi embora (no-op sem controle)"""
+    controle = controle or controle_prazo.get()
+    if controle is None:
+        return
+    motivo = controle.motivo()
+    if motivo is not None:
+        raise abandonar_requisicao(controle, motivo, etapa)
+
+async def vigiar_desconexao(request, controle):
+    """Marca o controle quando o cliente fecha a conexão (o corpo já foi lido pelo FastAPI)"""
+    while True:
+        mensagem = await request.receive()
+        if mensagem["type"] == "http.disconnect":
+            controle.desconectado.set()
+            return
+
+async def controlar_prazo(request: Request):
+    """
+    Dependência dos endpoints de predição: lê o prazo do cabeçalho PRAZO_HEADER (ms restantes
+    no cliente), descarta na hora requisições que já chegam vencidas e vigia a desconexão.
+    O controle segue por contextvar até o executor e os agendadores de lote.
+    """
+    valor = request.headers.get(PRAZO_HEADER)
+    try:
+        prazo_ms = float(valor) if valor is not None else PRAZO_PADRAO_MS or None
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{PRAZO_HEADER} deve ser um número de milissegundos")
+    
+    chegada = getattr(request.state, "chegada", time.monotonic())
+    controle = ControlePrazo(endpoint_atual.get(), chegada + prazo_ms / 1000 if prazo_ms is not None else None)
+    verificar_prazo("admissao", controle)
+    
+    token = controle_prazo.set(controle)
+    vigia = asyncio.create_task(vigiar_desconexao(request, controle))
+    try:
+        yield controle
+    finally:
+        vigia.cancel()
+        controle_prazo.reset(token)
+
+def estatisticas_inferencia():
+    em_execucao = inferencia_em_execucao
+    return {
+        "workers": INFERENCIA_WORKERS,
+        "em_execucao": em_execucao,
+        "fila": max(0, inferencia_admitidas - em_execucao),
+        "fila_max": INFERENCIA_FILA_MAX,
+        "admitidas": inferencia_admitidas,
+        "rejeitadas": inferencia_rejeitadas,
+        "abandonadas": {motivo: dict(por_etapa) for motivo, por_etapa in requisicoes_abandonadas.items()},
+        "ocupado": inferencia_admitidas >= INFERENCIA_WORKERS + INFERENCIA_FILA_MAX
+    }
+
+class CacheLRU:
+    """
+    Cache LRU em memória limitado por bytes e por tempo de vida (TTL).
+    Seguro para uso a partir do event loop e das threads do executor.
+    """
+    
+    def __init__(self, nome, max_bytes, ttl, tamanho=None):
+        self.nome = nome
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.tamanho = tamanho or (lambda valor: getattr(valor, 'nbytes', 0))
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_usados = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirados = 0
+    
+    def _remover(self, chave):
+        _, tamanho, _ = self._itens.pop(chave)
+        self.bytes_usados -= tamanho
+    
+    def adicionar(self, chave, valor):
+        tamanho = self.tamanho(valor)
+        if tamanho > self.max_bytes:
+            return False
+        
+        with self._lock:
+            if chave in self._itens:
+                self._remover(chave)
+            self._itens[chave] = (valor, tamanho, time.monotonic() + self.ttl)
+            self.bytes_usados += tamanho
+            
+            # Descarta os menos usados até caber no orçamento de bytes
+            while self.bytes_usados > self.max_bytes:
+                self._remover(next(iter(self._itens)))
+                self.evictions += 1
+        return True
+    
+    def obter(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.misses += 1
+                return None
+            
+            valor, _, expira_em = item
+            if time.monotonic() > expira_em:
+                self._remover(chave)
+                self.expirados += 1
+                self.misses += 1
+                return None
+            
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return valor
+    
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self.bytes_usados = 0
+    
+    def estatisticas(self):
+        return {
+            "itens": len(self._itens),
+            "bytes": self.bytes_usados,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirados": self.expirados
+        }
+
+cache_imagens = CacheLRU("imagens", int(CACHE_IMAGENS_MAX_MB * 1024 * 1024), CACHE_IMAGENS_TTL)
+
+def armazenar_imagem_sessao(img, image_id=None):
+    """Guarda o RGB decodificado da imagem no cache de sessão e retorna seu image_id"""
+    image_id = image_id or uuid.uuid4().hex
+    cache_imagens.adicionar(image_id, np.asarray(img))
+    return image_id
+
+class CacheResultados:
+    """
+    Cache das respostas de inferência em dois níveis: CacheLRU em memória e,
+    opcionalmente, uma tabela SQLite (WAL, segura entre processos).
+    Os valores são guardados como texto JSON (tamanho exato e imutáveis para quem lê).
+    Cada entrada registra as versões dos modelos que a produziram, para ser
+    descartada quando outro modelo for carregado.
+    """
+    
+    LIMPEZA_A_CADA = 200  # escritas entre remoções das linhas expiradas do SQLite
+    
+    def __init__(self, max_bytes, ttl, caminho_sqlite=""):
+        self.ttl = ttl
+        self.memoria = CacheLRU("resultados", max_bytes, ttl, tamanho=len)
+        self.caminho_sqlite = caminho_sqlite if max_bytes > 0 else ""
+        self._conexao = None
+        self._pid_conexao = None
+        self._lock = threading.Lock()
+        self._escritas = 0
+        self.hits_disco = 0
+        
+        if self.caminho_sqlite:
+            logger.info(f"🗄️ Cache de resultados em disco: {self.caminho_sqlite}")
+    
+    def _conectar(self):
+        """Conexão SQLite do processo atual (aberta sob demanda: não pode atravessar o fork do servir.py)"""
+        if self._conexao is None or self._pid_conexao != os.getpid():
+            Path(self.caminho_sqlite).parent.mkdir(parents=True, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho_sqlite, check_same_thread=False, timeout=5, isolation_level=None)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS resultados ("
+                " chave TEXT PRIMARY KEY, versao_yolo TEXT, versao_classificacao TEXT,"
+                " expira_em REAL NOT NULL, valor TEXT NOT NULL)"
+            )
+            self._conexao, self._pid_conexao = conexao, os.getpid()
+        return self._conexao
+    
+    def obter(self, chave):
+        """Retorna (valor, nível) do cache - nível "memoria" ou "disco" - ou (None, None)"""
+        texto = self.memoria.obter(chave)
+        if texto is not None:
+            return json.loads(texto), "memoria"
+        if not self.caminho_sqlite:
+            return None, None
+        
+        try:
+            with self._lock:
+                linha = self._conectar().execute(
+                    "SELECT valor FROM resultados WHERE chave = ? AND expira_em > ?", (chave, time.time())
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"⚠️ Falha ao ler o cache de resultados em disco: {e}")
+            return None, None
+        if linha is None:
+            return None, None
+        
+        self.hits_disco += 1
+        self.memoria.adicionar(chave, linha[0])
+        return json.loads(linha[0]), "disco"
+    
+    def adicionar(self, chave, valor, versoes):
+        texto = json.dumps(valor, separators=(",", ":"))
+        self.memoria.adicionar(chave, texto)
+        
+        # Modelos mockados têm pesos aleatórios por processo: não valem entre restarts
+        if not self.caminho_sqlite or "mock" in versoes.values():
+            return
+        try:
+            with self._lock:
+                conexao = self._conectar()
+                conexao.execute(
+                    "INSERT OR REPLACE INTO resultados VALUES (?, ?, ?, ?, ?)",
+                    (chave, versoes.get("yolo"), versoes.get("classificacao"), time.time() + self.ttl, texto)
+                )
+                self._escritas += 1
+                if self._escritas % self.LIMPEZA_A_CADA == 0:
+                    conexao.execute("DELETE FROM resultados WHERE expira_em <= ?", (time.time(),))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"⚠️ Falha ao gravar o cache de resultados em disco: {e}")
+    
+    def invalidar(self, tipo, versao):
+        """Descarta os resultados produzidos por qualquer versão de `tipo` diferente de `versao`"""
+        self.memoria.limpar()
+        if not self.caminho_sqlite:
+            return
+        try:
+            with self._lock:
+                removidas = self._conectar().execute(
+                    f"DELETE FROM resultados WHERE versao_{tipo} IS NOT NULL AND versao_{tipo} IS NOT ?",
+                    (versao,)
+                ).rowcount
+            if removidas:
+                logger.info(f"🧹 {removidas} resultados de outras versões de '{tipo}' removidos do cache em disco")
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"⚠️ Falha ao invalidar o cache de resultados em disco: {e}")
+    
+    def estatisticas(self):
+        return {**self.memoria.estatisticas(), "hits_disco": self.hits_disco, "disco": bool(self.caminho_sqlite)}
+
+cache_resultados = CacheResultados(
+    int(CACHE_RESULTADOS_MAX_MB * 1024 * 1024), CACHE_RESULTADOS_TTL, CACHE_RESULTADOS_SQLITE
+)
+
+def _chave_resultado(endpoint, entrada, modelos, parametros):
+    """sha256 de endpoint + conteúdo da entrada + versão/backend dos modelos + parâmetros"""
+    descricao = json.dumps({
+        "endpoint": endpoint,
+        "entrada": hashlib.sha256(entrada).hexdigest() if isinstance(entrada, bytes) else entrada,
+        "modelos": {tipo: versoes_modelos[tipo] for tipo in modelos},
+        "backends": {"yolo": BACKEND_YOLO, "classificacao": BACKEND_CLASSIFICACAO},
+        "parametros": parametros
+    }, sort_keys=True)
+    return hashlib.sha256(descricao.encode()).hexdigest()
+
+async def chave_resultado(endpoint, entrada, modelos, **parametros):
+    """
+    Chave do cache de resultados para a requisição, ou None se o cache estiver
+    desligado ou algum dos modelos ainda não tiver versão. O hash dos bytes
+    enviados roda fora do event loop.
+    """
+    if CACHE_RESULTADOS_MAX_MB <= 0 or any(versoes_modelos[tipo] is None for tipo in modelos):
+        return None
+    with medir_etapa("chave_cache"):
+        return await asyncio.to_thread(_chave_resultado, endpoint, entrada, modelos, parametros)
+
+async def consultar_cache_resultados(chave):
+    """Resultado cacheado para a chave (ou None), contando hit/miss por endpoint"""
+    if chave is None:
+        return None
+    if not cache_resultados.caminho_sqlite:
+        valor, nivel = cache_resultados.obter(chave)
+    else:
+        valor, nivel = await asyncio.to_thread(cache_resultados.obter, chave)
+    METRICA_CACHE_RESULTADOS.labels(endpoint_atual.get(), f"hit_{nivel}" if nivel else "miss").inc()
+    return valor
+
+async def guardar_cache_resultados(chave, valor, modelos):
+    """Guarda o resultado de uma inferência no cache (erros de gravação só são logados)"""
+    if chave is None:
+        return
+    versoes = {tipo: versoes_modelos[tipo] for tipo in modelos}
+    try:
+        if not cache_resultados.caminho_sqlite:
+            cache_resultados.adicionar(chave, valor, versoes)
+        else:
+            await asyncio.to_thread(cache_resultados.adicionar, chave, valor, versoes)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"⚠️ Resultado não serializável, fora do cache: {e}")
+
+class FilaJobs:
+    """
+    Fila persistente dos jobs assíncronos em SQLite (WAL). Cada job guarda a entrada
+    (bytes da imagem, descartados ao terminar), os parâmetros e, ao final, o resultado
+    em JSON ou o erro. A reserva é atômica (BEGIN IMMEDIATE), então vários processos
+    podem consumir a mesma fila sem executar um job duas vezes.
+    Status: pendente -> executando -> concluido | erro.
+    """
+    
+    def __init__(self, caminho, ttl=JOBS_TTL, max_pendentes=JOBS_MAX_PENDENTES):
+        self.caminho = caminho
+        self.ttl = ttl
+        self.max_pendentes = max_pendentes
+        self._conexao = None
+        self._pid_conexao = None
+        self._lock = threading.Lock()
+    
+    def _conectar(self):
+        """Conexão SQLite do processo atual (aberta sob demanda: não pode atravessar o fork do servir.py)"""
+        if self._conexao is None or self._pid_conexao != os.getpid():
+            Path(self.caminho).parent.mkdir(parents=True, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, check_same_thread=False, timeout=5, isolation_level=None)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, chave TEXT NOT NULL, tipo TEXT NOT NULL, parametros TEXT NOT NULL,"
+                " entrada BLOB, status TEXT NOT NULL, resultado TEXT, erro TEXT, status_http INTEGER,"
+                " tentativas INTEGER NOT NULL DEFAULT 0, criado_em REAL NOT NULL, iniciado_em REAL,"
+                " atualizado_em REAL NOT NULL, concluido_em REAL)"
+            )
+            conexao.execute("CREATE INDEX IF NOT EXISTS jobs_chave ON jobs (chave, status)")
+            conexao.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            self._conexao, self._pid_conexao = conexao, os.getpid()
+        return self._conexao
+    
+    @contextmanager
+    def _transacao(self):
+        """Transação de escrita exclusiva entre processos (BEGIN IMMEDIATE)"""
+        with self._lock:
+            conexao = self._conectar()
+            conexao.execute("BEGIN IMMEDIATE")
+            try:
+                yield conexao
+            except BaseException:
+                conexao.execute("ROLLBACK")
+                raise
+            conexao.execute("COMMIT")
+    
+    def enfileirar(self, chave, tipo, parametros, entrada):
+        """
+        Cria o job e retorna (id, duplicado). Um job com a mesma chave ainda pendente,
+        executando ou concluído (e não expirado) é reaproveitado em vez de criar outro.
+        Levanta 503 se a fila já tiver max_pendentes jobs esperando.
+        """
+        agora = time.time()
+        with self._transacao() as conexao:
+            existente = conexao.execute(
+                "SELECT id FROM jobs WHERE chave = ? AND status IN ('pendente', 'executando', 'concluido')"
+                " AND (concluido_em IS NULL OR concluido_em > ?) ORDER BY rowid DESC LIMIT 1",
+                (chave, agora - self.ttl)
+            ).fetchone()
+            if existente is not None:
+                return existente[0], True
+            
+            pendentes = conexao.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pendente'").fetchone()[0]
+            if pendentes >= self.max_pendentes:
+                raise HTTPException(
+                    status_code=503, detail=f"Fila de jobs cheia ({pendentes} pendentes), tente novamente",
+                    headers={"Retry-After": str(INFERENCIA_RETRY_AFTER)}
+                )
+            
+            job_id = uuid.uuid4().hex
+            conexao.execute(
+                "INSERT INTO jobs (id, chave, tipo, parametros, entrada, status, criado_em, atualizado_em)"
+                " VALUES (?, ?, ?, ?, ?, 'pendente', ?, ?)",
+                (job_id, chave, tipo, json.dumps(parametros), entrada, agora, agora)
+            )
+        return job_id, False
+    
+    def reservar(self):
+        """Marca o job pendente mais antigo como executando e retorna (id, tipo, parametros, entrada), ou None"""
+        agora = time.time()
+        with self._transacao() as conexao:
+            linha = conexao.execute(
+                "SELECT id, tipo, parametros, entrada FROM jobs WHERE status = 'pendente' ORDER BY rowid LIMIT 1"
+            ).fetchone()
+            if linha is None:
+                return None
+            conexao.execute(
+                "UPDATE jobs SET status = 'executando', tentativas = tentativas + 1,"
+                " iniciado_em = ?, atualizado_em = ? WHERE id = ?",
+                (agora, agora, linha[0])
+            )
+        job_id, tipo, parametros, entrada = linha
+        return job_id, tipo, json.loads(parametros), entrada
+    
+    def bater(self, job_id):
+        """Batimento do job em execução: prova que o processo que o reservou continua vivo"""
+        with self._lock:
+            self._conectar().execute(
+                "UPDATE jobs SET atualizado_em = ? WHERE id = ? AND status = 'executando'", (time.time(), job_id)
+            )
+    
+    def concluir(self, job_id, resultado):
+        agora = time.time()
+        with self._lock:
+            self._conectar().execute(
+                "UPDATE jobs SET status = 'concluido', resultado = ?, entrada = NULL,"
+                " atualizado_em = ?, concluido_em = ? WHERE id = ?",
+                (json.dumps(resultado, separators=(",", ":")), agora, agora, job_id)
+            )
+    
+    def falhar(self, job_id, erro, status_http=500):
+        agora = time.time()
+        with self._lock:
+            self._conectar().execute(
+                "UPDATE jobs SET status = 'erro', erro = ?, status_http = ?, entrada = NULL,"
+                " atualizado_em = ?, concluido_em = ? WHERE id = ?",
+                (str(erro), status_http, agora, agora, job_id)
+            )
+    
+    def devolver(self, job_id):
+        """Job interrompido pelo encerramento do processo volta para a fila sem gastar tentativa"""
+        with self._lock:
+            self._conectar().execute(
+                "UPDATE jobs SET status = 'pendente', tentativas = tentativas - 1, atualizado_em = ?"
+                " WHERE id = ? AND status = 'executando'",
+                (time.time(), job_id)
+            )
+    
+    def recuperar_orfaos(self, orfao=JOBS_ORFAO, max_tentativas=JOBS_MAX_TENTATIVAS):
+        """
+        Jobs executando sem batimento há `orfao` segundos (processo morto no meio) voltam
+        para a fila; os que já esgotaram as tentativas terminam em erro.
+        Retorna (reenfileirados, desistidos).
+        """
+        agora = time.time()
+        limite = agora - orfao
+        with self._transacao() as conexao:
+            desistidos = conexao.execute(
+                "UPDATE jobs SET status = 'erro', erro = 'Job interrompido repetidamente (processo encerrado)',"
+                " status_http = 500, entrada = NULL, atualizado_em = ?, concluido_em = ?"
+                " WHERE status = 'executando' AND atualizado_em < ? AND tentativas >= ?",
+                (agora, agora, limite, max_tentativas)
+            ).rowcount
+            reenfileirados = conexao.execute(
+                "UPDATE jobs SET status = 'pendente', atualizado_em = ? WHERE status = 'executando' AND atualizado_em < ?",
+                (agora, limite)
+            ).rowcount
+        return reenfileirados, desistidos
+    
+    def limpar_expirados(self):
+        """Remove os jobs terminados há mais de ttl segundos; retorna quantos"""
+        with self._lock:
+            return self._conectar().execute(
+                "DELETE FROM jobs WHERE status IN ('concluido', 'erro') AND concluido_em < ?",
+                (time.time() - self.ttl,)
+            ).rowcount
+    
+    def obter(self, job_id, com_resultado=True):
+        """Estado do job (com a posição na fila, se pendente) ou None se desconhecido/expirado"""
+        colunas = "tipo, status, erro, status_http, tentativas, criado_em, iniciado_em, concluido_em, rowid"
+        with self._lock:
+            conexao = self._conectar()
+            linha = conexao.execute(
+                f"SELECT {colunas}{', resultado' if com_resultado else ''} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if linha is None:
+                return None
+            tipo, status, erro, status_http, tentativas, criado_em, iniciado_em, concluido_em, rowid = linha[:9]
+            posicao = None
+            if status == "pendente":
+                posicao = conexao.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'pendente' AND rowid < ?", (rowid,)
+                ).fetchone()[0]
+        
+        def iso(instante):
+            return datetime.fromtimestamp(instante, timezone.utc).isoformat() if instante else None
+        
+        job = {
+            "job_id": job_id,
+            "tipo": tipo,
+            "status": status,
+            "posicao": posicao,
+            "tentativas": tentativas,
+            "criado_em": iso(criado_em),
+            "iniciado_em": iso(iniciado_em),
+            "concluido_em": iso(concluido_em),
+        }
+        if iniciado_em:
+            job["duracao_s"] = round((concluido_em or time.time()) - iniciado_em, 3)
+        if status == "erro":
+            job["erro"] = erro
+            job["status_http"] = status_http
+        if status == "concluido" and com_resultado:
+            job["resultado"] = json.loads(linha[9])
+        return job
+    
+    def estatisticas(self):
+        try:
+            with self._lock:
+                contagens = dict(self._conectar().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        except (sqlite3.Error, OSError) as e:
+            return {"sqlite": self.caminho, "erro": str(e)}
+        return {"sqlite": self.caminho, **{status: contagens.get(status, 0) for status in STATUS_JOBS}}
+
+STATUS_JOBS = ("pendente", "executando", "concluido", "erro")
+
+fila_jobs = FilaJobs(JOBS_SQLITE)
+
+cache_recortes = CacheLRU(
+    "recortes", int(CACHE_RECORTES_MAX_MB * 1024 * 1024), CACHE_IMAGENS_TTL,
+    tamanho=lambda memo: memo["caixas"].nbytes + memo["probs"].nbytes
+)
+
+def identidade_imagem(image_id=None, contents=None):
+    """Identifica o conteúdo da imagem: o image_id (imutável) ou o sha256 dos bytes enviados"""
+    if image_id:
+        return f"image_id:{image_id}"
+    return hashlib.sha256(contents).hexdigest()
+
+def caixas_deteccoes(deteccoes):
+    """Matriz (n, 4) float32 [xmin, ymin, xmax, ymax] das detecções"""
+    return np.array(
+        [[det.get("xmin", 0), det.get("ymin", 0), det.get("xmax", 0), det.get("ymax", 0)] for det in deteccoes],
+        dtype=np.float32
+    ).reshape(-1, 4)
+
+def iou_caixas(a, b):
+    """IoU entre todas as caixas de a (n, 4) e b (m, 4) -> (n, m)"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersecao = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersecao / (area_a[:, None] + area_b[None, :] - intersecao + 1e-7)
+
+def reaproveitar_classificacoes(identidade, caixas):
+    """
+    Probabilidades já conhecidas para as caixas da imagem: retorna (preds, em_cache),
+    com preds (n, len(LABEL_COLS)) preenchido onde em_cache é True.
+    Cada caixa reaproveita a caixa memorizada de maior IoU, se >= CLASSIFICACAO_INCREMENTAL_IOU.
+    """
+    preds = np.zeros((len(caixas), len(LABEL_COLS)), dtype=np.float32)
+    em_cache = np.zeros(len(caixas), dtype=bool)
+    
+    memo = cache_recortes.obter(identidade)
+    if memo is None or memo["versao"] != versoes_modelos["classificacao"] or not len(caixas):
+        return preds, em_cache
+    
+    iou = iou_caixas(caixas, memo["caixas"])
+    melhor = iou.argmax(axis=1)
+    em_cache = iou[np.arange(len(caixas)), melhor] >= CLASSIFICACAO_INCREMENTAL_IOU
+    preds[em_cache] = memo["probs"][melhor[em_cache]]
+    return preds, em_cache
+
+def memorizar_classificacoes(identidade, caixas, probs):
+    """Acrescenta caixas recém-classificadas ao memo da imagem (as mais recentes ficam)"""
+    versao = versoes_modelos["classificacao"]
+    memo = cache_recortes.obter(identidade)
+    if memo is not None and memo["versao"] == versao:
+        caixas = np.concatenate([memo["caixas"], caixas])
+        probs = np.concatenate([memo["probs"], probs])
+    limite = CLASSIFICACAO_INCREMENTAL_MAX_BOXES
+    cache_recortes.adicionar(identidade, {
+        "versao": versao,
+        "caixas": caixas[-limite:],
+        "probs": np.asarray(probs, dtype=np.float32)[-limite:]
+    })
+
+def invalidar_cache_resultados():
+    """Descarta os resultados de versões de modelo diferentes das carregadas agora"""
+    cache_recortes.limpar()
+    for tipo, versao in versoes_modelos.items():
+        if versao is not None:
+            cache_resultados.invalidar(tipo, versao)
+
+class AgendadorLotes:
+    """
+    Agrupa requisições concorrentes em um único forward pass.
+    Acumula itens até max_batch_size (medido por tamanho_item) ou até max_wait_ms,
+    executa funcao_lote fora do event loop e devolve a cada requisição o seu resultado.
+    """
+    
+    def __init__(self, nome, funcao_lote, max_batch_size, max_wait_ms, tamanho_item=None):
+        self.nome = nome
+        self.funcao_lote = funcao_lote
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.tamanho_item = tamanho_item or (lambda item: 1)
+        self.fila = asyncio.Queue()
+        self.lotes_executados = 0
+        self.itens_processados = 0
+        self._sobra = None
+        self._tarefa = None
+    
+    def iniciar(self):
+        if self._tarefa is None:
+            self._tarefa = asyncio.create_task(self._loop())
+            logger.info(f"📦 Agendador de lotes '{self.nome}' iniciado "
+                        f"(max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait * 1000:.0f})")
+    
+    async def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+    
+    async def submeter(self, item):
+        """Enfileira um item e aguarda o resultado do lote em que ele entrar"""
+        futuro = asyncio.get_running_loop().create_future()
+        # O controle de prazo da requisição vai junto para o item ser descartado antes do forward
+        await self.fila.put((item, futuro, controle_prazo.get()))
+        return await futuro
+    
+    async def _proximo(self, timeout=None):
+        if self._sobra is not None:
+            pendente, self._sobra = self._sobra, None
+            return pendente
+        if timeout is None:
+            return await self.fila.get()
+        return await asyncio.wait_for(self.fila.get(), timeout)
+    
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await self._proximo()]
+            total = self.tamanho_item(lote[0][0])
+            prazo = loop.time() + self.max_wait
+            
+            while total < self.max_batch_size:
+                restante = prazo - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    pendente = await self._proximo(restante)
+                except asyncio.TimeoutError:
+                    break
+                tamanho = self.tamanho_item(pendente[0])
+                if total + tamanho > self.max_batch_size:
+                    # Não cabe neste lote: vira o primeiro item do próximo
+                    self._sobra = pendente
+                    break
+                lote.append(pendente)
+                total += tamanho
+            
+            await self._executar(lote)
+    
+    async def _executar(self, lote):
+        # Ignora requisições que já desistiram (cliente cancelou, desconectou ou prazo vencido)
+        for _, futuro, controle in lote:
+            motivo = controle.motivo() if controle is not None and not futuro.done() else None
+            if motivo is not None:
+                futuro.set_exception(abandonar_requisicao(controle, motivo, f"lote_{self.nome}"))
+        lote = [(item, futuro) for item, futuro, _ in lote if not futuro.done()]
+        if not lote:
+            return
+        
+        try:
+            resultados = await executar_inferencia(self.funcao_lote, [item for item, _ in lote])
+        except Exception as e:
+            logger.error(f"❌ Erro no lote '{self.nome}': {e}")
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        
+        self.lotes_executados += 1
+        self.itens_processados += len(lote)
+        for (_, futuro), resultado in zip(lote, resultados):
+            if not futuro.done():
+                futuro.set_result(resultado)
+    
+    def estatisticas(self):
+        return {
+            "fila": self.fila.qsize(),
+            "lotes_executados": self.lotes_executados,
+            "itens_processados": self.itens_processados,
+            "media_por_lote": round(self.itens_processados / self.lotes_executados, 2) if self.lotes_executados else 0.0
+        }
+
+_lock_modelos = threading.Lock()
+forwards_em_andamento = {}  # id(modelo) -> forwards em execução nele
+
+@contextmanager
+def usar_modelo(tipo, modelo=None):
+    """
+    Entrega o modelo ativo de `tipo` (ou `modelo`) contando-o como em uso até o fim do
+    bloco: numa troca a quente, a versão antiga só é liberada quando esse uso acaba.
+    """
+    with _lock_modelos:
+        if modelo is None:
+            modelo = modelo_yolo if tipo == "yolo" else modelo_classificacao
+        chave = id(modelo)
+        forwards_em_andamento[chave] = forwards_em_andamento.get(chave, 0) + 1
+    sessao = sessao_perfil
+    try:
+        with sessao.perfilar_forward(tipo) if sessao is not None else nullcontext():
+            yield modelo
+    finally:
+        with _lock_modelos:
+            forwards_em_andamento[chave] -= 1
+            if not forwards_em_andamento[chave]:
+                del forwards_em_andamento[chave]
+
+class ResultadoDeteccaoIndividual:
+    """Resultado de uma única imagem extraído de um forward pass em lote"""
+    
+    def __init__(self, xyxy):
+        self.xyxy = [xyxy]
+
+# Buffer de entrada do YOLO por thread: forwards concorrentes (agendador, mosaico, jobs)
+# não disputam o mesmo tensor nem precisam de lock
+_buffers_yolo = threading.local()
+_nms_yolo = None
+
+def obter_nms_yolo():
+    """Importa (uma vez) o non_max_suppression do pacote yolov5, se disponível"""
+    global _nms_yolo
+    if _nms_yolo is None:
+        try:
+            from yolov5.utils.general import non_max_suppression
+            _nms_yolo = non_max_suppression
+        except ImportError:
+            _nms_yolo = False
+    return _nms_yolo
+
+_yolos_tracados = weakref.WeakKeyDictionary()  # AutoShape -> rede traçada (uma por versão carregada)
+yolo_tracings = 0
+
+def tracar_yolo(modelo):
+    """
+    torch.jit.trace da rede do AutoShape (DetectionModel) com entrada 640x640: o forward
+    deixa de passar pelo Python de cada camada. O lote é dinâmico; a grade do Detect
+    fica fixa em 640, por isso só entradas 640x640 usam a versão traçada.
+    """
+    global yolo_tracings
+    if not YOLO_TRACADO or not aceita_tensor_direto(modelo) or not getattr(modelo.model, "pt", False):
+        return
+    if modelo in _yolos_tracados:
+        return
+    
+    try:
+        rede = modelo.model.model.eval()
+        with warnings.catch_warnings(), torch.inference_mode():
+            warnings.simplefilter("ignore")
+            tracado = torch.jit.trace(rede, torch.zeros((1, 3, 640, 640)), strict=False, check_trace=False)
+        _yolos_tracados[modelo] = tracado
+        yolo_tracings += 1
+        METRICA_COMPILACOES.labels("yolo").inc()
+        logger.info("🔥 YOLO traçado (torch.jit.trace)")
+    except Exception as e:
+        logger.warning(f"⚠️ torch.jit.trace do YOLO falhou ({e}), usando o forward do AutoShape")
+
+def forward_yolo(modelo, tensor):
+    """Rede traçada do modelo (se houver e a entrada for 640x640) ou o próprio AutoShape"""
+    tracado = _yolos_tracados.get(modelo)
+    if tracado is not None and tuple(tensor.shape[2:]) == (640, 640):
+        return tracado(tensor)
+    return modelo(tensor)
+
+def compilar_modelos():
+    """Traça o YOLO nativo; o classificador compilado é traçado no warmup (um grafo por bucket)"""
+    if modelo_yolo is not None:
+        tracar_yolo(modelo_yolo)
+
+def estatisticas_compilacao():
+    classificacao = modelo_classificacao.estatisticas() if isinstance(modelo_classificacao, ClassificadorCompilado) else None
+    return {
+        "classificacao": classificacao,
+        "yolo": {"tracado": modelo_yolo is not None and modelo_yolo in _yolos_tracados, "tracings": yolo_tracings}
+    }
+
+def aceita_tensor_direto(modelo):
+    """Verifica se o modelo é um AutoShape do YOLOv5 (aceita tensor BCHW já preparado)"""
+    return (torch is not None and isinstance(modelo, torch.nn.Module)
+            and hasattr(modelo, 'dmb') and bool(obter_nms_yolo()))
+
+def montar_tensor_yolo(imagens):
+    """
+    Copia as imagens letterboxed (HWC uint8) para o buffer BCHW float32 pré-alocado da
+    thread e normaliza para 0-1. O buffer cresce apenas quando chega um lote maior.
+    """
+    importar_torch()
+    n = len(imagens)
+    h, w = imagens[0].shape[:2]
+    
+    buffer = getattr(_buffers_yolo, "tensor", None)
+    if buffer is None or buffer.shape[0] < n or buffer.shape[2:] != (h, w):
+        buffer = _buffers_yolo.tensor = torch.empty((max(n, YOLO_MAX_BATCH_SIZE), 3, h, w), dtype=torch.float32)
+    
+    tensor = buffer[:n]
+    for i, img in enumerate(imagens):
+        tensor[i].copy_(torch.from_numpy(img).permute(2, 0, 1))
+    tensor.div_(255.0)
+    return tensor
+
+def inferir_yolo_tensor(imagens, modelo, conf=None):
+    """
+    Forward direto no modelo com as imagens já letterboxed (sem o pré-processamento
+    do AutoShape), seguido do NMS com os mesmos parâmetros do AutoShape (ou `conf`).
+    """
+    importar_torch()
+    non_max_suppression = obter_nms_yolo()
+    
+    with torch.inference_mode():
+        tensor = montar_tensor_yolo(imagens)
+        pred = forward_yolo(modelo, tensor)
+        deteccoes = non_max_suppression(
+            pred,
+            modelo.conf if conf is None else conf,
+            modelo.iou,
+            modelo.classes,
+            modelo.agnostic,
+            modelo.multi_label,
+            max_det=modelo.max_det
+        )
+        
+        # Mantém as boxes dentro da imagem, como o scale_boxes do AutoShape
+        h, w = imagens[0].shape[:2]
+        for det in deteccoes:
+            det[:, [0, 2]] = det[:, [0, 2]].clamp(0, w)
+            det[:, [1, 3]] = det[:, [1, 3]].clamp(0, h)
+    
+    return [ResultadoDeteccaoIndividual(det) for det in deteccoes]
+
+def inferir_yolo_lote(imagens, modelo=None, conf=None):
+    """
+    Executa o YOLO (o ativo, ou `modelo`) uma única vez para uma lista de imagens e separa
+    os resultados. `conf` troca o limiar do NMS só nesta chamada (o AutoShape chamado
+    inteiro, sem tensor direto, sempre usa o próprio conf).
+    """
+    imagens = list(imagens)
+    METRICA_LOTE.labels("yolo").observe(len(imagens))
+    with usar_modelo("yolo", modelo) as modelo, METRICA_FORWARD.labels("yolo").time():
+        if hasattr(modelo, 'inferir_lote'):
+            return [ResultadoDeteccaoIndividual(det) for det in modelo.inferir_lote(imagens, conf)]
+        if aceita_tensor_direto(modelo):
+            return inferir_yolo_tensor(imagens, modelo, conf)
+        
+        results = modelo(imagens)
+        return [ResultadoDeteccaoIndividual(xyxy) for xyxy in results.xyxy]
+
+def classificar_lote_requisicoes(lotes_recortes):
+    """Concatena os recortes de várias requisições, classifica e devolve as predições de cada uma"""
+    preds = classificar_recortes(np.concatenate(lotes_recortes, axis=0))
+    cortes = np.cumsum([len(recortes) for recortes in lotes_recortes])[:-1]
+    return np.split(preds, cortes)
+
+async def inferir_yolo(img):
+    """Detecção via agendador de lotes (ou chamada direta se ele não estiver ativo)"""
+    with medir_etapa("inferencia_yolo"):
+        if agendador_yolo is None:
+            resultados = await executar_inferencia(inferir_yolo_lote, [img])
+            return resultados[0]
+        return await agendador_yolo.submeter(img)
+
+async def inferir_classificacao(recortes):
+    """Classificação via agendador de lotes (ou chamada direta se ele não estiver ativo)"""
+    with medir_etapa("inferencia_classificacao"):
+        if agendador_classificacao is None:
+            return await executar_inferencia(classificar_recortes, recortes)
+        return await agendador_classificacao.submeter(recortes)
+
+async def classificar_em_fatias(img, deteccoes):
+    """
+    Recorta e classifica as boxes de `img` em fatias de CLASSIFICACAO_MAX_BATCH_SIZE, uma
+    submissão ao agendador por vez. Cada fatia só é recortada quando a anterior terminou,
+    então um cliente que desconectou ou um prazo vencido param também os recortes.
+    """
+    METRICA_RECORTES.labels(endpoint_atual.get()).observe(len(deteccoes))
+    tamanho = max(1, CLASSIFICACAO_MAX_BATCH_SIZE)
+    preds = []
+    for inicio in range(0, len(deteccoes), tamanho):
+        if inicio:
+            verificar_prazo("entre_lotes")
+        recortes = await executar_inferencia(preparar_recortes, img, deteccoes[inicio:inicio + tamanho], 224, False)
+        preds.append(await inferir_classificacao(recortes))
+        del recortes
+    return preds[0] if len(preds) == 1 else np.concatenate(preds, axis=0)
+
+def iniciar_agendadores():
+    """Cria os agendadores de lote de cada modelo"""
+    global agendador_yolo, agendador_classificacao
+    
+    agendador_yolo = AgendadorLotes(
+        "yolo", inferir_yolo_lote, YOLO_MAX_BATCH_SIZE, YOLO_MAX_WAIT_MS
+    )
+    agendador_classificacao = AgendadorLotes(
+        "classificacao", classificar_lote_requisicoes,
+        CLASSIFICACAO_MAX_BATCH_SIZE, CLASSIFICACAO_MAX_WAIT_MS,
+        tamanho_item=len
+    )
+    agendador_yolo.iniciar()
+    agendador_classificacao.iniciar()
+
+def aquecer_yolo(modelo):
+    """
+    Inferências com imagens vazias em cada tamanho de lote do agendador (o executor do
+    TorchScript especializa o grafo nas primeiras chamadas de cada shape)
+    """
+    vazia = np.zeros((640, 640, 3), dtype=np.uint8)
+    tamanhos = range(1, max(YOLO_MAX_BATCH_SIZE, MOSAICO_LOTE) + 1) if modelo in _yolos_tracados else [1]
+    for tamanho in tamanhos:
+        for _ in range(2):
+            inferir_yolo_lote([vazia] * tamanho, modelo)
+
+def aquecer_classificador(modelo):
+    """Traça todos os buckets do classificador compilado e retorna as predições de um recorte vazio"""
+    if isinstance(modelo, ClassificadorCompilado):
+        modelo.aquecer()
+    return classificar_recortes(np.zeros((1, 224, 224, 3), dtype=np.float32), modelo)
+
+def aquecer_modelos():
+    """
+    Executa inferências com entradas vazias em cada modelo (aloca buffers, inicializa kernels).
+    Retorna False se o warmup falhou: o serviço não deve ser marcado como pronto.
+    """
+    try:
+        aquecer_yolo(modelo_yolo)
+        aquecer_classificador(modelo_classificacao)
+        return True
+    except Exception as e:
+        logger.error(f"❌ Warmup dos modelos falhou: {e}")
+        return False
+
+async def inicializar_modelos():
+    """Importa os frameworks, carrega e aquece os modelos em segundo plano"""
+    global modelos_prontos, erro_inicializacao
+    
+    try:
+        # Downloads pendentes correm em paralelo com os imports dos frameworks
+        downloads = asyncio.create_task(baixar_modelos_pendentes())
+        
+        # Imports em ordem fixa (torch antes do tensorflow), fora do event loop,
+        # apenas dos frameworks que os backends escolhidos usam
+        if BACKEND_YOLO not in BACKENDS_ONNX:
+            await asyncio.to_thread(importar_torch)
+        if BACKEND_CLASSIFICACAO == "nativo":
+            await asyncio.to_thread(importar_tensorflow)
+        await downloads
+        
+        # Carrega em paralelo os modelos que ainda não vieram pré-carregados (servir.py)
+        carregadores = {}
+        if modelo_classificacao is None:
+            carregadores["classificacao"] = carregar_modelo_classificacao()
+        if modelo_yolo is None:
+            carregadores["yolo"] = carregar_modelo_yolo()
+        with medir_fase("carga_modelos"):
+            results = await asyncio.gather(*carregadores.values(), return_exceptions=True)
+        
+        # Verifica se houve erros
+        for nome, result in zip(carregadores, results):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Erro ao carregar modelo {nome}: {result}")
+        
+        # Resultados cacheados por outras versões dos modelos deixam de valer
+        await asyncio.to_thread(invalidar_cache_resultados)
+        
+        with medir_fase("compilacao"):
+            await asyncio.to_thread(compilar_modelos)
+        with medir_fase("warmup"):
+            aquecidos = await asyncio.to_thread(aquecer_modelos)
+        if not aquecidos:
+            erro_inicializacao = "warmup dos modelos falhou"
+            return
+        
+        modelos_prontos = True
+        TEMPOS_INICIALIZACAO["total_desde_processo"] = round(time.monotonic() - INICIO_PROCESSO, 3)
+        
+        resumo = ", ".join(f"{fase}={segundos:.2f}s" for fase, segundos in TEMPOS_INICIALIZACAO.items())
+        logger.info(f"✅ API inicializada com sucesso! Tempos: {resumo}")
+        
+    except Exception as e:
+        logger.error(f"❌ Erro na inicialização: {e}")
+        erro_inicializacao = str(e)
+
+async def precarregar_modelos_compartilhados():
+    """
+    Executado pelo processo mestre do servir.py antes do fork: baixa os modelos
+    pendentes e carrega o YOLO do PyTorch, cujos pesos ficam compartilhados
+    (copy-on-write) entre os workers. TensorFlow e ONNX Runtime não sobrevivem
+    a um fork (threads internas), então o classificador e os backends ONNX são
+    carregados em cada worker.
+    """
+    await baixar_modelos_pendentes()
+    if BACKEND_YOLO in ("nativo", "torchscript"):
+        await asyncio.to_thread(importar_torch)
+        # Sem trabalho paralelo no mestre: o pool do OpenMP não pode existir antes do fork
+        # (os workers reaplicam THREADS_INTRA_OP em configurar_threads)
+        torch.set_num_threads(1)
+        with medir_fase("carga_modelos_compartilhados"):
+            await carregar_modelo_yolo()
+
+@app.on_event("startup")
+async def startup_event():
+    """Abre o servidor imediatamente e carrega os modelos em segundo plano"""
+    global tarefa_inicializacao, tarefa_vigia_modelos
+    logger.info("🚀 Iniciando API de IA Médica...")
+    
+    iniciar_agendadores()
+    tarefa_inicializacao = asyncio.create_task(inicializar_modelos())
+    iniciar_trabalhadores_jobs()
+    if MODELOS_VIGIA_INTERVALO > 0:
+        tarefa_vigia_modelos = asyncio.create_task(vigiar_manifesto())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Encerra a inicialização pendente, os jobs, o perfilamento, os agendadores de lote e o executor de inferência"""
+    for tarefa in (tarefa_inicializacao, tarefa_vigia_modelos):
+        if tarefa is not None and not tarefa.done():
+            tarefa.cancel()
+    await parar_trabalhadores_jobs()
+    if sessao_perfil is not None:
+        await encerrar_perfil()
+    for agendador in (agendador_yolo, agendador_classificacao):
+        if agendador is not None:
+            await agendador.parar()
+    executor_inferencia.shutdown(wait=False)
+
+_tabela_nomes_yolo = (None, None)
+
+def para_numpy(deteccoes):
+    """Converte as detecções (tensor torch ou array) para NumPy"""
+    if hasattr(deteccoes, 'cpu'):
+        return deteccoes.cpu().numpy()
+    return np.asarray(deteccoes)
+
+def tabela_nomes_yolo(max_class_id):
+    """Tabela (array de objetos) id -> nome de classe do modelo YOLO atual, cacheada por modelo"""
+    global _tabela_nomes_yolo
+    modelo, tabela = _tabela_nomes_yolo
+    
+    if modelo is not modelo_yolo or tabela is None or len(tabela) <= max_class_id:
+        names = getattr(modelo_yolo, 'names', None) or {}
+        if isinstance(names, (list, tuple)):
+            names = dict(enumerate(names))
+        tamanho = max([max_class_id, *names.keys()]) + 1
+        tabela = np.array([names.get(i, f"class_{i}") for i in range(tamanho)], dtype=object)
+        _tabela_nomes_yolo = (modelo_yolo, tabela)
+    
+    return tabela
+
+def processar_deteccoes_yolo(results, resize_info=None, conf_min=None, formato="lista"):
+    """Pós-processamento das detecções, medido como a etapa 'pos_processamento'"""
+    with medir_etapa("pos_processamento"):
+        deteccoes = _processar_deteccoes_yolo(results, resize_info, conf_min, formato)
+    METRICA_BOXES.labels(endpoint_atual.get()).observe(
+        len(deteccoes["xmin"]) if formato == "colunar" else len(deteccoes)
+    )
+    return deteccoes
+
+def _processar_deteccoes_yolo(results, resize_info=None, conf_min=None, formato="lista"):
     """
     Processa os resultados do YOLOv5 e retorna uma lista de dicionários
     de detecções. Este é o formato ideal para o cliente.
+    Tudo é feito com operações vetorizadas do NumPy:
+    - conf_min: filtra detecções abaixo da confiança mínima
+    - resize_info: converte as boxes do letterbox 640 para pixels da imagem original
+    - formato="colunar": retorna arrays paralelos em vez de lista de dicionários
     """
-    deteccoes = []
+    colunas = ("xmin", "ymin", "xmax", "ymax", "classe", "confianca")
+    vazio = {coluna: [] for coluna in colunas} if formato == "colunar" else []
     
     try:
         # Verifica se há resultados
         if not hasattr(results, 'xyxy') or len(results.xyxy[0]) == 0:
-            return deteccoes
+            return vazio
         
         # Pega as detecções
-        deteccoes_tensor = results.xyxy[0].cpu().numpy()
+        deteccoes_tensor = para_numpy(results.xyxy[0])
         
-        for i, (*box, conf, cls) in enumerate(deteccoes_tensor):
-            x1, y1, x2, y2 = map(int, box)
-            confidence = float(conf)
-            class_id = int(cls)
-            
-            # Pega o nome da classe
-            if hasattr(modelo_yolo, 'names') and class_id in modelo_yolo.names:
-                class_name = modelo_yolo.names[class_id]
-            else:
-                class_name = f"class_{class_id}"
-            
-            deteccoes.append({
-                "xmin": x1,
-                "ymin": y1, 
-                "xmax": x2,
-                "ymax": y2,
-                "classe": class_name,
-                "confianca": confidence
-            })
+        if conf_min is not None:
+            deteccoes_tensor = deteccoes_tensor[deteccoes_tensor[:, 4] >= conf_min]
+            if len(deteccoes_tensor) == 0:
+                return vazio
+        
+        boxes = deteccoes_tensor[:, :4]
+        if resize_info is not None:
+            # Remove o padding, desfaz a escala e limita às dimensões originais
+            pad = np.array([resize_info["padding"]["x"], resize_info["padding"]["y"]] * 2, dtype=np.float32)
+            limites = np.array([resize_info["original_size"]["width"], resize_info["original_size"]["height"]] * 2, dtype=np.float32)
+            boxes = np.clip(np.rint((boxes - pad) / resize_info["scale_factor"]), 0, limites)
+        
+        coords = boxes.astype(np.int64)
+        class_ids = deteccoes_tensor[:, 5].astype(np.int64)
+        classes = tabela_nomes_yolo(int(class_ids.max()))[class_ids]
+        
+        valores = (*coords.T.tolist(), classes.tolist(), deteccoes_tensor[:, 4].tolist())
+        if formato == "colunar":
+            return dict(zip(colunas, valores))
+        return [dict(zip(colunas, linha)) for linha in zip(*valores)]
             
     except Exception as e:
         logger.error(f"Erro ao processar detecções: {e}")
         
-    return deteccoes
+    return vazio
 
-def redimensionar_imagem(img, target_size=640):
-    """Redimensiona a imagem mantendo a proporção"""
-    w_original, h_original = img.size
+def redimensionar_imagem(img, target_size=640, tamanho_original=None):
+    """
+    Redimensiona a imagem mantendo a proporção.
+    tamanho_original: dimensões reais quando img foi decodificada já reduzida
+    (o resize_info continua referente à imagem original).
+    """
+    w_original, h_original = tamanho_original or img.size
     scale = min(target_size / w_original, target_size / h_original)
     
     new_w = int(w_original * scale)
@@ -449,12 +2665,359 @@ def redimensionar_imagem(img, target_size=640):
         "scale_factor": scale
     }
 
-def image_to_base64(img):
-    """Converte PIL Image para base64"""
-    buffered = io.BytesIO()
-    img.save(buffered, format="JPEG", quality=90)
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
+def letterbox_imagem(img, target_size=640, tamanho_original=None):
+    """
+    Letterbox em um único passo com OpenCV: redimensiona mantendo a proporção
+    direto dentro do canvas preto final (HWC uint8 RGB). Mesmo resize_info
+    de redimensionar_imagem (inclusive com tamanho_original).
+    """
+    img_array = np.asarray(img)
+    h_decodificada, w_decodificada = img_array.shape[:2]
+    w_original, h_original = tamanho_original or (w_decodificada, h_decodificada)
+    scale = min(target_size / w_original, target_size / h_original)
+    
+    new_w = int(w_original * scale)
+    new_h = int(h_original * scale)
+    paste_x = (target_size - new_w) // 2
+    paste_y = (target_size - new_h) // 2
+    
+    canvas = np.zeros((target_size, target_size, 3), dtype=np.uint8)
+    interpolacao = cv2.INTER_AREA if new_w < w_decodificada else cv2.INTER_LINEAR
+    cv2.resize(
+        img_array, (new_w, new_h),
+        dst=canvas[paste_y:paste_y + new_h, paste_x:paste_x + new_w],
+        interpolation=interpolacao
+    )
+    
+    return canvas, {
+        "original_size": {"width": w_original, "height": h_original},
+        "resized_size": {"width": new_w, "height": new_h},
+        "final_size": {"width": target_size, "height": target_size},
+        "padding": {"x": paste_x, "y": paste_y},
+        "scale_factor": scale
+    }
+
+def preparar_letterbox(img, target_size=640, tamanho_original=None):
+    """Letterbox da imagem para o YOLO, retornando array HWC uint8 RGB e resize_info"""
+    with medir_etapa("redimensionamento"):
+        if YOLO_PREPROCESSAMENTO == "pil":
+            img_padded, resize_info = redimensionar_imagem(img, target_size, tamanho_original)
+            return np.asarray(img_padded), resize_info
+        return letterbox_imagem(img, target_size, tamanho_original)
+
+# Orientação EXIF (tag 0x0112) -> transposição que deixa a imagem em pé
+ORIENTACAO_EXIF = 0x0112
+TRANSPOSICOES_EXIF = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+
+async def ler_upload(file):
+    """
+    Lê o upload respeitando UPLOAD_MAX_MB: recusa pelo tamanho conhecido antes de ler
+    e nunca lê mais que o limite + 1 byte. O arquivo temporário é fechado logo em seguida.
+    """
+    with medir_etapa("leitura_upload"):
+        if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload maior que o limite de {UPLOAD_MAX_MB:g} MB")
+        contents = await file.read(UPLOAD_MAX_BYTES + 1)
+        await file.close()
+        if len(contents) > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload maior que o limite de {UPLOAD_MAX_MB:g} MB")
+        return contents
+
+def abrir_imagem(contents):
+    """Abre a imagem só pelo cabeçalho e confere o limite de pixels antes de decodificar"""
+    try:
+        img = Image.open(io.BytesIO(contents))
+    except Exception:  # UnidentifiedImageError, DecompressionBombError, plugins com dependência ausente...
+        raise HTTPException(status_code=400, detail="Arquivo enviado não é uma imagem válida")
+    
+    largura, altura = img.size
+    if largura * altura > IMAGEM_MAX_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Imagem de {largura}x{altura} excede o limite de {IMAGEM_MAX_MEGAPIXELS:g} megapixels"
+        )
+    return img
+
+def orientar_rgb(img, orientacao=None):
+    """Decodifica em RGB (sem cópia se já for RGB) e aplica a orientação EXIF uma única vez"""
+    if orientacao is None:
+        orientacao = img.getexif().get(ORIENTACAO_EXIF)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    else:
+        img.load()
+    if orientacao in TRANSPOSICOES_EXIF:
+        img = img.transpose(TRANSPOSICOES_EXIF[orientacao])
+    return img
+
+def decodificar_imagem(contents):
+    """Decodifica os bytes enviados em uma PIL Image RGB em resolução total, já orientada"""
+    with medir_etapa("decodificacao"):
+        return orientar_rgb(abrir_imagem(contents))
+
+def decodificar_reduzida(contents, target_size=640):
+    """
+    Decodifica só o necessário para um alvo de target_size no lado maior: em JPEGs o
+    libjpeg reduz na própria DCT (1/2, 1/4 ou 1/8), sem materializar o bitmap inteiro.
+    Retorna a imagem RGB orientada e o tamanho original (também já orientado).
+    """
+    with medir_etapa("decodificacao"):
+        img = abrir_imagem(contents)
+        largura, altura = img.size
+        orientacao = img.getexif().get(ORIENTACAO_EXIF)
+        
+        if DECODIFICACAO_REDUZIDA and img.format == "JPEG":
+            # Pedido proporcional: o libjpeg escolhe a maior redução que ainda cobre o alvo
+            fator = target_size / max(largura, altura)
+            if fator < 1:
+                img.draft("RGB", (max(1, int(largura * fator)), max(1, int(altura * fator))))
+        
+        if orientacao in (5, 6, 7, 8):  # rotações de 90°: largura e altura trocam
+            largura, altura = altura, largura
+        return orientar_rgb(img, orientacao), (largura, altura)
+
+def preparar_imagem_deteccao(contents, target_size=640):
+    """Decodifica (reduzida, se possível) e redimensiona a imagem para a entrada do YOLO"""
+    img, tamanho_original = decodificar_reduzida(contents, target_size)
+    return preparar_letterbox(img, target_size, tamanho_original)
+
+def grade_mosaico(largura, altura, tamanho=640, sobreposicao=MOSAICO_SOBREPOSICAO):
+    """Origens (x, y) dos tiles tamanho x tamanho que cobrem a imagem com a sobreposição pedida"""
+    passo = max(1, int(tamanho * (1 - sobreposicao)))
+    
+    def origens(dimensao):
+        if dimensao <= tamanho:
+            return [0]
+        # O último tile encosta na borda em vez de sair da imagem
+        return list(range(0, dimensao - tamanho, passo)) + [dimensao - tamanho]
+    
+    return [(x, y) for y in origens(altura) for x in origens(largura)]
+
+def planejar_mosaico(largura, altura, tamanho=640):
+    """
+    Escala (<= 1) da imagem e origens dos tiles dentro do orçamento MOSAICO_MAX_TILES:
+    reduz a imagem em passos de 10% até a grade caber.
+    """
+    escala = 1.0
+    while True:
+        w, h = max(1, round(largura * escala)), max(1, round(altura * escala))
+        origens = grade_mosaico(w, h, tamanho)
+        if len(origens) <= max(1, MOSAICO_MAX_TILES) or (w <= tamanho and h <= tamanho):
+            return escala, origens
+        escala *= 0.9
+
+def preparar_mosaico(img, origens, escala, tamanho=640):
+    """Recorta os tiles (n, tamanho, tamanho, 3) uint8 da imagem na escala do plano (bordas com preto)"""
+    with medir_etapa("mosaico_recortes"):
+        img_array = np.asarray(img)
+        if escala < 1:
+            h, w = img_array.shape[:2]
+            img_array = cv2.resize(img_array, (round(w * escala), round(h * escala)), interpolation=cv2.INTER_AREA)
+        
+        tiles = np.zeros((len(origens), tamanho, tamanho, 3), dtype=np.uint8)
+        for i, (x, y) in enumerate(origens):
+            pedaco = img_array[y:y + tamanho, x:x + tamanho]
+            tiles[i, :pedaco.shape[0], :pedaco.shape[1]] = pedaco
+        return tiles
+
+def triar_tiles(origens, caixas, tamanho=640):
+    """Índices dos tiles que encostam em alguma caixa da passada grosseira (caixas na escala do plano)"""
+    if not len(caixas):
+        return []
+    caixas = caixas + np.array([-1, -1, 1, 1], dtype=np.float32) * MOSAICO_TRIAGEM_MARGEM
+    return [
+        i for i, (x, y) in enumerate(origens)
+        if np.any((caixas[:, 0] < x + tamanho) & (caixas[:, 2] > x) & (caixas[:, 1] < y + tamanho) & (caixas[:, 3] > y))
+    ]
+
+def letterbox_para_original(deteccoes, resize_info):
+    """Converte detecções (n, 6) do letterbox para as coordenadas da imagem original"""
+    deteccoes = deteccoes.copy()
+    pad = np.array([resize_info["padding"]["x"], resize_info["padding"]["y"]] * 2, dtype=np.float32)
+    deteccoes[:, :4] = (deteccoes[:, :4] - pad) / resize_info["scale_factor"]
+    return deteccoes
+
+def original_para_letterbox(deteccoes, resize_info):
+    """Converte detecções (n, 6) da imagem original para o espaço do letterbox"""
+    deteccoes = deteccoes.copy()
+    pad = np.array([resize_info["padding"]["x"], resize_info["padding"]["y"]] * 2, dtype=np.float32)
+    deteccoes[:, :4] = deteccoes[:, :4] * resize_info["scale_factor"] + pad
+    return deteccoes
+
+def mesclar_mosaico(partes, largura, altura):
+    """Junta as detecções (n, 6) em coordenadas originais de todas as passadas com NMS + IoS"""
+    with medir_etapa("mosaico_mesclagem"):
+        deteccoes = np.concatenate([np.asarray(p, dtype=np.float32).reshape(-1, 6) for p in partes])
+        if not len(deteccoes):
+            return deteccoes
+        deteccoes[:, [0, 2]] = deteccoes[:, [0, 2]].clip(0, largura)
+        deteccoes[:, [1, 3]] = deteccoes[:, [1, 3]].clip(0, altura)
+        mantidos = nms_caixas(
+            deteccoes[:, :4], deteccoes[:, 4], deteccoes[:, 5].astype(np.int64),
+            getattr(modelo_yolo, 'iou', YOLO_IOU), ios_thres=MOSAICO_IOS,
+            max_det=getattr(modelo_yolo, 'max_det', 1000)
+        )
+        return deteccoes[mantidos]
+
+async def detectar_mosaico(img, img_resized, resize_info, triagem=False):
+    """
+    Detecção em mosaico na resolução original. A passada global (letterbox 640) sempre
+    entra na mesclagem, pois encontra os objetos grandes que os tiles cortam; com triagem,
+    ela roda antes, com MOSAICO_TRIAGEM_CONF, e só os tiles perto das suas caixas (mesmo as
+    fracas) vão para o modelo. Detecções que nem fracas aparecem no 640 não são refinadas.
+    Retorna o resultado no espaço do letterbox (como inferir_yolo) e o resumo do mosaico.
+    """
+    tempos = {}
+    
+    @contextmanager
+    def cronometro(nome):
+        inicio = time.perf_counter()
+        yield
+        tempos[nome] = round((time.perf_counter() - inicio) * 1000, 2)
+    
+    with cronometro("total"):
+        largura, altura = img.size
+        escala, origens = planejar_mosaico(largura, altura)
+        selecionados = list(range(len(origens)))
+        partes = []
+        
+        if triagem:
+            with cronometro("triagem"):
+                # Fora do agendador: o lote dele usa o conf de produção
+                resultado = await executar_inferencia(inferir_yolo_lote, [img_resized], None, MOSAICO_TRIAGEM_CONF)
+                global_ = letterbox_para_original(para_numpy(resultado[0].xyxy[0]), resize_info)
+            partes.append(global_[global_[:, 4] > getattr(modelo_yolo, 'conf', YOLO_CONF)])
+            selecionados = triar_tiles(origens, global_[:, :4] * escala)
+        
+        origens_selecionadas = [origens[i] for i in selecionados]
+        with cronometro("recortes"):
+            tiles = await executar_inferencia(preparar_mosaico, img, origens_selecionadas, escala)
+        
+        with cronometro("inferencia"):
+            with medir_etapa("inferencia_mosaico"):
+                # Sem triagem, a passada global vai no primeiro lote junto com os tiles
+                imagens = list(tiles) if triagem else [img_resized] + list(tiles)
+                lote = max(1, MOSAICO_LOTE)
+                resultados = []
+                for i in range(0, len(imagens), lote):
+                    resultados += await executar_inferencia(inferir_yolo_lote, imagens[i:i + lote])
+        
+        if not triagem:
+            partes.append(letterbox_para_original(para_numpy(resultados.pop(0).xyxy[0]), resize_info))
+        for (x, y), resultado in zip(origens_selecionadas, resultados):
+            det = para_numpy(resultado.xyxy[0]).astype(np.float32, copy=True).reshape(-1, 6)
+            det[:, :4] = (det[:, :4] + np.array([x, y, x, y], dtype=np.float32)) / escala
+            partes.append(det)
+        
+        with cronometro("mesclagem"):
+            mescladas = await executar_inferencia(mesclar_mosaico, partes, largura, altura)
+    
+    resumo = {
+        "tiles": len(origens),
+        "tiles_processados": len(origens_selecionadas),
+        "lotes": -(-len(imagens) // lote),
+        "escala": round(escala, 4),
+        "triagem": triagem,
+        "tempos_ms": tempos
+    }
+    return ResultadoDeteccaoIndividual(original_para_letterbox(mescladas, resize_info)), resumo
+
+def finalizar_deteccao(results, img_resized, formato_imagem="base64", tipo_imagem="jpeg",
+                       qualidade=IMAGEM_QUALIDADE_PADRAO, opcoes_boxes=None):
+    """Processa as detecções e, se pedido, codifica a imagem redimensionada em base64"""
+    deteccoes = processar_deteccoes_yolo(results, **(opcoes_boxes or {}))
+    if formato_imagem != "base64":
+        return deteccoes, None
+    return deteccoes, image_to_base64(img_resized, tipo_imagem, qualidade)
+
+def montar_resultados_classificacao(deteccoes, preds, em_cache=None):
+    """
+    Junta cada detecção com a classe predita (LABEL_COLS) e a confiança do classificador.
+    Com em_cache, cada resultado informa se veio da reclassificação incremental.
+    """
+    resultados = []
+    
+    for i, (det, pred) in enumerate(zip(deteccoes, preds)):
+        index = np.argmax(pred)
+        classe_predita = LABEL_COLS[index]
+        confianca_maxima = float(np.max(pred))
+        
+        # Adiciona os resultados da classificação à detecção original
+        resultados.append({
+            "xmin": det.get("xmin", 0),
+            "ymin": det.get("ymin", 0),
+            "xmax": det.get("xmax", 0),
+            "ymax": det.get("ymax", 0),
+            "classe_deteccao": det.get("classe"),
+            "confianca_deteccao": det.get("confianca"),
+            "classe_classificacao": classe_predita,
+            "confianca_classificacao": confianca_maxima
+        })
+        if em_cache is not None:
+            resultados[-1]["em_cache"] = bool(em_cache[i])
+    
+    return resultados
+
+def codificar_imagem(img, tipo="jpeg", qualidade=IMAGEM_QUALIDADE_PADRAO):
+    """Codifica uma PIL Image (ou array RGB) em JPEG/WebP e retorna os bytes"""
+    with medir_etapa("codificacao_imagem"):
+        if isinstance(img, np.ndarray):
+            img = Image.fromarray(img)
+        buffered = io.BytesIO()
+        img.save(buffered, format=TIPOS_IMAGEM[tipo][0], quality=qualidade)
+        return buffered.getvalue()
+
+def image_to_base64(img, tipo="jpeg", qualidade=IMAGEM_QUALIDADE_PADRAO):
+    """Converte PIL Image para base64"""
+    img_str = base64.b64encode(codificar_imagem(img, tipo, qualidade)).decode()
+    return img_str
+
+def validar_opcoes_imagem(formato_imagem, tipo_imagem, qualidade):
+    """Valida as opções de retorno da imagem, levantando 400 se inválidas"""
+    if formato_imagem not in FORMATOS_IMAGEM:
+        raise HTTPException(status_code=400, detail=f"formato_imagem deve ser um de {list(FORMATOS_IMAGEM)}")
+    if tipo_imagem not in TIPOS_IMAGEM:
+        raise HTTPException(status_code=400, detail=f"tipo_imagem deve ser um de {list(TIPOS_IMAGEM)}")
+    if not 1 <= qualidade <= 100:
+        raise HTTPException(status_code=400, detail="qualidade_imagem deve estar entre 1 e 100")
+
+def preparar_recortes(img, deteccoes, tamanho=224, observar=True):
+    """
+    Recorta e redimensiona todas as boxes em um único tensor (N, 224, 224, 3)
+    já normalizado, pronto para uma só passada do classificador. Sem observar,
+    quem chama registra o nº de recortes (classificar_em_fatias, uma vez por imagem).
+    """
+    if observar:
+        METRICA_RECORTES.labels(endpoint_atual.get()).observe(len(deteccoes))
+    
+    with medir_etapa("recortes"):
+        recortes = np.empty((len(deteccoes), tamanho, tamanho, 3), dtype=np.float32)
+        
+        for i, det in enumerate(deteccoes):
+            box = (det.get("xmin", 0), det.get("ymin", 0), det.get("xmax", 0), det.get("ymax", 0))
+            recortes[i] = np.asarray(img.crop(box).resize((tamanho, tamanho)), dtype=np.float32)
+        
+        recortes /= 255.0
+    return recortes
+
+def classificar_recortes(recortes, modelo=None):
+    """Classifica os recortes (com o classificador ativo, ou `modelo`) em lotes de até CLASSIFICACAO_MAX_BATCH imagens"""
+    max_batch = max(1, CLASSIFICACAO_MAX_BATCH)
+    METRICA_LOTE.labels("classificacao").observe(len(recortes))
+    with usar_modelo("classificacao", modelo) as modelo, METRICA_FORWARD.labels("classificacao").time():
+        preds = [
+            modelo.predict(recortes[i:i + max_batch], batch_size=max_batch, verbose=0)
+            for i in range(0, len(recortes), max_batch)
+        ]
+    return np.concatenate(preds, axis=0)
 
 @app.get("/")
 async def root():
@@ -465,56 +3028,279 @@ async def root():
         "endpoints": [
             "/predict/detection",
             "/predict/classification",
+            "/predict/analyze",
+            "/predict/lote",
+            "/jobs",
+            "/jobs/{job_id}",
+            "/jobs/{job_id}/eventos",
+            "/images/{image_id}",
             "/health",
-            "/models/info"
+            "/metrics",
+            "/models/info",
+            "/admin/modelos/{tipo}",
+            "/admin/modelos/{tipo}/rollback",
+            "/admin/perfil",
+            "/admin/perfil/{perfil_id}"
         ]
     }
 
 @app.get("/health")
 async def health_check():
-    """Endpoint de verificação de saúde da API e modelos"""
-    return {
-        "status": "healthy",
+    """
+    Endpoint de verificação de saúde da API e modelos (healthcheck do deploy).
+    Responde 503 até os modelos estarem carregados, compilados e aquecidos, e
+    permanentemente se a inicialização falhou, para a plataforma reiniciar o processo.
+    Um worker que segue servindo uma versão anterior à do manifesto (troca a quente que
+    falhou nele) continua 200, com status "desatualizado" e o motivo em trocas_pendentes.
+    """
+    if modelos_prontos:
+        status = "desatualizado" if trocas_pendentes else "healthy"
+    elif erro_inicializacao is not None:
+        status = "falha"
+    else:
+        status = "iniciando"
+    conteudo = {
+        "status": status,
+        "pronto": modelos_prontos,
+        "erro_inicializacao": erro_inicializacao,
         "models": {
             "classificacao": modelo_classificacao is not None,
             "yolo": modelo_yolo is not None
         },
-        "timestamp": None
+        "versoes": versoes_modelos,
+        "trocas_pendentes": trocas_pendentes,
+        "backends": {"yolo": BACKEND_YOLO, "classificacao": BACKEND_CLASSIFICACAO},
+        "inicializacao": TEMPOS_INICIALIZACAO,
+        "processo": {"worker": os.getenv("SERVIR_WORKER"), **memoria_processo()},
+        "inferencia": estatisticas_inferencia(),
+        "compilacao": estatisticas_compilacao(),
+        "cache_imagens": cache_imagens.estatisticas(),
+        "cache_resultados": cache_resultados.estatisticas(),
+        "cache_recortes": cache_recortes.estatisticas(),
+        "jobs": {"workers": JOBS_WORKERS if tarefas_jobs else 0, **await asyncio.to_thread(fila_jobs.estatisticas)},
+        "lotes": {
+            "yolo": agendador_yolo.estatisticas() if agendador_yolo else None,
+            "classificacao": agendador_classificacao.estatisticas() if agendador_classificacao else None
+        },
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+    if not modelos_prontos:
+        return RespostaJSON(content=conteudo, status_code=503, headers={"Retry-After": str(INICIALIZACAO_RETRY_AFTER)})
+    return conteudo
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas no formato de exposição do Prometheus (agregadas entre workers, se houver)"""
+    if METRICAS_MULTIPROCESSO:
+        METRICA_RSS.set(rss_processo())
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+        return Response(content=generate_latest(registro), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+def validar_opcoes_deteccao(formato_imagem, tipo_imagem, qualidade_imagem, coordenadas, formato_boxes):
+    """Valida as opções de /predict/detection (e dos jobs de detecção), levantando 400 se inválidas"""
+    validar_opcoes_imagem(formato_imagem, tipo_imagem, qualidade_imagem)
+    if coordenadas not in ("letterbox", "original"):
+        raise HTTPException(status_code=400, detail="coordenadas deve ser 'letterbox' ou 'original'")
+    if formato_boxes not in ("lista", "colunar"):
+        raise HTTPException(status_code=400, detail="formato_boxes deve ser 'lista' ou 'colunar'")
+
+async def detectar_imagem(contents, formato_imagem="base64", tipo_imagem="jpeg",
+                          qualidade_imagem=IMAGEM_QUALIDADE_PADRAO, coordenadas="letterbox",
+                          formato_boxes="lista", conf_min=None, mosaico=False, triagem=False):
+    """Pipeline de /predict/detection sobre os bytes da imagem; retorna o corpo da resposta"""
+    # Mesmos bytes, modelo e limiares: reaproveita as boxes sem decodificar nem inferir
+    chave = await chave_resultado(
+        "deteccao", contents, ["yolo"], coordenadas=coordenadas, formato_boxes=formato_boxes,
+        conf_min=conf_min, conf=YOLO_CONF, iou=YOLO_IOU,
+        mosaico=[MOSAICO_SOBREPOSICAO, MOSAICO_MAX_TILES, MOSAICO_IOS, MOSAICO_TRIAGEM_MARGEM,
+                 MOSAICO_TRIAGEM_CONF if triagem else None, triagem] if mosaico else None
+    )
+    cacheado = await consultar_cache_resultados(chave)
+    
+    if cacheado is not None:
+        deteccoes, resize_info, image_id = cacheado["boxes"], cacheado["dimensoes"], cacheado["image_id"]
+        resumo_mosaico = cacheado.get("mosaico")
+        img_resized = cache_imagens.obter(image_id)
+        if img_resized is None:
+            # Imagem da sessão expirada (ou de outro worker): só o letterbox, sem o YOLO
+            img_resized, _ = await executar_inferencia(preparar_imagem_deteccao, contents)
+            armazenar_imagem_sessao(img_resized, image_id)
+        imagem_base64 = None
+        if formato_imagem == "base64":
+            imagem_base64 = await executar_inferencia(image_to_base64, img_resized, tipo_imagem, qualidade_imagem)
+    else:
+        resumo_mosaico = None
+        if mosaico:
+            # Mosaico: a imagem original fica decodificada para recortar os tiles
+            img_original = await executar_inferencia(decodificar_imagem, contents)
+            del contents
+            img_resized, resize_info = await executar_inferencia(preparar_letterbox, img_original, 640)
+            results, resumo_mosaico = await detectar_mosaico(img_original, img_resized, resize_info, triagem)
+            del img_original
+        else:
+            # Decodifica e redimensiona a imagem para a entrada do modelo, mantendo a proporção
+            img_resized, resize_info = await executar_inferencia(preparar_imagem_deteccao, contents)
+            
+            # Realiza a predição com o modelo YOLO
+            results = await inferir_yolo(img_resized)
+        
+        # Processa os resultados e converte a imagem redimensionada para base64 (se pedido)
+        opcoes_boxes = {
+            "resize_info": resize_info if coordenadas == "original" else None,
+            "conf_min": conf_min,
+            "formato": formato_boxes
+        }
+        deteccoes, imagem_base64 = await executar_inferencia(
+            finalizar_deteccao, results, img_resized, formato_imagem, tipo_imagem, qualidade_imagem, opcoes_boxes
+        )
+        
+        # Mantém a imagem decodificada para a classificação referenciar por image_id
+        image_id = armazenar_imagem_sessao(img_resized)
+        valor_cache = {"boxes": deteccoes, "dimensoes": resize_info, "image_id": image_id}
+        if resumo_mosaico:
+            valor_cache["mosaico"] = resumo_mosaico
+        await guardar_cache_resultados(chave, valor_cache, ["yolo"])
+
+    # Retorna a resposta no formato esperado pelo frontend
+    resposta = {
+        "boxes": deteccoes,                 # <-- RENOMEADO de "deteccoes" para "boxes"
+        "dimensoes": resize_info,           # <-- RENOMEADO de "info_redimensionamento"
+        "image_id": image_id
     }
+    if resumo_mosaico:
+        resposta["mosaico"] = resumo_mosaico
+    if formato_imagem == "base64":
+        resposta["imagem_redimensionada"] = imagem_base64  # <-- ADICIONADO este campo crucial
+    elif formato_imagem == "url":
+        resposta["imagem_url"] = f"/images/{image_id}?tipo={tipo_imagem}&qualidade={qualidade_imagem}"
+    return resposta
+
+async def classificar_imagem(deteccoes, contents=None, image_id=None, incremental=CLASSIFICACAO_INCREMENTAL):
+    """
+    Pipeline de /predict/classification: classifica as boxes na imagem enviada (bytes)
+    ou na imagem de sessão do image_id; retorna o corpo da resposta.
+    """
+    img_sessao = None
+    if contents is None:
+        img_sessao = cache_imagens.obter(image_id)
+        if img_sessao is None:
+            raise HTTPException(status_code=404, detail="image_id expirado ou desconhecido; reenvie o arquivo.")
+    
+    if not deteccoes:
+        return {"resultados": []}
+    
+    # A imagem de um image_id nunca muda: ele identifica o conteúdo tão bem quanto os bytes
+    identidade = await asyncio.to_thread(identidade_imagem, image_id if contents is None else None, contents)
+    chave = await chave_resultado(
+        "classificacao", identidade, ["classificacao"], deteccoes=json.dumps(deteccoes, sort_keys=True),
+        incremental=incremental
+    )
+    cacheado = await consultar_cache_resultados(chave)
+    if cacheado is not None:
+        if incremental:
+            cacheado = [{**resultado, "em_cache": True} for resultado in cacheado]
+        return {"resultados": cacheado}
+    
+    # Incremental: só as boxes novas ou movidas além da tolerância de IoU vão para o modelo
+    caixas = caixas_deteccoes(deteccoes)
+    if incremental:
+        preds, em_cache = reaproveitar_classificacoes(identidade, caixas)
+        METRICA_RECORTES_REAPROVEITADOS.inc(int(em_cache.sum()))
+    else:
+        preds, em_cache = np.zeros((len(caixas), len(LABEL_COLS)), dtype=np.float32), np.zeros(len(caixas), bool)
+    pendentes = np.flatnonzero(~em_cache)
+    
+    if len(pendentes):
+        # Decodifica (ou reaproveita a imagem da sessão), recorta as boxes pendentes e classifica o lote inteiro
+        if img_sessao is not None:
+            img_original = Image.fromarray(img_sessao)
+        else:
+            img_original = await executar_inferencia(decodificar_imagem, contents)
+            del contents
+        preds[pendentes] = await classificar_em_fatias(img_original, [deteccoes[i] for i in pendentes])
+        if incremental:
+            memorizar_classificacoes(identidade, caixas[pendentes], preds[pendentes])
+
+    resultados_finais = montar_resultados_classificacao(deteccoes, preds, em_cache if incremental else None)
+    await guardar_cache_resultados(chave, resultados_finais, ["classificacao"])
+    return {"resultados": resultados_finais}
+
+async def analisar_imagem(contents):
+    """Pipeline de /predict/analyze (detecção + classificação de cada box); retorna o corpo da resposta"""
+    chave = await chave_resultado(
+        "analise", contents, ["yolo", "classificacao"], conf=YOLO_CONF, iou=YOLO_IOU
+    )
+    cacheado = await consultar_cache_resultados(chave)
+    if cacheado is not None:
+        return cacheado
+    
+    img_original = await executar_inferencia(decodificar_imagem, contents)
+    del contents
+    img_resized, resize_info = await executar_inferencia(preparar_letterbox, img_original, 640)
+    
+    results = await inferir_yolo(img_resized)
+    
+    # Boxes já convertidas para a imagem original: recorta dela, não da versão letterboxed
+    deteccoes = processar_deteccoes_yolo(results, resize_info=resize_info)
+    
+    if not deteccoes:
+        resposta = {"resultados": [], "dimensoes": resize_info}
+    else:
+        preds = await classificar_em_fatias(img_original, deteccoes)
+        resposta = {
+            "resultados": montar_resultados_classificacao(deteccoes, preds),
+            "dimensoes": resize_info
+        }
+    
+    await guardar_cache_resultados(chave, resposta, ["yolo", "classificacao"])
+    return resposta
 
 @app.post("/predict/detection")
-async def predict_detection(file: UploadFile = File(...)):
+async def predict_detection(
+    file: UploadFile = File(...),
+    formato_imagem: str = Form("base64"),
+    tipo_imagem: str = Form("jpeg"),
+    qualidade_imagem: int = Form(IMAGEM_QUALIDADE_PADRAO),
+    coordenadas: str = Form("letterbox"),
+    formato_boxes: str = Form("lista"),
+    conf_min: Optional[float] = Form(None),
+    mosaico: bool = Form(False),
+    triagem: bool = Form(False),
+    _prazo: ControlePrazo = Depends(controlar_prazo),
+    _admissao: None = Depends(admitir_inferencia)
+):
     """
     Endpoint para detecção de objetos.
     Recebe uma imagem, retorna uma lista de detecções (boxes, classes, confianças),
-    a imagem redimensionada em base64 e as informações de redimensionamento.
+    a imagem redimensionada e as informações de redimensionamento.
+    A imagem pode vir em base64 (padrão), ser omitida ("nenhum") ou ser
+    buscada depois em GET /images/{image_id} ("url").
+    As boxes podem vir no espaço do letterbox 640 (padrão) ou da imagem
+    original (coordenadas="original"), como lista ou colunar (formato_boxes).
+    Com mosaico=true, detecta em tiles 640 sobrepostos da imagem em resolução total
+    (lesões pequenas que somem no 640); triagem=true pula os tiles sem nenhuma caixa,
+    nem fraca (MOSAICO_TRIAGEM_CONF), na passada global: só refina o que ela já enxerga.
+    A resposta traz o resumo do mosaico (tiles, escala, tempos em ms).
+    O cabeçalho X-Deadline-Ms (PRAZO_HEADER) informa quanto o cliente ainda espera:
+    vencido o prazo responde 504; se o cliente desconectar, o trabalho é descartado.
     """
     if modelo_yolo is None:
         raise HTTPException(status_code=503, detail="Modelo YOLO não carregado")
     
+    validar_opcoes_deteccao(formato_imagem, tipo_imagem, qualidade_imagem, coordenadas, formato_boxes)
+    
     try:
-        contents = await file.read()
-        img_original = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        # Redimensiona a imagem para a entrada do modelo, mantendo a proporção
-        img_resized, resize_info = redimensionar_imagem(img_original, target_size=640)
-        
-        # Realiza a predição com o modelo YOLO
-        results = modelo_yolo(img_resized)
-        
-        # Processa os resultados para obter a lista de detecções
-        deteccoes = processar_deteccoes_yolo(results)
-        
-        # Converte a imagem redimensionada para base64
-        imagem_base64 = image_to_base64(img_resized)
-
-        # Retorna a resposta no formato esperado pelo frontend
-        return JSONResponse(content={
-            "boxes": deteccoes,                 # <-- RENOMEADO de "deteccoes" para "boxes"
-            "dimensoes": resize_info,           # <-- RENOMEADO de "info_redimensionamento"
-            "imagem_redimensionada": imagem_base64  # <-- ADICIONADO este campo crucial
-        })
+        contents = await ler_upload(file)
+        resposta = await detectar_imagem(
+            contents, formato_imagem, tipo_imagem, qualidade_imagem, coordenadas, formato_boxes,
+            conf_min, mosaico, triagem
+        )
+        return RespostaJSON(content=resposta)
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro na detecção: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -530,71 +3316,481 @@ if __name__ == "__main__":
 
 @app.post("/predict/classification")
 async def predict_classification(
-    file: UploadFile = File(...), 
-    deteccoes_json: str = Form(...)
+    file: Optional[UploadFile] = File(None), 
+    deteccoes_json: str = Form(...),
+    image_id: Optional[str] = Form(None),
+    incremental: bool = Form(CLASSIFICACAO_INCREMENTAL),
+    _prazo: ControlePrazo = Depends(controlar_prazo),
+    _admissao: None = Depends(admitir_inferencia)
 ):
     """
     Endpoint para classificação de imagens recortadas.
-    Recebe a imagem original e um JSON com as bounding boxes detectadas.
-    Retorna as classificações para cada box.
+    Recebe a imagem (arquivo ou image_id retornado pela detecção) e um JSON
+    com as bounding boxes detectadas. Retorna as classificações para cada box.
+    No modo incremental (padrão), boxes já classificadas para a mesma imagem,
+    ou movidas só alguns pixels, reaproveitam o resultado anterior ("em_cache").
+    Com muitas boxes, a classificação para entre os lotes se o cliente desconectar
+    ou o prazo de X-Deadline-Ms (PRAZO_HEADER) vencer (504).
     """
     if modelo_classificacao is None:
         raise HTTPException(status_code=503, detail="Modelo de classificação não carregado")
     
+    if file is None and not image_id:
+        raise HTTPException(status_code=400, detail="Envie 'file' ou 'image_id'.")
+    
     try:
         # Converte o JSON string para uma lista de dicionários
         deteccoes = json.loads(deteccoes_json)
-        contents = await file.read()
-        img_original = Image.open(io.BytesIO(contents)).convert("RGB")
-        
-        resultados_finais = []
-
-        if not deteccoes:
-            return JSONResponse(content={"resultados": resultados_finais})
-
-        for det in deteccoes:
-            xmin = det.get("xmin", 0)
-            ymin = det.get("ymin", 0)
-            xmax = det.get("xmax", 0)
-            ymax = det.get("ymax", 0)
-            
-            # Recorta a imagem original usando as coordenadas da box
-            cropped_img = img_original.crop((xmin, ymin, xmax, ymax))
-            
-            # Redimensiona a imagem recortada para a entrada do modelo de classificação
-            img_resized = cropped_img.resize((224, 224))
-
-            # Converte a imagem para um array e normaliza
-            img_array = image.img_to_array(img_resized) / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
-
-            # Realiza a predição
-            pred = modelo_classificacao.predict(img_array, verbose=0)
-            index = np.argmax(pred[0])
-            classe_predita = LABEL_COLS[index]
-            confianca_maxima = float(np.max(pred[0]))
-            
-            # Adiciona os resultados da classificação à detecção original
-            resultados_finais.append({
-                "xmin": xmin,
-                "ymin": ymin,
-                "xmax": xmax,
-                "ymax": ymax,
-                "classe_deteccao": det.get("classe"),
-                "confianca_deteccao": det.get("confianca"),
-                "classe_classificacao": classe_predita,
-                "confianca_classificacao": confianca_maxima
-            })
-
-        return JSONResponse(content={"resultados": resultados_finais})
+        contents = await ler_upload(file) if file is not None else None
+        resposta = await classificar_imagem(deteccoes, contents, image_id, incremental)
+        return RespostaJSON(content=resposta)
     
     except json.JSONDecodeError as e:
         logger.error(f"Erro ao decodificar JSON: {e}")
         raise HTTPException(status_code=400, detail="Formato JSON de detecções inválido.")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro na classificação: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/predict/analyze")
+async def predict_analyze(
+    file: UploadFile = File(...),
+    _prazo: ControlePrazo = Depends(controlar_prazo),
+    _admissao: None = Depends(admitir_inferencia)
+):
+    """
+    Endpoint de análise completa em uma única chamada (fluxos não interativos).
+    Decodifica a imagem uma vez, detecta com o YOLO e classifica cada box
+    recortando da imagem original em resolução total.
+    """
+    if modelo_yolo is None or modelo_classificacao is None:
+        raise HTTPException(status_code=503, detail="Modelos não carregados")
+    
+    try:
+        contents = await ler_upload(file)
+        return RespostaJSON(content=await analisar_imagem(contents))
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na análise: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def itens_do_lote(files):
+    """
+    Expande os uploads do lote em itens (nome, origem): cada imagem solta vira um item
+    e cada arquivo .zip contribui com as suas entradas (lidas sob demanda, sem extrair).
+    """
+    itens, pacotes = [], []
+    for file in files:
+        if zipfile.is_zipfile(file.file):
+            pacote = zipfile.ZipFile(file.file)
+            pacotes.append(pacote)
+            for info in pacote.infolist():
+                nome = info.filename
+                if info.is_dir() or nome.startswith("__MACOSX/") or Path(nome).name.startswith("."):
+                    continue
+                itens.append((nome, (pacote, info)))
+        else:
+            file.file.seek(0)
+            itens.append((file.filename, file))
+    return itens, pacotes
+
+def ler_item_lote(origem):
+    """Bytes de um item do lote (upload ou entrada de zip), respeitando UPLOAD_MAX_MB"""
+    limite = f"Imagem maior que o limite de {UPLOAD_MAX_MB:g} MB"
+    if isinstance(origem, tuple):
+        pacote, info = origem
+        if info.file_size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=limite)
+        with pacote.open(info) as f:
+            contents = f.read(UPLOAD_MAX_BYTES + 1)
+    else:
+        contents = origem.file.read(UPLOAD_MAX_BYTES + 1)
+        origem.file.close()
+    if len(contents) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=limite)
+    return contents
+
+async def processar_item_lote(indice, nome, origem, classificar, coordenadas, conf_min):
+    """
+    Detecção (e, se pedido, classificação) de um item do lote pelo mesmo pipeline dos
+    endpoints individuais. Erros viram uma linha com "erro" e "status", sem abortar o lote.
+    """
+    inicio = time.perf_counter()
+    linha = {"indice": indice, "arquivo": nome}
+    try:
+        contents = await asyncio.to_thread(ler_item_lote, origem)
+        if classificar:
+            # Os recortes saem da imagem em resolução total, como em /predict/analyze
+            img_original = await executar_inferencia(decodificar_imagem, contents)
+            del contents
+            img_resized, resize_info = await executar_inferencia(preparar_letterbox, img_original, 640)
+        else:
+            img_resized, resize_info = await executar_inferencia(preparar_imagem_deteccao, contents)
+            del contents
+        
+        results = await inferir_yolo(img_resized)
+        del img_resized
+        deteccoes_originais = processar_deteccoes_yolo(results, resize_info=resize_info, conf_min=conf_min)
+        deteccoes = deteccoes_originais
+        if coordenadas == "letterbox":
+            deteccoes = processar_deteccoes_yolo(results, conf_min=conf_min)
+        
+        linha["boxes"] = deteccoes
+        linha["dimensoes"] = resize_info
+        if classificar:
+            linha["resultados"] = []
+            if deteccoes_originais:
+                recortes = await executar_inferencia(preparar_recortes, img_original, deteccoes_originais)
+                del img_original
+                preds = await inferir_classificacao(recortes)
+                linha["resultados"] = montar_resultados_classificacao(deteccoes, preds)
+    except HTTPException as e:
+        linha.update({"erro": e.detail, "status": e.status_code})
+    except Exception as e:
+        logger.error(f"Erro no item {indice} ({nome}) do lote: {e}")
+        linha.update({"erro": str(e), "status": 500})
+    
+    linha["duracao_ms"] = round((time.perf_counter() - inicio) * 1000, 2)
+    return linha
+
+async def gerar_resultados_lote(itens, pacotes, concorrencia, classificar, coordenadas, conf_min):
+    """
+    Processa os itens com no máximo `concorrencia` imagens em andamento (decode no executor,
+    modelos pelos agendadores de lote, que juntam as imagens concorrentes em um forward) e
+    emite uma linha NDJSON por imagem assim que fica pronta, mais uma linha final de resumo.
+    """
+    endpoint_atual.set("/predict/lote")
+    inicio = time.perf_counter()
+    semaforo = asyncio.Semaphore(concorrencia)
+    
+    async def processar(indice, nome, origem):
+        async with semaforo:
+            return await processar_item_lote(indice, nome, origem, classificar, coordenadas, conf_min)
+    
+    tarefas = [asyncio.create_task(processar(i, nome, origem)) for i, (nome, origem) in enumerate(itens)]
+    erros = 0
+    try:
+        for proxima in asyncio.as_completed(tarefas):
+            linha = await proxima
+            erros += "erro" in linha
+            yield json.dumps(linha, ensure_ascii=False) + "\n"
+        
+        yield json.dumps({"resumo": {
+            "total": len(itens),
+            "sucesso": len(itens) - erros,
+            "erros": erros,
+            "duracao_s": round(time.perf_counter() - inicio, 3)
+        }}) + "\n"
+    finally:
+        # Cliente desconectou (ou terminou): nada continua rodando para este lote
+        for tarefa in tarefas:
+            tarefa.cancel()
+        for pacote in pacotes:
+            pacote.close()
+
+@app.post("/predict/lote")
+async def predict_lote(
+    files: List[UploadFile] = File(...),
+    classificar: bool = Form(False),
+    coordenadas: str = Form("original"),
+    conf_min: Optional[float] = Form(None),
+    concorrencia: int = Form(LOTE_CONCORRENCIA),
+    _admissao: None = Depends(admitir_inferencia)
+):
+    """
+    Reanálise em lote (ex.: arquivo de imagens ao trocar a versão do modelo).
+    Recebe várias imagens no multipart e/ou arquivos .zip e devolve NDJSON em streaming:
+    uma linha por imagem (na ordem em que ficam prontas, com "indice" e "arquivo"),
+    com as boxes e, se classificar=true, a classe de LABEL_COLS de cada box.
+    Falhas de uma imagem saem na própria linha ("erro", "status"); a última linha é o resumo.
+    """
+    if modelo_yolo is None or (classificar and modelo_classificacao is None):
+        raise HTTPException(status_code=503, detail="Modelos não carregados")
+    if coordenadas not in ("letterbox", "original"):
+        raise HTTPException(status_code=400, detail="coordenadas deve ser 'letterbox' ou 'original'")
+    if not 1 <= concorrencia <= LOTE_MAX_CONCORRENCIA:
+        raise HTTPException(status_code=400, detail=f"concorrencia deve estar entre 1 e {LOTE_MAX_CONCORRENCIA}")
+    
+    itens, pacotes = await asyncio.to_thread(itens_do_lote, files)
+    if not itens or len(itens) > LOTE_MAX_ITENS:
+        for pacote in pacotes:
+            pacote.close()
+        if not itens:
+            raise HTTPException(status_code=400, detail="Nenhuma imagem no lote")
+        raise HTTPException(status_code=413, detail=f"Lote com {len(itens)} imagens excede o limite de {LOTE_MAX_ITENS}")
+    
+    logger.info(f"📚 Lote com {len(itens)} imagens (concorrência {concorrencia}, classificar={classificar})")
+    return StreamingResponse(
+        gerar_resultados_lote(itens, pacotes, concorrencia, classificar, coordenadas, conf_min),
+        media_type="application/x-ndjson"
+    )
+
+# Parâmetros aceitos por tipo de job (com os padrões dos endpoints equivalentes, exceto a
+# imagem redimensionada: o resultado fica JOBS_TTL no SQLite, então só vem se pedida em
+# base64) e os modelos de que cada tipo depende (entram na chave de deduplicação)
+PARAMETROS_JOBS = {
+    "deteccao": {
+        "formato_imagem": "nenhum", "tipo_imagem": "jpeg", "qualidade_imagem": IMAGEM_QUALIDADE_PADRAO,
+        "coordenadas": "letterbox", "formato_boxes": "lista", "conf_min": None, "mosaico": False, "triagem": False
+    },
+    "classificacao": {"deteccoes": None, "incremental": CLASSIFICACAO_INCREMENTAL},
+    "analise": {},
+}
+MODELOS_JOBS = {"deteccao": ["yolo"], "classificacao": ["classificacao"], "analise": ["yolo", "classificacao"]}
+
+evento_jobs = None  # acorda os trabalhadores deste processo quando um job é enfileirado
+tarefas_jobs = []
+
+def validar_parametros_job(tipo, parametros):
+    """Completa os parâmetros do job com os padrões do tipo, levantando 400 se inválidos"""
+    if tipo not in PARAMETROS_JOBS:
+        raise HTTPException(status_code=400, detail=f"tipo deve ser um de {list(PARAMETROS_JOBS)}")
+    if not isinstance(parametros, dict):
+        raise HTTPException(status_code=400, detail="parametros deve ser um objeto JSON")
+    desconhecidos = set(parametros) - set(PARAMETROS_JOBS[tipo])
+    if desconhecidos:
+        raise HTTPException(status_code=400, detail=f"Parâmetros desconhecidos para '{tipo}': {sorted(desconhecidos)}")
+    
+    parametros = {**PARAMETROS_JOBS[tipo], **parametros}
+    try:
+        if tipo == "deteccao":
+            validar_opcoes_deteccao(
+                parametros["formato_imagem"], parametros["tipo_imagem"], parametros["qualidade_imagem"],
+                parametros["coordenadas"], parametros["formato_boxes"]
+            )
+            if parametros["formato_imagem"] == "url":
+                raise HTTPException(
+                    status_code=400,
+                    detail="formato_imagem 'url' não vale para jobs (a imagem de sessão não sobrevive ao processo); use 'base64' ou 'nenhum'"
+                )
+    except TypeError:
+        raise HTTPException(status_code=400, detail="Parâmetros de detecção com tipo inválido")
+    if tipo == "classificacao" and not isinstance(parametros["deteccoes"], list):
+        raise HTTPException(status_code=400, detail="Jobs de classificação exigem 'deteccoes' (lista de boxes)")
+    return parametros
+
+async def rodar_job(tipo, entrada, parametros):
+    """
+    Executa o job pelo mesmo pipeline do endpoint síncrono equivalente. O resultado é
+    persistido, então fica sem o image_id (imagem de sessão na memória deste processo).
+    """
+    if tipo == "deteccao":
+        resultado = await detectar_imagem(entrada, **parametros)
+        resultado.pop("image_id", None)
+        return resultado
+    if tipo == "classificacao":
+        return await classificar_imagem(parametros["deteccoes"], entrada, incremental=parametros["incremental"])
+    return await analisar_imagem(entrada)
+
+async def executar_job(job_id, tipo, parametros, entrada):
+    """Roda um job reservado, com batimento periódico, e grava o resultado ou o erro"""
+    inicio = time.perf_counter()
+    
+    async def bater():
+        while True:
+            await asyncio.sleep(JOBS_BATIMENTO)
+            try:
+                await asyncio.to_thread(fila_jobs.bater, job_id)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"⚠️ Falha no batimento do job {job_id}: {e}")
+    
+    batimento = asyncio.create_task(bater())
+    try:
+        resultado = await rodar_job(tipo, entrada, parametros)
+        del entrada
+        await asyncio.to_thread(fila_jobs.concluir, job_id, resultado)
+        METRICA_JOBS.labels(tipo, "concluido").inc()
+        logger.info(f"✅ Job {job_id} ({tipo}) concluído em {time.perf_counter() - inicio:.2f}s")
+    except asyncio.CancelledError:
+        # Encerramento do processo: o job volta para a fila e outro worker (ou o próximo start) o executa
+        fila_jobs.devolver(job_id)
+        raise
+    except HTTPException as e:
+        METRICA_JOBS.labels(tipo, "erro").inc()
+        await asyncio.to_thread(fila_jobs.falhar, job_id, e.detail, e.status_code)
+    except Exception as e:
+        logger.error(f"Erro no job {job_id} ({tipo}): {e}")
+        METRICA_JOBS.labels(tipo, "erro").inc()
+        await asyncio.to_thread(fila_jobs.falhar, job_id, str(e))
+    finally:
+        batimento.cancel()
+
+async def trabalhador_jobs():
+    """Consome a fila de jobs: espera os modelos ficarem prontos e executa um job por vez"""
+    if tarefa_inicializacao is not None:
+        await asyncio.wait([tarefa_inicializacao])
+    if not modelos_prontos:
+        # Jobs persistidos ficam na fila para o próximo processo (o /health já reporta a falha)
+        logger.error("❌ Modelos não ficaram prontos; trabalhador de jobs não vai consumir a fila")
+        return
+    endpoint_atual.set("/jobs")
+    
+    while True:
+        evento_jobs.clear()
+        try:
+            job = await asyncio.to_thread(fila_jobs.reservar)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"⚠️ Falha ao reservar job: {e}")
+            job = None
+        
+        if job is None:
+            # Jobs enfileirados por outros processos só são vistos no próximo intervalo
+            try:
+                await asyncio.wait_for(evento_jobs.wait(), JOBS_INTERVALO)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await executar_job(*job)
+
+async def manter_fila_jobs():
+    """Periodicamente devolve à fila os jobs órfãos e remove os expirados"""
+    while True:
+        try:
+            reenfileirados, desistidos = await asyncio.to_thread(fila_jobs.recuperar_orfaos)
+            if reenfileirados or desistidos:
+                logger.warning(f"⚠️ Jobs órfãos: {reenfileirados} de volta à fila, {desistidos} desistidos")
+                evento_jobs.set()
+            removidos = await asyncio.to_thread(fila_jobs.limpar_expirados)
+            if removidos:
+                logger.info(f"🧹 {removidos} jobs expirados removidos")
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"⚠️ Falha na manutenção da fila de jobs: {e}")
+        await asyncio.sleep(max(1.0, JOBS_ORFAO / 2))
+
+def iniciar_trabalhadores_jobs():
+    global evento_jobs
+    if JOBS_WORKERS <= 0:
+        return
+    evento_jobs = asyncio.Event()
+    tarefas_jobs.extend(asyncio.create_task(trabalhador_jobs()) for _ in range(JOBS_WORKERS))
+    tarefas_jobs.append(asyncio.create_task(manter_fila_jobs()))
+    logger.info(f"📬 {JOBS_WORKERS} trabalhadores de jobs (fila em {JOBS_SQLITE})")
+
+async def parar_trabalhadores_jobs():
+    for tarefa in tarefas_jobs:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas_jobs, return_exceptions=True)
+    tarefas_jobs.clear()
+
+@app.post("/jobs", status_code=202)
+async def criar_job(
+    file: UploadFile = File(...),
+    tipo: str = Form("deteccao"),
+    parametros: str = Form("{}")
+):
+    """
+    Enfileira uma análise e retorna o job_id imediatamente (202), sem esperar a execução
+    (503 + Retry-After enquanto os modelos não estão prontos).
+    tipo: "deteccao", "classificacao" ou "analise"; parametros: JSON com as opções do
+    endpoint equivalente (classificação exige "deteccoes"; detecção não devolve a imagem nem
+    o image_id, a menos que formato_imagem seja "base64"). A mesma imagem com os mesmos
+    parâmetros e modelos reaproveita o job existente ("duplicado": true).
+    Acompanhe por GET /jobs/{job_id} ou pelo stream SSE GET /jobs/{job_id}/eventos.
+    """
+    exigir_modelos_prontos()
+    try:
+        parametros = json.loads(parametros)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="parametros não é um JSON válido")
+    parametros = validar_parametros_job(tipo, parametros)
+    
+    try:
+        contents = await ler_upload(file)
+        chave = await asyncio.to_thread(_chave_resultado, f"job:{tipo}", contents, MODELOS_JOBS[tipo], parametros)
+        job_id, duplicado = await asyncio.to_thread(fila_jobs.enfileirar, chave, tipo, parametros, contents)
+        METRICA_JOBS.labels(tipo, "duplicado" if duplicado else "enfileirado").inc()
+        if evento_jobs is not None:
+            evento_jobs.set()
+        
+        job = await asyncio.to_thread(fila_jobs.obter, job_id, False)
+        return RespostaJSON(status_code=202, content={
+            **job,
+            "duplicado": duplicado,
+            "links": {"status": f"/jobs/{job_id}", "eventos": f"/jobs/{job_id}/eventos"}
+        })
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao enfileirar job: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs/{job_id}")
+async def consultar_job(job_id: str):
+    """Estado do job: pendente (com a posição na fila), executando, concluido (com o resultado) ou erro"""
+    job = await asyncio.to_thread(fila_jobs.obter, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job_id desconhecido ou expirado")
+    return RespostaJSON(content=job)
+
+def evento_sse(evento, dados):
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+async def gerar_eventos_job(job_id):
+    """
+    Stream SSE do job: um evento "progresso" a cada mudança de status/posição na fila e,
+    ao terminar, um evento "concluido" (com o resultado) ou "erro". Comentários periódicos
+    mantêm a conexão viva através de proxies enquanto nada muda.
+    """
+    anterior = None
+    ultimo_envio = time.monotonic()
+    while True:
+        job = await asyncio.to_thread(fila_jobs.obter, job_id, False)
+        if job is None:
+            yield evento_sse("erro", {"job_id": job_id, "erro": "job_id desconhecido ou expirado", "status_http": 404})
+            return
+        if job["status"] in ("concluido", "erro"):
+            job = await asyncio.to_thread(fila_jobs.obter, job_id)
+            yield evento_sse(job["status"], job)
+            return
+        
+        estado = (job["status"], job["posicao"], job["tentativas"])
+        if estado != anterior:
+            yield evento_sse("progresso", job)
+            anterior, ultimo_envio = estado, time.monotonic()
+        elif time.monotonic() - ultimo_envio >= 15:
+            yield ": aguardando\n\n"
+            ultimo_envio = time.monotonic()
+        await asyncio.sleep(JOBS_INTERVALO)
+
+@app.get("/jobs/{job_id}/eventos")
+async def eventos_job(job_id: str):
+    """Acompanha o job por Server-Sent Events até ele terminar"""
+    if await asyncio.to_thread(fila_jobs.obter, job_id, False) is None:
+        raise HTTPException(status_code=404, detail="job_id desconhecido ou expirado")
+    return StreamingResponse(
+        gerar_eventos_job(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/images/{image_id}")
+async def obter_imagem(request: Request, image_id: str, tipo: str = "jpeg", qualidade: int = IMAGEM_QUALIDADE_PADRAO):
+    """
+    Retorna em binário a imagem redimensionada de uma detecção.
+    O conteúdo de um image_id nunca muda, então a resposta é cacheável (ETag/Cache-Control).
+    """
+    validar_opcoes_imagem("url", tipo, qualidade)
+    
+    etag = f'"{image_id}-{tipo}-{qualidade}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={int(CACHE_IMAGENS_TTL)}, immutable"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    img_sessao = cache_imagens.obter(image_id)
+    if img_sessao is None:
+        raise HTTPException(status_code=404, detail="image_id expirado ou desconhecido")
+    
+    conteudo = await executar_inferencia(codificar_imagem, img_sessao, tipo, qualidade)
+    return Response(content=conteudo, media_type=TIPOS_IMAGEM[tipo][1], headers=headers)
+
 @app.get("/models/info")
 async def models_info():
     """Retorna informações sobre os modelos carregados"""
@@ -612,17 +3808,616 @@ async def models_info():
                 "input_size": "640x640"
             }
         
-        return JSONResponse(content={
+        return RespostaJSON(content={
             "classificacao": {
                 "classes": LABEL_COLS,
                 "input_shape": "224x224x3",
-                "loaded": modelo_classificacao is not None
+                "loaded": modelo_classificacao is not None,
+                "versao": versoes_modelos["classificacao"]
             },
             "deteccao": {
                 **yolo_info,
-                "loaded": modelo_yolo is not None
-            }
+                "loaded": modelo_yolo is not None,
+                "versao": versoes_modelos["yolo"]
+            },
+            "slots": {tipo: await asyncio.to_thread(slots_modelo, tipo) for tipo in ("yolo", "classificacao")},
+            "trocas": historico_trocas,
+            "trocas_pendentes": trocas_pendentes,
+            "worker": os.getenv("SERVIR_WORKER"),
+            "inicializacao": TEMPOS_INICIALIZACAO
         })
     except Exception as e:
         logger.error(f"Erro ao obter info dos modelos: {e}")
-        raise HTTPException(status_code=500, detail=str)
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str)
+# ========================================
+# TROCA DE MODELOS A QUENTE (SLOTS VERSIONADOS)
+# ========================================
+TIPOS_MODELO = ("yolo", "classificacao")
+_lock_troca = asyncio.Lock()
+historico_trocas = []  # últimas trocas deste processo (GET /models/info)
+versoes_recusadas = set()  # (tipo do registro, versão) que falharam na carga: o vigia não insiste
+trocas_pendentes = {}  # tipo -> versão do manifesto que este worker não conseguiu carregar (e o erro)
+tarefa_vigia_modelos = None
+
+def tipo_registro(tipo):
+    """Chave do manifesto do artefato servido: "yolo"/"classificacao" ou a do backend exportado"""
+    backend = BACKEND_YOLO if tipo == "yolo" else BACKEND_CLASSIFICACAO
+    return tipo if backend == "nativo" else f"{tipo}_{backend}"
+
+def slots_modelo(tipo):
+    """Versões do histórico do manifesto para o backend ativo, marcando a em uso"""
+    registro = tipo_registro(tipo)
+    return [
+        {**entrada, "ativa": entrada["versao"] == versoes_modelos[tipo],
+         "disponivel": (MODELS_DIR / entrada["arquivo"]).exists()}
+        for entrada in ler_manifesto().get("historico", {}).get(registro, [])
+    ]
+
+def workers_servindo():
+    """Nº de processos que carregam cada versão: os workers do servir.py, ou 1"""
+    return max(1, int(os.getenv("SERVIR_WORKERS", "1"))) if os.getenv("SERVIR_WORKER") else 1
+
+def verificar_memoria_troca(caminho, copias=1):
+    """
+    Levanta 507 se não houver memória para mais `copias` cópias do modelo (uma por worker que
+    vai carregá-lo); retorna (necessária, disponível)
+    """
+    necessaria = int(Path(caminho).stat().st_size * MODELOS_FATOR_MEMORIA * copias)
+    disponivel = memoria_disponivel()
+    if disponivel is not None and disponivel < necessaria:
+        raise HTTPException(
+            status_code=507,
+            detail=f"Memória insuficiente para carregar a nova versão: ~{necessaria / 2**20:.0f} MB necessários, "
+                   f"{disponivel / 2**20:.0f} MB disponíveis"
+        )
+    return necessaria, disponivel
+
+def carregar_versao_modelo(tipo, caminho):
+    """Carrega, compila e aquece uma versão do modelo no backend ativo, sem tocar no modelo em uso"""
+    if tipo == "yolo":
+        if BACKEND_YOLO == "nativo":
+            importar_torch()
+            modelo = carregar_yolo_local(caminho)
+            modelo.conf, modelo.iou = YOLO_CONF, YOLO_IOU
+            tracar_yolo(modelo)
+        else:
+            modelo = BackendYoloExportado(caminho, BACKEND_YOLO)
+        if not getattr(modelo, "names", None):
+            raise ValueError("Modelo YOLO sem nomes de classes")
+        aquecer_yolo(modelo)
+        return modelo
+    
+    if BACKEND_CLASSIFICACAO == "nativo":
+        importar_tensorflow()
+        modelo = compilar_classificador(tf.keras.models.load_model(str(caminho), compile=False))
+    else:
+        modelo = BackendClassificacaoOnnx(caminho)
+    saida = aquecer_classificador(modelo)
+    if saida.shape[-1] != len(LABEL_COLS):
+        raise ValueError(f"Classificador com {saida.shape[-1]} saídas; esperado {len(LABEL_COLS)} ({LABEL_COLS})")
+    return modelo
+
+async def drenar_modelo(modelo):
+    """Espera os forwards em andamento no modelo terminarem (até MODELOS_DRENAGEM_TIMEOUT); retorna se drenou"""
+    limite = time.monotonic() + MODELOS_DRENAGEM_TIMEOUT
+    while forwards_em_andamento.get(id(modelo)):
+        if time.monotonic() >= limite:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+async def trocar_modelo(tipo, caminho, versao, registrar=True, reordenar_historico=True):
+    """
+    Carrega e aquece a versão em segundo plano, troca a referência global (os próximos
+    forwards já usam a nova), invalida os resultados cacheados e libera a versão antiga
+    depois que os forwards em andamento nela terminam. Com registrar, a versão passa a
+    ser a ativa do manifesto (é a que carrega no próximo start, e a que os outros workers
+    seguem, por isso a memória é conferida para todos); sem reordenar_historico (rollback),
+    mantém a posição dela no histórico.
+    """
+    global modelo_yolo, modelo_classificacao
+    registro = tipo_registro(tipo)
+    
+    async with _lock_troca:
+        if versoes_modelos[tipo] == versao:
+            return {"tipo": tipo, "versao": versao, "trocado": False}
+        
+        necessaria, disponivel = verificar_memoria_troca(caminho, workers_servindo() if registrar else 1)
+        logger.info(f"🔁 Carregando {tipo} {versao} para troca a quente (~{necessaria / 2**20:.0f} MB)")
+        inicio = time.perf_counter()
+        try:
+            novo = await asyncio.to_thread(carregar_versao_modelo, tipo, caminho)
+        except Exception:
+            versoes_recusadas.add((registro, versao))
+            raise
+        carga_s = time.perf_counter() - inicio
+        
+        with _lock_modelos:
+            if tipo == "yolo":
+                anterior, modelo_yolo = modelo_yolo, novo
+            else:
+                anterior, modelo_classificacao = modelo_classificacao, novo
+            versao_anterior, versoes_modelos[tipo] = versoes_modelos[tipo], versao
+        trocas_pendentes.pop(tipo, None)
+        
+        if registrar:
+            await asyncio.to_thread(registrar_modelo, registro, caminho, versao, reordenar_historico)
+        await asyncio.to_thread(invalidar_cache_resultados)
+        
+        drenado = await drenar_modelo(anterior)
+        if not drenado:
+            logger.warning(f"⚠️ {tipo} {versao_anterior} ainda em uso após {MODELOS_DRENAGEM_TIMEOUT:g}s; liberado pelo GC ao terminar")
+        del anterior
+        await asyncio.to_thread(gc.collect)
+        
+        troca = {
+            "tipo": tipo,
+            "versao": versao,
+            "versao_anterior": versao_anterior,
+            "trocado": True,
+            "drenado": drenado,
+            "carga_s": round(carga_s, 3),
+            "total_s": round(time.perf_counter() - inicio, 3),
+            "memoria_disponivel_mb": round(disponivel / 2**20, 1) if disponivel is not None else None,
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        historico_trocas.append(troca)
+        del historico_trocas[:-20]
+        logger.info(f"✅ {tipo} trocado a quente: {versao_anterior} -> {versao} em {troca['total_s']}s")
+        return troca
+
+def instalar_slot(tipo, origem, versao=None):
+    """
+    Move o artefato enviado para MODELS_DIR/slots/<tipo do registro>/<versao>/; retorna
+    (caminho, versao, novo), novo indicando que o slot não existia antes do envio
+    """
+    registro = tipo_registro(tipo)
+    versao = versao or calcular_sha256(origem)[:12]
+    try:
+        pasta = diretorio_slot(registro, versao)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="versao deve começar com letra, número ou '_' e conter só letras, números, '.', '-' e '_'")
+    destino = pasta / ARQUIVOS_MODELOS[registro]
+    novo = not pasta.exists()
+    if destino.exists() and calcular_sha256(destino) != calcular_sha256(origem):
+        raise HTTPException(status_code=409, detail=f"Versão {versao} já existe com outro conteúdo")
+    pasta.mkdir(parents=True, exist_ok=True)
+    os.replace(origem, destino)
+    versoes_recusadas.discard((registro, versao))
+    return destino, versao, novo
+
+def slot_registrado(tipo, versao):
+    """Caminho do artefato de uma versão do histórico (sha256 conferido), ou None"""
+    for entrada in ler_manifesto().get("historico", {}).get(tipo_registro(tipo), []):
+        if entrada["versao"] == versao:
+            caminho = MODELS_DIR / entrada["arquivo"]
+            if caminho.exists() and calcular_sha256(caminho) == entrada["sha256"]:
+                return caminho
+    return None
+
+def exigir_admin(request: Request):
+    """Dependência dos endpoints administrativos: Authorization: Bearer <ADMIN_TOKEN>"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Endpoints administrativos desativados (defina ADMIN_TOKEN)")
+    esquema, _, token = request.headers.get("authorization", "").partition(" ")
+    if esquema.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token administrativo inválido", headers={"WWW-Authenticate": "Bearer"})
+
+def validar_tipo_modelo(tipo):
+    if tipo not in TIPOS_MODELO:
+        raise HTTPException(status_code=404, detail=f"tipo deve ser um de {list(TIPOS_MODELO)}")
+
+async def executar_troca(tipo, caminho, versao, novo_slot=False, reordenar_historico=True):
+    """Troca a quente respondendo 422 se a versão não carregar (o slot recém-enviado é descartado)"""
+    try:
+        return await trocar_modelo(tipo, caminho, versao, reordenar_historico=reordenar_historico)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Falha ao carregar {tipo} {versao}: {e}")
+        if novo_slot:
+            apagar_slot(tipo_registro(tipo), caminho_no_registro(caminho))
+        raise HTTPException(status_code=422, detail=f"Versão {versao} de {tipo} não carregou: {e}")
+
+@app.post("/admin/modelos/{tipo}")
+async def ativar_modelo(
+    tipo: str,
+    file: Optional[UploadFile] = File(None),
+    versao: Optional[str] = Form(None),
+    _admin: None = Depends(exigir_admin)
+):
+    """
+    Troca a quente do modelo `tipo` ("yolo" ou "classificacao"), sem reiniciar o processo.
+    Com file: instala o artefato (formato do backend ativo) como uma nova versão (versao ou
+    os 12 primeiros caracteres do sha256) e a ativa. Sem file: reativa a versao indicada
+    do histórico. Responde quando a nova versão já está servindo.
+    """
+    validar_tipo_modelo(tipo)
+    if file is None:
+        if not versao:
+            raise HTTPException(status_code=400, detail="Envie 'file' ou a 'versao' de um slot existente")
+        caminho = await asyncio.to_thread(slot_registrado, tipo, versao)
+        if caminho is None:
+            raise HTTPException(status_code=404, detail=f"Versão {versao} de {tipo} não está no histórico")
+        return RespostaJSON(content=await executar_troca(tipo, caminho, versao))
+    
+    temporario = MODELS_DIR / "slots" / f".upload-{uuid.uuid4().hex}"
+    try:
+        def salvar():
+            temporario.parent.mkdir(parents=True, exist_ok=True)
+            with open(temporario, "wb") as destino:
+                shutil.copyfileobj(file.file, destino, 1024 * 1024)
+        await asyncio.to_thread(salvar)
+        caminho, versao, novo = await asyncio.to_thread(instalar_slot, tipo, temporario, versao)
+    finally:
+        temporario.unlink(missing_ok=True)
+    return RespostaJSON(content=await executar_troca(tipo, caminho, versao, novo_slot=novo))
+
+@app.post("/admin/modelos/{tipo}/rollback")
+async def rollback_modelo(tipo: str, _admin: None = Depends(exigir_admin)):
+    """
+    Volta o modelo `tipo` para a versão do histórico anterior à ativa. O histórico não é
+    reordenado, então rollbacks seguidos descem v3 -> v2 -> v1 até a mais antiga.
+    """
+    validar_tipo_modelo(tipo)
+    historico = await asyncio.to_thread(slots_modelo, tipo)
+    ativa = next((i for i, s in enumerate(historico) if s["ativa"]), len(historico))
+    candidatas = [s["versao"] for s in historico[:ativa] if s["disponivel"]]
+    if not candidatas:
+        raise HTTPException(status_code=409, detail=f"Nenhuma versão anterior de {tipo} disponível para rollback")
+    
+    versao = candidatas[-1]
+    caminho = await asyncio.to_thread(slot_registrado, tipo, versao)
+    if caminho is None:
+        raise HTTPException(status_code=409, detail=f"Artefato da versão {versao} ausente ou corrompido")
+    return RespostaJSON(content=await executar_troca(tipo, caminho, versao, reordenar_historico=False))
+
+async def vigiar_manifesto():
+    """
+    Segue o manifesto de modelos: quando a versão ativa registrada difere da carregada
+    (troca feita por outro worker, ou artefato registrado por um deploy), troca a quente.
+    """
+    if tarefa_inicializacao is not None:
+        await asyncio.wait([tarefa_inicializacao])
+    while True:
+        await asyncio.sleep(MODELOS_VIGIA_INTERVALO)
+        for tipo in TIPOS_MODELO:
+            registro = tipo_registro(tipo)
+            entrada = ler_manifesto()["modelos"].get(registro)
+            if not entrada or entrada["versao"] == versoes_modelos[tipo]:
+                trocas_pendentes.pop(tipo, None)
+                continue
+            if (registro, entrada["versao"]) in versoes_recusadas:
+                continue
+            try:
+                registrado = await asyncio.to_thread(modelo_registrado, registro)
+                if registrado is None:
+                    versoes_recusadas.add((registro, entrada["versao"]))
+                    raise ValueError("artefato ausente ou com sha256 divergente")
+                logger.info(f"👀 Manifesto aponta {tipo} {entrada['versao']} (carregada: {versoes_modelos[tipo]})")
+                await trocar_modelo(tipo, registrado[0], entrada["versao"], registrar=False)
+            except Exception as e:
+                # Sem memória (507) tenta de novo no próximo ciclo; carga que falhou fica recusada
+                detalhe = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"❌ Troca a quente de {tipo} pelo manifesto falhou: {detalhe}")
+                pendente = trocas_pendentes.get(tipo)
+                if pendente is None or pendente["versao"] != entrada["versao"]:
+                    pendente = trocas_pendentes[tipo] = {
+                        "versao": entrada["versao"],
+                        "versao_carregada": versoes_modelos[tipo],
+                        "tentativas": 0,
+                        "desde": datetime.now(timezone.utc).isoformat()
+                    }
+                pendente["tentativas"] += 1
+                pendente["erro"] = detalhe
+                pendente["recusada"] = (registro, entrada["versao"]) in versoes_recusadas
+
+# ========================================
+# PERFILAMENTO SOB DEMANDA
+# ========================================
+
+class SessaoPerfil:
+    """
+    Coleta de perfis de uma janela: cProfile por thread (event loop + executor de inferência),
+    amostragem periódica das pilhas de todas as threads (formato colapsado, para flamegraph),
+    traces do PyTorch a cada forward do YOLO e o profiler do TensorFlow para o processo todo.
+    """
+    
+    def __init__(self, requisicoes=None, segundos=None, cprofile=True, amostragem_ms=PERFIL_AMOSTRAGEM_MS,
+                 perfil_torch=False, perfil_tf=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.requisicoes = requisicoes
+        self.segundos = segundos or PERFIL_MAX_SEGUNDOS
+        self.cprofile = cprofile
+        self.amostragem = amostragem_ms / 1000.0
+        self.perfil_torch = perfil_torch
+        self.perfil_tf = perfil_tf
+        self.iniciado_em = datetime.now(timezone.utc).isoformat()
+        self.inicio = time.monotonic()
+        self.duracao = None
+        self.requisicoes_concluidas = 0
+        self.amostras = 0
+        self.fim = asyncio.Event()
+        self.tarefa = None
+        self._perfis = {}  # thread -> cProfile.Profile (um objeto não pode ser usado por duas threads)
+        self._em_uso = set()  # threads com o cProfile ligado agora
+        self._perfil_loop = None
+        self._pilhas = {}
+        self._traces_torch = []
+        self._lock = threading.Lock()
+        self._lock_torch = threading.Lock()  # o profiler do PyTorch admite uma sessão ativa por vez
+        self._parar_amostragem = threading.Event()
+        self._amostrador = None
+        self._dir_tf = None
+    
+    def iniciar(self):
+        """Liga os coletores; chamado no thread do event loop"""
+        if self.cprofile:
+            self._perfil_loop = cProfile.Profile()
+            self._perfil_loop.enable()
+        if self.amostragem > 0:
+            self._amostrador = threading.Thread(target=self._amostrar, name="perfil-amostragem", daemon=True)
+            self._amostrador.start()
+        if self.perfil_tf:
+            self._dir_tf = tempfile.mkdtemp(prefix="dfu-perfil-tf-")
+            tf.profiler.experimental.start(self._dir_tf)
+    
+    def parar(self):
+        """Desliga os coletores; chamado no mesmo thread do event loop que iniciou"""
+        self.duracao = round(time.monotonic() - self.inicio, 3)
+        if self._perfil_loop is not None:
+            self._perfil_loop.disable()
+        if self._amostrador is not None:
+            self._parar_amostragem.set()
+            self._amostrador.join()
+        if self._dir_tf is not None:
+            try:
+                tf.profiler.experimental.stop()
+            except Exception as e:
+                logger.warning(f"⚠️ Profiler do TensorFlow não encerrou: {e}")
+    
+    def requisicao_concluida(self):
+        self.requisicoes_concluidas += 1
+        if self.requisicoes and self.requisicoes_concluidas >= self.requisicoes:
+            self.fim.set()
+    
+    @contextmanager
+    def perfilar_thread(self):
+        """cProfile da thread corrente (do executor) durante o bloco"""
+        if not self.cprofile:
+            yield
+            return
+        thread = threading.get_ident()
+        with self._lock:
+            perfil = self._perfis.get(thread)
+            if perfil is None:
+                perfil = self._perfis[thread] = cProfile.Profile()
+            self._em_uso.add(thread)
+        perfil.enable()
+        try:
+            yield
+        finally:
+            perfil.disable()
+            with self._lock:
+                self._em_uso.discard(thread)
+    
+    @contextmanager
+    def perfilar_forward(self, tipo):
+        """Trace do PyTorch de um forward do YOLO (o profiler só enxerga a thread que o liga)"""
+        if tipo != "yolo" or not self.perfil_torch or not self._lock_torch.acquire(blocking=False):
+            yield
+            return
+        try:
+            with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as perfil:
+                yield
+            self._traces_torch.append(perfil)
+        finally:
+            self._lock_torch.release()
+    
+    def _amostrar(self):
+        """Pilhas de todas as threads a cada intervalo de amostragem, agregadas no formato colapsado"""
+        proprio = threading.get_ident()
+        while not self._parar_amostragem.wait(self.amostragem):
+            nomes = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread, quadro in sys._current_frames().items():
+                if thread == proprio:
+                    continue
+                pilha = []
+                while quadro is not None:
+                    codigo = quadro.f_code
+                    pilha.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                    quadro = quadro.f_back
+                pilha.append(nomes.get(thread, str(thread)))
+                chave = ";".join(reversed(pilha))
+                self._pilhas[chave] = self._pilhas.get(chave, 0) + 1
+            self.amostras += 1
+    
+    def resumo(self):
+        return {
+            "id": self.id,
+            "ativo": self.duracao is None,
+            "iniciado_em": self.iniciado_em,
+            "duracao_s": self.duracao if self.duracao is not None else round(time.monotonic() - self.inicio, 3),
+            "requisicoes": self.requisicoes,
+            "segundos": self.segundos,
+            "requisicoes_concluidas": self.requisicoes_concluidas,
+            "coletores": {
+                "cprofile": self.cprofile,
+                "amostragem_ms": self.amostragem * 1000,
+                "torch": self.perfil_torch,
+                "tf": self.perfil_tf
+            },
+            "amostras": self.amostras,
+            "traces_torch": len(self._traces_torch),
+            "worker": os.getenv("SERVIR_WORKER"),
+            "pid": os.getpid(),
+            "artefato": f"/admin/perfil/{self.id}"
+        }
+    
+    def gravar(self):
+        """
+        Monta o .zip em PERFIL_DIR: perfil.pstats (snakeviz / pstats), perfil.txt (top por tempo
+        acumulado), pilhas.txt (colapsado: flamegraph.pl / speedscope), torch_trace.json
+        (chrome://tracing / Perfetto), tf/ (TensorBoard) e sessao.json
+        """
+        PERFIL_DIR.mkdir(parents=True, exist_ok=True)
+        destino = PERFIL_DIR / f"perfil-{self.id}.zip"
+        temporario = destino.with_suffix(".zip.tmp")
+        
+        # Chamadas ainda em execução no executor: espera um pouco; as que não terminarem ficam de fora
+        # (o cProfile de uma thread não pode ser desligado por outra)
+        limite = time.monotonic() + 5
+        while self._em_uso and time.monotonic() < limite:
+            time.sleep(0.05)
+        with self._lock:
+            perfis = [p for thread, p in self._perfis.items() if thread not in self._em_uso]
+        if self._perfil_loop is not None:
+            perfis.insert(0, self._perfil_loop)
+        
+        with zipfile.ZipFile(temporario, "w", zipfile.ZIP_DEFLATED) as arquivo:
+            if perfis:
+                estatisticas = pstats.Stats(perfis[0])
+                for perfil in perfis[1:]:
+                    estatisticas.add(perfil)
+                with tempfile.NamedTemporaryFile(suffix=".pstats") as saida:
+                    estatisticas.dump_stats(saida.name)
+                    arquivo.write(saida.name, "perfil.pstats")
+                texto = io.StringIO()
+                estatisticas.stream = texto
+                estatisticas.sort_stats("cumulative").print_stats(80)
+                arquivo.writestr("perfil.txt", texto.getvalue())
+            
+            if self._pilhas:
+                arquivo.writestr("pilhas.txt", "".join(
+                    f"{pilha} {contagem}\n" for pilha, contagem in sorted(self._pilhas.items(), key=lambda item: -item[1])
+                ))
+            
+            if self._traces_torch:
+                eventos = []
+                for perfil in self._traces_torch:
+                    with tempfile.NamedTemporaryFile(suffix=".json") as saida:
+                        perfil.export_chrome_trace(saida.name)
+                        with open(saida.name) as f:
+                            eventos.extend(json.load(f).get("traceEvents", []))
+                arquivo.writestr("torch_trace.json", json.dumps({"traceEvents": eventos}))
+            
+            if self._dir_tf is not None:
+                for raiz, _, nomes in os.walk(self._dir_tf):
+                    for nome in nomes:
+                        caminho = os.path.join(raiz, nome)
+                        arquivo.write(caminho, os.path.join("tf", os.path.relpath(caminho, self._dir_tf)))
+                shutil.rmtree(self._dir_tf, ignore_errors=True)
+            
+            arquivo.writestr("sessao.json", json.dumps(self.resumo(), indent=2))
+        os.replace(temporario, destino)
+        
+        # Mantém só os PERFIL_HISTORICO artefatos mais recentes
+        artefatos = sorted(PERFIL_DIR.glob("perfil-*.zip"), key=lambda p: p.stat().st_mtime)
+        for antigo in artefatos[:-PERFIL_HISTORICO]:
+            antigo.unlink(missing_ok=True)
+        return destino
+
+async def acompanhar_perfil(sessao):
+    """Encerra a sessão ao completar as requisições pedidas, ao fim da janela ou no limite de PERFIL_MAX_SEGUNDOS"""
+    try:
+        await asyncio.wait_for(sessao.fim.wait(), timeout=sessao.segundos)
+    except asyncio.TimeoutError:
+        pass
+    await encerrar_perfil()
+
+async def encerrar_perfil():
+    """Desliga os coletores da sessão ativa e grava o artefato; devolve o resumo (ou None se não havia sessão)"""
+    global sessao_perfil
+    sessao = sessao_perfil
+    if sessao is None:
+        return None
+    sessao_perfil = None
+    sessao.parar()
+    if sessao.tarefa is not None and sessao.tarefa is not asyncio.current_task():
+        sessao.tarefa.cancel()
+    destino = await asyncio.to_thread(sessao.gravar)
+    logger.info(f"🔬 Perfil {sessao.id} gravado em {destino} ({sessao.requisicoes_concluidas} requisições, "
+                f"{sessao.duracao}s, {sessao.amostras} amostras)")
+    return sessao.resumo()
+
+def artefato_perfil(perfil_id):
+    """Caminho do .zip do perfil (de qualquer worker), ou None se ainda não existe"""
+    if not re.fullmatch(r"[0-9a-f]{12}", perfil_id):
+        return None
+    caminho = PERFIL_DIR / f"perfil-{perfil_id}.zip"
+    return caminho if caminho.exists() else None
+
+@app.post("/admin/perfil", status_code=202)
+async def iniciar_perfil(
+    requisicoes: Optional[int] = Form(None),
+    segundos: Optional[float] = Form(None),
+    cprofile: bool = Form(True),
+    amostragem_ms: float = Form(PERFIL_AMOSTRAGEM_MS),
+    perfil_torch: bool = Form(False, alias="torch"),
+    perfil_tf: bool = Form(False, alias="tf"),
+    _admin: None = Depends(exigir_admin)
+):
+    """
+    Perfila as próximas `requisicoes` de /predict/* ou uma janela de `segundos` (uma das duas;
+    no máximo PERFIL_MAX_SEGUNDOS) neste worker. Coletores: cProfile, amostragem das pilhas
+    (amostragem_ms, 0 desliga) e, opcionais, torch=true (forwards do YOLO em PyTorch) e
+    tf=true (TensorFlow). Ao terminar, o .zip fica em GET /admin/perfil/{id}.
+    """
+    global sessao_perfil
+    if sessao_perfil is not None:
+        raise HTTPException(status_code=409, detail=f"Perfil {sessao_perfil.id} já em andamento neste worker")
+    if (requisicoes is None) == (segundos is None):
+        raise HTTPException(status_code=400, detail="Informe 'requisicoes' ou 'segundos' (apenas um)")
+    if requisicoes is not None and requisicoes < 1:
+        raise HTTPException(status_code=400, detail="requisicoes deve ser pelo menos 1")
+    if segundos is not None and not 0 < segundos <= PERFIL_MAX_SEGUNDOS:
+        raise HTTPException(status_code=400, detail=f"segundos deve estar entre 0 e {PERFIL_MAX_SEGUNDOS:g}")
+    if amostragem_ms < 0:
+        raise HTTPException(status_code=400, detail="amostragem_ms não pode ser negativo")
+    if perfil_torch and torch is None:
+        raise HTTPException(status_code=400, detail="PyTorch não carregado neste worker")
+    if perfil_tf and tf is None:
+        raise HTTPException(status_code=400, detail="TensorFlow não carregado neste worker")
+    
+    sessao = SessaoPerfil(requisicoes, segundos, cprofile, amostragem_ms, perfil_torch, perfil_tf)
+    try:
+        sessao.iniciar()
+    except Exception as e:
+        sessao.parar()
+        raise HTTPException(status_code=409, detail=f"Não foi possível iniciar o perfilamento: {e}")
+    sessao_perfil = sessao
+    sessao.tarefa = asyncio.create_task(acompanhar_perfil(sessao))
+    logger.info(f"🔬 Perfil {sessao.id} iniciado ({requisicoes or '-'} requisições / {sessao.segundos:g}s)")
+    return sessao.resumo()
+
+@app.get("/admin/perfil")
+async def estado_perfil(_admin: None = Depends(exigir_admin)):
+    """Sessão ativa neste worker e artefatos disponíveis em PERFIL_DIR"""
+    def listar():
+        if not PERFIL_DIR.exists():
+            return []
+        artefatos = sorted(PERFIL_DIR.glob("perfil-*.zip"), key=lambda p: p.stat().st_mtime, reverse=True)
+        return [{"id": p.stem.removeprefix("perfil-"), "bytes": p.stat().st_size,
+                 "criado_em": datetime.fromtimestamp(p.stat().st_mtime, timezone.utc).isoformat()} for p in artefatos]
+    return {
+        "ativo": sessao_perfil.resumo() if sessao_perfil is not None else None,
+        "artefatos": await asyncio.to_thread(listar)
+    }
+
+@app.delete("/admin/perfil")
+async def parar_perfil(_admin: None = Depends(exigir_admin)):
+    """Encerra antes do previsto a sessão ativa neste worker e grava o artefato"""
+    resumo = await encerrar_perfil()
+    if resumo is None:
+        raise HTTPException(status_code=404, detail="Nenhum perfil em andamento neste worker")
+    return resumo
+
+@app.get("/admin/perfil/{perfil_id}")
+async def baixar_perfil(perfil_id: str, _admin: None = Depends(exigir_admin)):
+    """Baixa o .zip do perfil; 202 com o andamento se a sessão ainda está coletando neste worker"""
+    caminho = await asyncio.to_thread(artefato_perfil, perfil_id)
+    if caminho is not None:
+        return FileResponse(caminho, media_type="application/zip", filename=caminho.name)
+    if sessao_perfil is not None and sessao_perfil.id == perfil_id:
+        return RespostaJSON(content=sessao_perfil.resumo(), status_code=202)
+    raise HTTPException(status_code=404, detail="Perfil desconhecido (ou ainda coletando em outro worker)")
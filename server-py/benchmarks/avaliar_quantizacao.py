@@ -0,0 +1,247 @@
+"""
+Avaliação dos backends quantizados (INT8) frente à referência FP32.
+
+Cada backend roda em um subprocesso próprio (RSS isolado) sobre a mesma pasta de
+imagens, pelo mesmo pipeline da API: letterbox -> YOLO -> boxes na imagem original,
+e classificador em recortes fixos (imagem inteira + quadrantes) para que a
+comparação das probabilidades de LABEL_COLS não dependa das detecções.
+
+Relatório por backend: carga, latência p50/p95 (YOLO e classificador), RSS após a carga
+e pico; e, frente à referência, concordância das caixas (IoU >= --iou, mesma classe)
+e das classes previstas pelo classificador.
+
+Uso (a partir de server-py/, com os modelos exportados por exportar_modelos.py):
+    python benchmarks/avaliar_quantizacao.py --imagens ./amostras
+    python benchmarks/avaliar_quantizacao.py --imagens ./amostras --referencia onnx --candidatos onnx_int8 --saida rel.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+SERVER_PY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTENSOES = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def rss_mb():
+    """RSS atual do processo (Linux: /proc; fallback: pico)"""
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    return pico_rss_mb()
+
+
+def pico_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentis(tempos):
+    if not tempos:
+        return {"p50_ms": None, "p95_ms": None}
+    return {"p50_ms": round(float(np.median(tempos)), 2), "p95_ms": round(float(np.percentile(tempos, 95)), 2)}
+
+
+def caixas_fixas(w, h):
+    return [{"xmin": 0, "ymin": 0, "xmax": w, "ymax": h}] + [
+        {"xmin": x, "ymin": y, "xmax": x + w // 2, "ymax": y + h // 2}
+        for x in (0, w // 2) for y in (0, h // 2)
+    ]
+
+
+def executar_backend(backend, pasta, quantidade, saida):
+    """Roda no subprocesso: carrega os modelos do backend e grava métricas + predições em JSON"""
+    os.environ["BACKEND_YOLO"] = backend
+    os.environ["BACKEND_CLASSIFICACAO"] = backend if backend != "torchscript" else "nativo"
+    if backend not in ("onnx", "onnx_int8"):
+        import yolov5  # noqa: F401  (torch antes do tensorflow)
+
+    sys.path.insert(0, SERVER_PY)
+    import api_ia
+
+    rss_inicial = rss_mb()
+    inicio = time.perf_counter()
+
+    async def carregar():
+        await api_ia.carregar_modelo_yolo()
+        await api_ia.carregar_modelo_classificacao()
+
+    asyncio.run(carregar())
+    carga_s = time.perf_counter() - inicio
+    api_ia.compilar_modelos()
+    api_ia.aquecer_modelos()
+    rss_carregado = rss_mb()
+
+    caminhos = sorted(p for p in Path(pasta).iterdir() if p.suffix.lower() in EXTENSOES)[:quantidade]
+    tempos_yolo, tempos_classificacao, predicoes = [], [], []
+    for caminho in caminhos:
+        img = api_ia.Image.open(caminho).convert("RGB")
+        canvas, resize_info = api_ia.preparar_letterbox(img)
+
+        t0 = time.perf_counter()
+        resultado = api_ia.inferir_yolo_lote([canvas])[0]
+        tempos_yolo.append((time.perf_counter() - t0) * 1000)
+        deteccoes = api_ia.processar_deteccoes_yolo(resultado, resize_info)
+
+        recortes = api_ia.preparar_recortes(img, caixas_fixas(*img.size))
+        t0 = time.perf_counter()
+        probs = api_ia.classificar_recortes(recortes)
+        tempos_classificacao.append((time.perf_counter() - t0) * 1000)
+
+        predicoes.append({"arquivo": caminho.name, "deteccoes": deteccoes, "probs": probs.tolist()})
+
+    # Backend pedido indisponível -> a API cai no modelo nativo; o relatório deixa isso explícito
+    fallback = []
+    if backend != "nativo" and not hasattr(api_ia.modelo_yolo, "inferir_lote"):
+        fallback.append("yolo")
+    if api_ia.BACKEND_CLASSIFICACAO != "nativo" and not isinstance(api_ia.modelo_classificacao, api_ia.BackendClassificacaoOnnx):
+        fallback.append("classificacao")
+
+    relatorio = {
+        "backend": backend,
+        "fallback_nativo": fallback,
+        "modelos": {
+            "yolo": type(api_ia.modelo_yolo).__name__,
+            "classificacao": type(api_ia.modelo_classificacao).__name__,
+        },
+        "versoes": api_ia.versoes_modelos,
+        "imagens": len(caminhos),
+        "carga_s": round(carga_s, 2),
+        "yolo": percentis(tempos_yolo),
+        "classificacao": percentis(tempos_classificacao),
+        "rss_mb": {
+            "inicial": round(rss_inicial, 1),
+            "carregado": round(rss_carregado, 1),
+            "pico": round(pico_rss_mb(), 1),
+        },
+    }
+    with open(saida, "w") as f:
+        json.dump({"relatorio": relatorio, "predicoes": predicoes}, f)
+
+
+def iou_matriz(a, b):
+    """IoU entre todas as caixas de a (n, 4) e b (m, 4)"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersecao = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersecao / (area_a[:, None] + area_b[None, :] - intersecao + 1e-7)
+
+
+def comparar(referencia, candidato, limiar_iou):
+    """Concordância das caixas (pareamento guloso por IoU) e do classificador"""
+    total_ref = total_cand = pares = 0
+    ious, concordancia_classe, dif_probs = [], [], []
+
+    for ref, cand in zip(referencia, candidato):
+        a = ref["deteccoes"]
+        b = cand["deteccoes"]
+        total_ref += len(a)
+        total_cand += len(b)
+        if a and b:
+            caixas_a = np.array([[d["xmin"], d["ymin"], d["xmax"], d["ymax"]] for d in a], dtype=np.float32)
+            caixas_b = np.array([[d["xmin"], d["ymin"], d["xmax"], d["ymax"]] for d in b], dtype=np.float32)
+            mesma_classe = np.array([[da["classe"] == db["classe"] for db in b] for da in a])
+            matriz = iou_matriz(caixas_a, caixas_b) * mesma_classe
+            while matriz.size and matriz.max() >= limiar_iou:
+                i, j = np.unravel_index(matriz.argmax(), matriz.shape)
+                ious.append(float(matriz[i, j]))
+                pares += 1
+                matriz[i, :] = 0
+                matriz[:, j] = 0
+
+        probs_ref = np.array(ref["probs"])
+        probs_cand = np.array(cand["probs"])
+        concordancia_classe.extend(probs_ref.argmax(1) == probs_cand.argmax(1))
+        dif_probs.append(np.abs(probs_ref - probs_cand).max())
+
+    return {
+        "caixas": {
+            "referencia": total_ref,
+            "candidato": total_cand,
+            "recall": round(pares / total_ref, 4) if total_ref else None,
+            "precisao": round(pares / total_cand, 4) if total_cand else None,
+            "iou_medio": round(float(np.mean(ious)), 4) if ious else None,
+        },
+        "classificacao": {
+            "concordancia_top1": round(float(np.mean(concordancia_classe)), 4) if concordancia_classe else None,
+            "dif_max_prob": round(float(np.max(dif_probs)), 6) if dif_probs else None,
+        },
+    }
+
+
+def rodar_subprocesso(backend, args, pasta_tmp):
+    saida = os.path.join(pasta_tmp, f"{backend}.json")
+    comando = [
+        sys.executable, os.path.abspath(__file__), "--executar", backend,
+        "--imagens", args.imagens, "--quantidade", str(args.quantidade), "--saida", saida
+    ]
+    subprocess.run(comando, check=True)
+    with open(saida) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--imagens", required=True, help="pasta com as imagens de avaliação")
+    parser.add_argument("--quantidade", type=int, default=50)
+    parser.add_argument("--referencia", default="nativo", help="backend FP32 de referência")
+    parser.add_argument("--candidatos", nargs="+", default=["onnx_int8"])
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU mínimo para considerar duas caixas iguais")
+    parser.add_argument("--saida", help="grava o relatório completo em JSON")
+    parser.add_argument("--executar", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.executar:
+        executar_backend(args.executar, args.imagens, args.quantidade, args.saida)
+        return
+
+    with tempfile.TemporaryDirectory() as pasta_tmp:
+        referencia = rodar_subprocesso(args.referencia, args, pasta_tmp)
+        candidatos = [rodar_subprocesso(backend, args, pasta_tmp) for backend in args.candidatos]
+
+    relatorio = {"referencia": referencia["relatorio"], "candidatos": []}
+    for candidato in candidatos:
+        entrada = dict(candidato["relatorio"])
+        entrada["concordancia"] = comparar(referencia["predicoes"], candidato["predicoes"], args.iou)
+        relatorio["candidatos"].append(entrada)
+
+    print(f"\n{'backend':<12} {'carga s':>8} {'yolo p50':>9} {'yolo p95':>9} {'cls p50':>8} {'RSS MB':>8} {'pico MB':>8}")
+    for r in [relatorio["referencia"]] + relatorio["candidatos"]:
+        print(f"{r['backend']:<12} {r['carga_s']:>8} {r['yolo']['p50_ms']:>9} {r['yolo']['p95_ms']:>9} "
+              f"{r['classificacao']['p50_ms']:>8} {r['rss_mb']['carregado']:>8} {r['rss_mb']['pico']:>8}")
+
+    for r in [relatorio["referencia"]] + relatorio["candidatos"]:
+        if r["fallback_nativo"]:
+            print(f"⚠️ {r['backend']}: {', '.join(r['fallback_nativo'])} caiu no modelo nativo (artefato ausente ou inválido)")
+
+    for r in relatorio["candidatos"]:
+        caixas = r["concordancia"]["caixas"]
+        classificacao = r["concordancia"]["classificacao"]
+        print(f"\n{r['backend']} vs {args.referencia} ({r['imagens']} imagens):")
+        print(f"  caixas: {caixas['candidato']}/{caixas['referencia']}  recall={caixas['recall']}  "
+              f"precisão={caixas['precisao']}  IoU médio={caixas['iou_medio']}")
+        print(f"  classificador: top-1 igual em {classificacao['concordancia_top1']}  "
+              f"dif. máx. prob={classificacao['dif_max_prob']}")
+
+    if args.saida:
+        with open(args.saida, "w") as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Benchmark/verificação do downloader de modelos contra um servidor HTTP local.
+
+O servidor de teste (ThreadingHTTPServer) serve um arquivo aleatório com suporte
+opcional a Range, limita a banda por conexão (como um CDN/Drive faz) e pode
+derrubar conexões no meio para exercitar a retomada.
+
+Cenários: 1 segmento vs N segmentos paralelos, queda de conexão no meio,
+servidor sem Range, sha256 errado (deve falhar sem deixar o destino) e
+retomada de um .part deixado por um processo anterior.
+
+Uso (a partir de server-py/):
+    python benchmarks/bench_download.py --tamanho-mb 64 --banda-mbps 40 --segmentos 4
+"""
+import argparse
+import hashlib
+import http.server
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import api_ia  # noqa: E402
+
+
+class Servidor(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, conteudo, banda_bytes_s, aceita_range=True, falhar_apos=None):
+        super().__init__(("127.0.0.1", 0), ManipuladorArquivo)
+        self.conteudo = conteudo
+        self.banda_bytes_s = banda_bytes_s
+        self.aceita_range = aceita_range
+        self.falhar_apos = falhar_apos  # derruba cada conexão após N bytes (uma vez por faixa)
+        self.faixas_derrubadas = set()
+        self.requisicoes = 0
+
+
+class ManipuladorArquivo(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        servidor = self.server
+        servidor.requisicoes += 1
+        total = len(servidor.conteudo)
+        inicio, fim = 0, total - 1
+
+        faixa = self.headers.get("Range")
+        if faixa and servidor.aceita_range:
+            inicio_txt, fim_txt = faixa.replace("bytes=", "").split("-")
+            inicio = int(inicio_txt)
+            fim = min(int(fim_txt), total - 1) if fim_txt else total - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {inicio}-{fim}/{total}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(fim - inicio + 1))
+        self.end_headers()
+
+        derrubar_em = None
+        if servidor.falhar_apos and fim - inicio > servidor.falhar_apos and (inicio, fim) not in servidor.faixas_derrubadas:
+            servidor.faixas_derrubadas.add((inicio, fim))
+            derrubar_em = inicio + servidor.falhar_apos
+
+        posicao, bloco = inicio, 256 * 1024
+        try:
+            while posicao <= fim:
+                ate = min(fim + 1, posicao + bloco)
+                if derrubar_em is not None and ate > derrubar_em:
+                    self.wfile.write(servidor.conteudo[posicao:derrubar_em])
+                    self.wfile.flush()
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(servidor.conteudo[posicao:ate])
+                posicao = ate
+                if servidor.banda_bytes_s:
+                    time.sleep(bloco / servidor.banda_bytes_s)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def iniciar_servidor(**kwargs):
+    servidor = Servidor(**kwargs)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/modelo.bin"
+
+
+def cenario(nome, conteudo, sha256, segmentos, esperar_falha=False, preparar=None, **kwargs_servidor):
+    servidor, url = iniciar_servidor(conteudo=conteudo, **kwargs_servidor)
+    api_ia.DOWNLOAD_SEGMENTOS = segmentos
+    with tempfile.TemporaryDirectory() as pasta:
+        destino = Path(pasta) / "modelo.bin"
+        if preparar:
+            preparar(url, destino)
+        inicio = time.perf_counter()
+        try:
+            api_ia.baixar_arquivo_bloqueante(url, destino, sha256)
+            erro = None
+        except Exception as e:
+            erro = e
+        duracao = time.perf_counter() - inicio
+
+        if esperar_falha:
+            ok = erro is not None and not destino.exists()
+        else:
+            ok = erro is None and hashlib.sha256(destino.read_bytes()).hexdigest() == hashlib.sha256(conteudo).hexdigest()
+    servidor.shutdown()
+
+    mb_s = len(conteudo) / 1024 / 1024 / duracao
+    detalhe = f"erro: {erro}" if erro and not esperar_falha else f"{servidor.requisicoes} requisições"
+    print(f"{'✅' if ok else '❌'} {nome:<40} {duracao:6.2f}s  {mb_s:7.1f} MB/s  ({detalhe})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanho-mb", type=float, default=64)
+    parser.add_argument("--banda-mbps", type=float, default=40, help="banda por conexão em MB/s (0 = sem limite)")
+    parser.add_argument("--segmentos", type=int, default=4)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger("api_ia").setLevel(logging.INFO if args.verbose else logging.ERROR)
+    api_ia.DOWNLOAD_SEGMENTO_MIN_MB = 1
+    api_ia.DOWNLOAD_TENTATIVAS = 3
+    conteudo = os.urandom(int(args.tamanho_mb * 1024 * 1024))
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    banda = args.banda_mbps * 1024 * 1024
+    meio = len(conteudo) // (2 * args.segmentos)
+
+    def part_de_processo_anterior(url, destino):
+        # Simula um restart: metade de cada segmento já no .part + estado salvo
+        api_ia.DOWNLOAD_SEGMENTOS = args.segmentos
+        servidor_falho, url_falha = iniciar_servidor(conteudo=conteudo, banda_bytes_s=0, falhar_apos=meio)
+        api_ia.DOWNLOAD_TENTATIVAS = 1
+        try:
+            api_ia.baixar_arquivo_bloqueante(url_falha, destino, sha256)
+        except Exception:
+            pass
+        finally:
+            api_ia.DOWNLOAD_TENTATIVAS = 3
+            servidor_falho.shutdown()
+        # O estado aponta para a URL do servidor anterior; reaproveita-o para a nova URL
+        estado_path = destino.with_name(destino.name + ".part.json")
+        estado = api_ia.json.loads(estado_path.read_text())
+        estado["url"] = url
+        estado_path.write_text(api_ia.json.dumps(estado))
+
+    resultados = [
+        cenario("1 segmento", conteudo, sha256, 1, banda_bytes_s=banda),
+        cenario(f"{args.segmentos} segmentos paralelos", conteudo, sha256, args.segmentos, banda_bytes_s=banda),
+        cenario("queda de conexão no meio (retomada)", conteudo, sha256, args.segmentos,
+                banda_bytes_s=banda, falhar_apos=meio),
+        cenario("servidor sem Range", conteudo, sha256, args.segmentos, banda_bytes_s=banda, aceita_range=False),
+        cenario("sha256 errado (deve falhar)", conteudo, "0" * 64, args.segmentos,
+                esperar_falha=True, banda_bytes_s=banda),
+        cenario("retomada de .part após restart", conteudo, sha256, args.segmentos,
+                preparar=part_de_processo_anterior, banda_bytes_s=banda),
+    ]
+    return 0 if all(resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark do pré-processamento do YOLO (por imagem).
+
+Antes: redimensionar_imagem (PIL LANCZOS + canvas) seguido do pré-processamento
+interno do AutoShape (np.asarray, letterbox, stack, BCHW, /255).
+Depois: letterbox_imagem (OpenCV, um único passo) + montar_tensor_yolo (buffer pré-alocado).
+
+Uso (a partir de server-py/):
+    python benchmarks/bench_preprocessamento.py --largura 4000 --altura 3000 --repeticoes 20
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+from yolov5.utils.augmentations import letterbox
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import api_ia  # noqa: E402
+
+
+def preprocessamento_antigo(img):
+    img_padded, _ = api_ia.redimensionar_imagem(img, target_size=640)
+    # Mesmo caminho do AutoShape.forward para uma imagem PIL
+    im = np.asarray(img_padded)
+    x = letterbox(im, (640, 640), auto=False)[0]
+    x = np.ascontiguousarray(np.array([x]).transpose((0, 3, 1, 2)))
+    return torch.from_numpy(x).float() / 255
+
+
+def preprocessamento_novo(img):
+    canvas, _ = api_ia.letterbox_imagem(img, target_size=640)
+    return api_ia.montar_tensor_yolo([canvas])
+
+
+def medir(funcao, img, repeticoes):
+    funcao(img)  # aquecimento
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(img)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return np.median(tempos), np.percentile(tempos, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--largura", type=int, default=4000)
+    parser.add_argument("--altura", type=int, default=3000)
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    img = Image.fromarray(rng.integers(0, 256, (args.altura, args.largura, 3), dtype=np.uint8))
+
+    print(f"Imagem {args.largura}x{args.altura}, {args.repeticoes} repetições")
+    for nome, funcao in (("antes (PIL + AutoShape)", preprocessamento_antigo),
+                         ("depois (OpenCV + buffer)", preprocessamento_novo)):
+        p50, p95 = medir(funcao, img, args.repeticoes)
+        print(f"  {nome:<26} p50={p50:8.2f} ms  p95={p95:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
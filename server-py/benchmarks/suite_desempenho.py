@@ -0,0 +1,369 @@
+"""
+Suíte de desempenho reprodutível, 100% offline, com os modelos mock da API
+(YOLOMock e o classificador tf.keras.Sequential de demonstração).
+
+Micro-benchmarks: redimensionar_imagem, letterbox_imagem, processar_deteccoes_yolo,
+image_to_base64 e o laço de recortes + classificação.
+Carga: gerador em processo (httpx + ASGITransport, sem rede) contra /predict/detection
+e /predict/classification com concorrência e tamanhos de imagem configuráveis.
+
+Memória: pico de RSS de cada requisição isolada (amostrado em uma thread, acima do RSS
+de antes da requisição), por endpoint e tamanho de imagem.
+
+Resultados: p50/p95/p99, throughput e pico de RSS, gravados em JSON e comparados com
+um baseline (regressão se o p95 piorar, ou o throughput cair, mais que --limite).
+
+Uso (a partir de server-py/):
+    python benchmarks/suite_desempenho.py --saida resultados.json
+    python benchmarks/suite_desempenho.py --gravar-baseline benchmarks/baseline.json
+    python benchmarks/suite_desempenho.py --baseline benchmarks/baseline.json --limite 0.15
+
+O baseline só é comparável na mesma máquina/configuração: grave-o no ambiente de referência.
+"""
+import argparse
+import asyncio
+import ctypes.util
+import gc
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+# Força os mocks: sem rede e com uma pasta de modelos vazia
+os.environ["MODELOS_OFFLINE"] = "1"
+os.environ["MODELS_DIR"] = tempfile.mkdtemp(prefix="dfu-bench-")
+os.environ["BACKEND_INFERENCIA"] = "nativo"
+for variavel in ("BACKEND_YOLO", "BACKEND_CLASSIFICACAO"):
+    os.environ.pop(variavel, None)
+# Requisições repetidas com a mesma imagem: sem os caches de resultado, toda requisição infere
+os.environ["CACHE_RESULTADOS_MAX_MB"] = "0"
+os.environ["CLASSIFICACAO_INCREMENTAL"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import api_ia  # noqa: E402
+
+
+def pico_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss_atual_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c")) if platform.system() == "Linux" else None
+
+
+def liberar_memoria():
+    """Coleta o lixo e devolve ao SO a memória livre do malloc, para o RSS de partida ser comparável"""
+    gc.collect()
+    if _libc is not None and hasattr(_libc, "malloc_trim"):
+        _libc.malloc_trim(0)
+
+
+class AmostradorRSS:
+    """Amostra o RSS do processo em uma thread enquanto o bloco executa e guarda o pico"""
+
+    def __init__(self, intervalo=0.001):
+        self.intervalo = intervalo
+        self.pico = 0.0
+        self._parar = threading.Event()
+
+    def _amostrar(self):
+        while not self._parar.is_set():
+            self.pico = max(self.pico, rss_atual_mb())
+            time.sleep(self.intervalo)
+
+    def __enter__(self):
+        self.pico = rss_atual_mb()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._parar.set()
+        self._thread.join()
+        self.pico = max(self.pico, rss_atual_mb())
+
+
+def percentis(tempos_ms):
+    tempos = np.asarray(tempos_ms)
+    return {
+        "p50_ms": round(float(np.percentile(tempos, 50)), 3),
+        "p95_ms": round(float(np.percentile(tempos, 95)), 3),
+        "p99_ms": round(float(np.percentile(tempos, 99)), 3),
+        "amostras": len(tempos),
+    }
+
+
+def medir(funcao, repeticoes):
+    funcao()  # aquecimento
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return percentis(tempos)
+
+
+def imagem_sintetica(largura, altura, seed=0):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (altura, largura, 3), dtype=np.uint8))
+
+
+def jpeg_sintetico(largura, altura, seed=0):
+    buffer = io.BytesIO()
+    imagem_sintetica(largura, altura, seed).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def deteccoes_sinteticas(quantidade, tamanho=640, seed=0):
+    """Saída no formato do YOLO (n, 6) [x1, y1, x2, y2, conf, cls] dentro do letterbox"""
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, tamanho * 0.8, (quantidade, 2))
+    wh = rng.uniform(16, tamanho * 0.2, (quantidade, 2))
+    conf = rng.uniform(0.25, 1.0, (quantidade, 1))
+    cls = rng.integers(0, 2, (quantidade, 1))
+    return np.hstack([xy, xy + wh, conf, cls]).astype(np.float32)
+
+
+def boxes_sinteticas(quantidade, largura, altura, seed=0):
+    """Boxes no formato aceito por /predict/classification"""
+    rng = np.random.default_rng(seed)
+    boxes = []
+    for _ in range(quantidade):
+        w, h = int(rng.integers(32, largura // 3)), int(rng.integers(32, altura // 3))
+        x, y = int(rng.integers(0, largura - w)), int(rng.integers(0, altura - h))
+        boxes.append({"xmin": x, "ymin": y, "xmax": x + w, "ymax": y + h, "classe": "ulcera", "confianca": 0.9})
+    return boxes
+
+
+def executar_micro(tamanhos, boxes, repeticoes):
+    resultados = {}
+    for largura, altura in tamanhos:
+        img = imagem_sintetica(largura, altura)
+        sufixo = f"[{largura}x{altura}]"
+        resultados[f"redimensionar_imagem{sufixo}"] = medir(lambda: api_ia.redimensionar_imagem(img), repeticoes)
+        resultados[f"letterbox_imagem{sufixo}"] = medir(lambda: api_ia.letterbox_imagem(img), repeticoes)
+
+        canvas, resize_info = api_ia.letterbox_imagem(img)
+        resultados[f"image_to_base64[640x640]{sufixo}"] = medir(lambda: api_ia.image_to_base64(canvas), repeticoes)
+
+        deteccoes = api_ia.processar_deteccoes_yolo(
+            api_ia.ResultadoDeteccaoIndividual(deteccoes_sinteticas(boxes)), resize_info
+        )
+        resultados[f"recortes_classificacao[{boxes} boxes]{sufixo}"] = medir(
+            lambda: api_ia.classificar_recortes(api_ia.preparar_recortes(img, deteccoes)), repeticoes
+        )
+
+    for quantidade in (10, boxes, 300):
+        resultado = api_ia.ResultadoDeteccaoIndividual(deteccoes_sinteticas(quantidade))
+        _, resize_info = api_ia.letterbox_imagem(imagem_sintetica(*tamanhos[0]))
+        resultados[f"processar_deteccoes_yolo[{quantidade} boxes]"] = medir(
+            lambda: api_ia.processar_deteccoes_yolo(resultado, resize_info), repeticoes
+        )
+    return resultados
+
+
+async def gerar_carga(cliente, nome, requisicao, concorrencia, total):
+    """Dispara `total` requisições com `concorrencia` clientes simultâneos"""
+    tempos, status = [], {}
+    restantes = iter(range(total))
+
+    async def cliente_virtual():
+        for _ in restantes:
+            inicio = time.perf_counter()
+            resposta = await requisicao(cliente)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            status[resposta.status_code] = status.get(resposta.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente_virtual() for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+
+    resultado = percentis(tempos)
+    resultado.update({
+        "throughput_rps": round(total / duracao, 2),
+        "status": {str(codigo): n for codigo, n in sorted(status.items())},
+        "erros": sum(n for codigo, n in status.items() if codigo != 200),
+    })
+    print(f"  {nome:<60} p95={resultado['p95_ms']:9.2f} ms  {resultado['throughput_rps']:8.2f} req/s")
+    return resultado
+
+
+async def medir_memoria(cliente, nome, requisicao, repeticoes):
+    """Pico de RSS acima do RSS de partida em requisições isoladas (uma por vez)"""
+    await requisicao(cliente)  # aquecimento: buffers e caches de primeira execução
+    picos = []
+    for _ in range(repeticoes):
+        liberar_memoria()
+        partida = rss_atual_mb()
+        with AmostradorRSS() as amostrador:
+            await requisicao(cliente)
+        picos.append(amostrador.pico - partida)
+
+    resultado = {
+        "pico_mb_p50": round(float(np.median(picos)), 1),
+        "pico_mb_max": round(float(np.max(picos)), 1),
+        "amostras": len(picos),
+    }
+    print(f"  {nome:<60} pico p50={resultado['pico_mb_p50']:7.1f} MB  máx={resultado['pico_mb_max']:7.1f} MB")
+    return resultado
+
+
+async def executar_carga(tamanhos, concorrencias, boxes, requisicoes, formato_imagem):
+    import httpx
+
+    await api_ia.startup_event()
+    while not api_ia.modelos_prontos:
+        if api_ia.erro_inicializacao is not None:
+            raise RuntimeError(f"Inicialização dos modelos falhou: {api_ia.erro_inicializacao}")
+        await asyncio.sleep(0.1)
+
+    resultados, memoria = {}, {}
+    transporte = httpx.ASGITransport(app=api_ia.app)
+    try:
+        async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=300) as cliente:
+            for largura, altura in tamanhos:
+                conteudo = jpeg_sintetico(largura, altura)
+                deteccoes_json = json.dumps(boxes_sinteticas(boxes, largura, altura))
+
+                async def deteccao(c):
+                    return await c.post(
+                        "/predict/detection",
+                        files={"file": ("bench.jpg", conteudo, "image/jpeg")},
+                        data={"formato_imagem": formato_imagem}
+                    )
+
+                async def classificacao(c):
+                    return await c.post(
+                        "/predict/classification",
+                        files={"file": ("bench.jpg", conteudo, "image/jpeg")},
+                        data={"deteccoes_json": deteccoes_json}
+                    )
+
+                memoria[f"/predict/detection[{largura}x{altura}]"] = await medir_memoria(
+                    cliente, f"memória /predict/detection[{largura}x{altura}]", deteccao, 5
+                )
+                memoria[f"/predict/classification[{boxes} boxes][{largura}x{altura}]"] = await medir_memoria(
+                    cliente, f"memória /predict/classification[{boxes} boxes][{largura}x{altura}]", classificacao, 5
+                )
+
+                for concorrencia in concorrencias:
+                    sufixo = f"[{largura}x{altura},c={concorrencia}]"
+                    resultados[f"/predict/detection{sufixo}"] = await gerar_carga(
+                        cliente, f"/predict/detection{sufixo}", deteccao, concorrencia, requisicoes
+                    )
+                    resultados[f"/predict/classification[{boxes} boxes]{sufixo}"] = await gerar_carga(
+                        cliente, f"/predict/classification[{boxes} boxes]{sufixo}", classificacao, concorrencia, requisicoes
+                    )
+    finally:
+        await api_ia.shutdown_event()
+    return resultados, memoria
+
+
+def comparar_baseline(resultados, baseline, limite):
+    """Lista as regressões: p95 acima de (1 + limite) x baseline ou throughput abaixo de (1 - limite) x baseline"""
+    regressoes = []
+    for secao in ("micro", "carga"):
+        for nome, novo in resultados.get(secao, {}).items():
+            antigo = baseline.get(secao, {}).get(nome)
+            if not antigo:
+                continue
+            if novo["p95_ms"] > antigo["p95_ms"] * (1 + limite):
+                regressoes.append(f"{nome}: p95 {antigo['p95_ms']} -> {novo['p95_ms']} ms")
+            if "throughput_rps" in novo and novo["throughput_rps"] < antigo["throughput_rps"] * (1 - limite):
+                regressoes.append(f"{nome}: throughput {antigo['throughput_rps']} -> {novo['throughput_rps']} req/s")
+    return regressoes
+
+
+def tamanho(texto):
+    largura, altura = texto.lower().split("x")
+    return int(largura), int(altura)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", nargs="+", type=tamanho, default=[(1024, 768), (4000, 3000)])
+    parser.add_argument("--concorrencias", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--requisicoes", type=int, default=40, help="requisições por cenário de carga")
+    parser.add_argument("--repeticoes", type=int, default=30, help="repetições por micro-benchmark")
+    parser.add_argument("--boxes", type=int, default=20, help="boxes por imagem nos cenários de classificação")
+    parser.add_argument("--formato-imagem", default="base64", choices=api_ia.FORMATOS_IMAGEM)
+    parser.add_argument("--somente", choices=["micro", "carga"])
+    parser.add_argument("--saida", help="grava os resultados em JSON")
+    parser.add_argument("--baseline", help="JSON de referência para detectar regressões")
+    parser.add_argument("--limite", type=float, default=0.15, help="piora relativa tolerada (0.15 = 15%%)")
+    parser.add_argument("--gravar-baseline", help="grava os resultados como novo baseline neste caminho")
+    args = parser.parse_args()
+
+    resultados = {
+        "ambiente": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "inferencia_workers": api_ia.INFERENCIA_WORKERS,
+        },
+        "config": {
+            "tamanhos": [f"{w}x{h}" for w, h in args.tamanhos],
+            "concorrencias": args.concorrencias,
+            "requisicoes": args.requisicoes,
+            "repeticoes": args.repeticoes,
+            "boxes": args.boxes,
+            "formato_imagem": args.formato_imagem,
+        },
+    }
+
+    if args.somente != "micro":
+        # A carga inicializa os modelos (mocks); os micro-benchmarks de classificação dependem deles
+        print("Carga:")
+        resultados["carga"], resultados["memoria"] = asyncio.run(executar_carga(
+            args.tamanhos, args.concorrencias, args.boxes, args.requisicoes, args.formato_imagem
+        ))
+    else:
+        asyncio.run(api_ia.inicializar_modelos())
+
+    resultados["modelos"] = dict(api_ia.versoes_modelos)
+
+    if args.somente != "carga":
+        print("Micro-benchmarks:")
+        resultados["micro"] = executar_micro(args.tamanhos, args.boxes, args.repeticoes)
+        for nome, r in resultados["micro"].items():
+            print(f"  {nome:<60} p50={r['p50_ms']:9.3f} ms  p95={r['p95_ms']:9.3f} ms")
+
+    # Grafos traçados ao fim da carga: devem ser os mesmos do warmup (sem retracing sob carga)
+    resultados["compilacao"] = api_ia.estatisticas_compilacao()
+    print(f"Compilação: {resultados['compilacao']}")
+
+    resultados["pico_rss_mb"] = round(pico_rss_mb(), 1)
+    print(f"Pico de RSS: {resultados['pico_rss_mb']} MB")
+
+    for caminho in (args.saida, args.gravar_baseline):
+        if caminho:
+            with open(caminho, "w") as f:
+                json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressoes = comparar_baseline(resultados, json.load(f), args.limite)
+        if regressoes:
+            print(f"❌ {len(regressoes)} regressão(ões) acima de {args.limite:.0%}:")
+            for regressao in regressoes:
+                print(f"   {regressao}")
+            return 1
+        print(f"✅ Sem regressões acima de {args.limite:.0%} frente ao baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Exporta os modelos para os backends alternativos da API e verifica a paridade.
+
+YOLO -> ONNX (dinâmico no batch, metadados names/stride) e TorchScript (names em config.txt).
+Classificador -> ONNX (tf2onnx, entrada (None, 224, 224, 3)).
+onnx_int8 -> quantização estática INT8 dos ONNX (ONNX Runtime, QDQ), calibrada com as
+imagens de --imagens; só Conv/MatMul são quantizados (o decode das caixas fica em FP32).
+Os artefatos são gravados em MODELS_DIR e registrados no manifest.json, de onde a API
+os carrega quando BACKEND_INFERENCIA / BACKEND_YOLO / BACKEND_CLASSIFICACAO pedem.
+
+Dependências só da exportação (não vão para a imagem da API): onnx, tf2onnx.
+
+Uso (a partir de server-py/):
+    python exportar_modelos.py                       # exporta tudo
+    python exportar_modelos.py --modelos yolo --formatos onnx
+    python exportar_modelos.py --formatos onnx onnx_int8 --imagens ./amostras
+    python exportar_modelos.py --verificar --imagens ./amostras
+
+A paridade também é conferida sem os pesos de produção, com modelos pequenos de pesos
+aleatórios, por tests/test_paridade_backends.py (python -m pytest tests).
+A precisão/latência do INT8 frente ao FP32 é medida por benchmarks/avaliar_quantizacao.py.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# torch/yolov5 antes do tensorflow (mesma ordem da API)
+import torch
+import yolov5  # noqa: F401  (registra os módulos do YOLOv5 usados pelos checkpoints)
+
+import api_ia
+
+
+NOMES_FORMATOS = {"onnx": "ONNX", "torchscript": "TorchScript"}
+
+
+def exportar_yolo_arquivos(origem, destinos):
+    """Exporta o checkpoint YOLOv5 `origem` para cada formato de destinos ({"onnx": caminho, ...})"""
+    from yolov5.models.experimental import attempt_load
+    from yolov5.models.yolo import Detect
+
+    modelo = attempt_load(str(origem), device="cpu", inplace=True, fuse=True).eval()
+    for m in modelo.modules():
+        if isinstance(m, Detect):
+            m.inplace = False
+            m.dynamic = True
+            m.export = True
+
+    names = {int(k): v for k, v in dict(modelo.names).items()}
+    stride = int(max(modelo.stride))
+    exemplo = torch.zeros(1, 3, 640, 640)
+    modelo(exemplo)  # dry run (monta os grids)
+
+    if "onnx" in destinos:
+        import onnx
+
+        destino = destinos["onnx"]
+        argumentos = dict(
+            opset_version=13,  # >= 13 para a quantização INT8 por canal (QDQ)
+            do_constant_folding=True,
+            input_names=["images"],
+            output_names=["output0"],
+            dynamic_axes={"images": {0: "batch"}, "output0": {0: "batch"}}
+        )
+        try:
+            torch.onnx.export(modelo, exemplo, str(destino), dynamo=False, **argumentos)
+        except TypeError:  # torch < 2.5 não tem o parâmetro dynamo
+            torch.onnx.export(modelo, exemplo, str(destino), **argumentos)
+
+        modelo_onnx = onnx.load(str(destino))
+        onnx.checker.check_model(modelo_onnx)
+        for chave, valor in {"stride": stride, "names": names}.items():
+            meta = modelo_onnx.metadata_props.add()
+            meta.key, meta.value = chave, str(valor)
+        onnx.save(modelo_onnx, str(destino))
+
+    if "torchscript" in destinos:
+        traced = torch.jit.trace(modelo, exemplo, strict=False)
+        config = json.dumps({"names": names, "stride": stride, "shape": list(exemplo.shape)})
+        traced.save(str(destinos["torchscript"]), _extra_files={"config.txt": config})
+
+
+def exportar_yolo(formatos):
+    origem = (api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS["yolo"]).resolve()
+    destinos = {
+        formato: api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS[f"yolo_{formato}"]
+        for formato in formatos if formato in NOMES_FORMATOS
+    }
+    exportar_yolo_arquivos(origem, destinos)
+
+    for formato, destino in destinos.items():
+        entrada = api_ia.registrar_modelo(f"yolo_{formato}", destino)
+        print(f"✅ YOLO {NOMES_FORMATOS[formato]}: {destino} ({entrada['versao']})")
+
+
+def exportar_classificacao_arquivo(origem, destino):
+    """Exporta o classificador Keras `origem` para ONNX em `destino`"""
+    import tensorflow as tf
+    import tf2onnx
+
+    modelo = tf.keras.models.load_model(str(origem), compile=False)
+
+    # from_function em vez de from_keras: funciona também com Keras 3
+    assinatura = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+    funcao = tf.function(lambda x: modelo(x, training=False), input_signature=assinatura)
+    tf2onnx.convert.from_function(funcao, input_signature=assinatura, opset=13, output_path=str(destino))
+
+
+def exportar_classificacao():
+    origem = api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS["classificacao"]
+    destino = api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS["classificacao_onnx"]
+    exportar_classificacao_arquivo(origem, destino)
+
+    entrada = api_ia.registrar_modelo("classificacao_onnx", destino)
+    print(f"✅ Classificador ONNX: {destino} ({entrada['versao']})")
+
+
+class LeitorCalibracao:
+    """CalibrationDataReader do ONNX Runtime: um lote de uma imagem por vez"""
+
+    def __init__(self, nome_entrada, amostras):
+        self.nome_entrada = nome_entrada
+        self.amostras = iter(amostras)
+
+    def get_next(self):
+        amostra = next(self.amostras, None)
+        return None if amostra is None else {self.nome_entrada: amostra[None]}
+
+
+def quantizar_onnx(tipo, amostras):
+    """Quantiza o ONNX FP32 registrado (tipo) em INT8 e registra como '<tipo>_int8'"""
+    import onnx
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    origem = api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS[tipo]
+    if not origem.exists():
+        raise SystemExit(f"❌ {origem} não existe; exporte o ONNX FP32 antes (--formatos onnx)")
+    destino = api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS[f"{tipo}_int8"]
+    preprocessado = destino.with_suffix(".pre.onnx")
+    nome_entrada = ort.InferenceSession(str(origem), providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    quant_pre_process(str(origem), str(preprocessado), skip_symbolic_shape=True)
+    quantize_static(
+        str(preprocessado),
+        str(destino),
+        LeitorCalibracao(nome_entrada, amostras),
+        quant_format=QuantFormat.QDQ,
+        op_types_to_quantize=["Conv", "MatMul", "Gemm"],
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8
+    )
+    preprocessado.unlink()
+
+    # Mantém os metadados (names/stride) do modelo FP32
+    metadados = onnx.load(str(origem)).metadata_props
+    modelo_int8 = onnx.load(str(destino))
+    for prop in metadados:
+        meta = modelo_int8.metadata_props.add()
+        meta.key, meta.value = prop.key, prop.value
+    onnx.save(modelo_int8, str(destino))
+
+    entrada = api_ia.registrar_modelo(f"{tipo}_int8", destino)
+    tamanho = destino.stat().st_size / origem.stat().st_size
+    print(f"✅ {tipo} INT8: {destino} ({entrada['versao']}, {tamanho:.0%} do FP32)")
+
+
+def amostras_yolo(imagens):
+    return [np.ascontiguousarray(img.transpose(2, 0, 1), dtype=np.float32) / 255.0 for img in imagens]
+
+
+def amostras_classificacao(imagens):
+    """Recortes de calibração: imagem inteira e quadrantes, no formato do preparar_recortes"""
+    amostras = []
+    for img in imagens:
+        pil = api_ia.Image.fromarray(img)
+        w, h = pil.size
+        caixas = [{"xmin": 0, "ymin": 0, "xmax": w, "ymax": h}] + [
+            {"xmin": x, "ymin": y, "xmax": x + w // 2, "ymax": y + h // 2}
+            for x in (0, w // 2) for y in (0, h // 2)
+        ]
+        amostras.extend(api_ia.preparar_recortes(pil, caixas))
+    return amostras
+
+
+def carregar_imagens(pasta, quantidade):
+    """Imagens da pasta (letterboxed como na API) ou sintéticas se nenhuma for informada"""
+    if pasta:
+        caminhos = sorted(p for p in Path(pasta).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"))
+        return [api_ia.preparar_letterbox(api_ia.Image.open(p).convert("RGB"))[0] for p in caminhos[:quantidade]]
+
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (640, 640, 3), dtype=np.uint8) for _ in range(quantidade)]
+
+
+def comparar_deteccoes(nativo, exportado, tol_px, tol_conf):
+    """Pareia as caixas pela maior sobreposição e compara coordenadas, confiança e classe"""
+    a = api_ia.para_numpy(nativo)
+    b = api_ia.para_numpy(exportado)
+    # Caixas muito perto do limiar podem entrar/sair por arredondamento
+    if len(a) != len(b):
+        return f"{len(a)} caixas nativas vs {len(b)} exportadas"
+    for caixa in a:
+        distancias = np.abs(b[:, :4] - caixa[:4]).max(axis=1)
+        j = distancias.argmin()
+        if distancias[j] > tol_px:
+            return f"caixa {caixa[:4].round(1).tolist()} sem par (dif. {distancias[j]:.2f}px)"
+        if abs(b[j, 4] - caixa[4]) > tol_conf or b[j, 5] != caixa[5]:
+            return f"confiança/classe divergentes ({caixa[4]:.4f}/{b[j, 4]:.4f})"
+    return None
+
+
+def verificar(formatos, modelos, imagens, tol_px, tol_conf, tol_prob):
+    """Compara o backend nativo com os exportados nas mesmas entradas; retorna o nº de falhas"""
+    falhas = 0
+
+    if "yolo" in modelos:
+        nativo = api_ia.carregar_yolo_local((api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS["yolo"]).resolve())
+        nativo.conf, nativo.iou = api_ia.YOLO_CONF, api_ia.YOLO_IOU
+        api_ia.modelo_yolo = nativo
+        referencia = [r.xyxy[0] for r in api_ia.inferir_yolo_lote(imagens)]
+
+        for formato in formatos:
+            api_ia.modelo_yolo = api_ia.carregar_yolo_exportado(formato)
+            resultado = [r.xyxy[0] for r in api_ia.inferir_yolo_lote(imagens)]
+            erros = [comparar_deteccoes(a, b, tol_px, tol_conf) for a, b in zip(referencia, resultado)]
+            erros = [e for e in erros if e]
+            total = sum(len(r) for r in referencia)
+            print(f"{'❌' if erros else '✅'} YOLO {formato}: {len(imagens)} imagens, {total} caixas")
+            for erro in erros[:5]:
+                print(f"   {erro}")
+            falhas += len(erros)
+
+    if "classificacao" in modelos and "onnx" in formatos:
+        import tensorflow as tf
+
+        rng = np.random.default_rng(1)
+        recortes = rng.random((16, 224, 224, 3), dtype=np.float32)
+        nativo = tf.keras.models.load_model(
+            str(api_ia.MODELS_DIR / api_ia.ARQUIVOS_MODELOS["classificacao"]), compile=False
+        )
+        api_ia.modelo_classificacao = nativo
+        referencia = api_ia.classificar_recortes(recortes)
+        api_ia.modelo_classificacao = api_ia.carregar_classificacao_exportada("onnx")
+        resultado = api_ia.classificar_recortes(recortes)
+
+        diferenca = float(np.abs(referencia - resultado).max())
+        ok = diferenca <= tol_prob and (referencia.argmax(1) == resultado.argmax(1)).all()
+        print(f"{'✅' if ok else '❌'} Classificador onnx: dif. máx. {diferenca:.2e}")
+        falhas += 0 if ok else 1
+
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modelos", nargs="+", choices=["yolo", "classificacao"], default=["yolo", "classificacao"])
+    parser.add_argument(
+        "--formatos", nargs="+", choices=["onnx", "torchscript", "onnx_int8"], default=["onnx", "torchscript"]
+    )
+    parser.add_argument("--verificar", action="store_true", help="só compara nativo vs exportado (não exporta)")
+    parser.add_argument("--imagens", help="pasta com imagens para a verificação/calibração (padrão: sintéticas)")
+    parser.add_argument("--quantidade", type=int, default=8, help="nº de imagens usadas (verificação/calibração)")
+    parser.add_argument("--tol-px", type=float, default=1.0, help="tolerância das caixas em pixels")
+    parser.add_argument("--tol-conf", type=float, default=1e-3)
+    parser.add_argument("--tol-prob", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    if not args.verificar:
+        if "yolo" in args.modelos:
+            exportar_yolo(args.formatos)
+        if "classificacao" in args.modelos and "onnx" in args.formatos:
+            exportar_classificacao()
+        if "onnx_int8" in args.formatos:
+            if not args.imagens:
+                print("⚠️ Calibrando com imagens sintéticas; use --imagens com fotos reais em produção")
+            imagens = carregar_imagens(args.imagens, args.quantidade)
+            if "yolo" in args.modelos:
+                quantizar_onnx("yolo_onnx", amostras_yolo(imagens))
+            if "classificacao" in args.modelos:
+                quantizar_onnx("classificacao_onnx", amostras_classificacao(imagens))
+        return 0
+
+    # INT8 não é exportação sem perdas: a comparação fica em benchmarks/avaliar_quantizacao.py
+    args.formatos = [f for f in args.formatos if f != "onnx_int8"]
+
+    imagens = carregar_imagens(args.imagens, args.quantidade)
+    falhas = verificar(args.formatos, args.modelos, imagens, args.tol_px, args.tol_conf, args.tol_prob)
+    return 1 if falhas else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
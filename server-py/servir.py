@@ -0,0 +1,198 @@
+"""
+Servidor de produção multi-worker (pre-fork) da API de IA.
+
+O processo mestre:
+  1. divide os núcleos entre os workers e fixa os threads de cada framework
+     (THREADS_INTRA_OP / OMP / MKL / TF / ONNX) antes de importar qualquer um;
+  2. baixa os modelos pendentes e carrega o YOLO (PyTorch) uma única vez, para os
+     pesos ficarem compartilhados copy-on-write entre os workers;
+  3. abre o socket e faz fork de SERVIR_WORKERS processos uvicorn, cada um fixado
+     (sched_setaffinity) no seu conjunto de núcleos; o classificador (TensorFlow
+     não sobrevive a fork) e os backends ONNX são carregados em cada worker;
+  4. reinicia workers que morrerem e registra periodicamente a memória de cada um
+     (RSS, PSS, privada, compartilhada) para dimensionar os pods.
+
+Opt-in (a imagem Docker usa uvicorn em um processo; SERVIR_PREFORK=1 usa este servidor).
+O mestre carrega o YOLO com 1 thread, para não criar o pool do OpenMP antes do fork
+(um pool herdado pode travar os filhos); cada worker aplica os seus threads depois.
+
+Estado por worker: as imagens de sessão (image_id), os caches de resultados e de
+recortes e as sessões de perfil (/admin/perfil) ficam na memória de cada processo.
+Uma classificação por image_id que cair em outro worker recebe 404 (o backend Node
+reenvia a imagem); para aproveitar os caches, use afinidade de sessão no balanceador.
+Uma troca a quente (POST /admin/modelos) exige memória para uma cópia do modelo por
+worker; o worker que não conseguir seguir o manifesto mostra a pendência em /health.
+
+Variáveis de ambiente:
+    SERVIR_WORKERS              nº de workers (padrão: núcleos / threads por worker)
+    SERVIR_THREADS_POR_WORKER   threads intra-op de cada worker (padrão: 4, limitado aos núcleos)
+    SERVIR_FIXAR_CPUS           1 = fixa cada worker nos seus núcleos (padrão)
+    SERVIR_RELATORIO_MEMORIA    intervalo do relatório de memória em segundos (0 desliga)
+    HOST / PORT                 endereço de escuta (padrão 0.0.0.0:8000)
+
+Uso:
+    SERVIR_WORKERS=4 SERVIR_THREADS_POR_WORKER=4 python servir.py
+"""
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("servir")
+
+
+def nucleos_disponiveis():
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # sem sched_getaffinity (macOS/Windows)
+        return list(range(os.cpu_count() or 1))
+
+
+NUCLEOS = nucleos_disponiveis()
+THREADS_POR_WORKER = max(1, min(int(os.getenv("SERVIR_THREADS_POR_WORKER", "4")), len(NUCLEOS)))
+WORKERS = int(os.getenv("SERVIR_WORKERS", str(max(1, len(NUCLEOS) // THREADS_POR_WORKER))))
+FIXAR_CPUS = os.getenv("SERVIR_FIXAR_CPUS", "1") == "1" and hasattr(os, "sched_setaffinity")
+RELATORIO_MEMORIA = float(os.getenv("SERVIR_RELATORIO_MEMORIA", "60"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+
+# Threads por worker: precisa estar no ambiente antes de importar numpy/cv2/torch/tensorflow
+for variavel in ("THREADS_INTRA_OP", "OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                 "TF_NUM_INTRAOP_THREADS"):
+    os.environ.setdefault(variavel, str(THREADS_POR_WORKER))
+os.environ.setdefault("THREADS_INTER_OP", "1")
+os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+# Um forward por vez por worker (mais um para decode/encode enquanto o modelo roda)
+os.environ.setdefault("INFERENCIA_WORKERS", "2")
+
+# Métricas Prometheus agregadas entre os workers
+if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="dfu-metricas-")
+else:
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+import uvicorn  # noqa: E402
+from prometheus_client import multiprocess  # noqa: E402
+
+import api_ia  # noqa: E402
+
+
+def nucleos_do_worker(indice):
+    """Fatia dos núcleos disponíveis reservada ao worker (circular se houver mais threads que núcleos)"""
+    inicio = (indice * THREADS_POR_WORKER) % len(NUCLEOS)
+    return {NUCLEOS[(inicio + i) % len(NUCLEOS)] for i in range(THREADS_POR_WORKER)}
+
+
+def executar_worker(indice, sock):
+    """Corpo do processo filho: fixa CPUs/threads e roda o uvicorn no socket herdado"""
+    os.environ["SERVIR_WORKER"] = str(indice)
+    os.environ["SERVIR_WORKERS"] = str(WORKERS)
+    for sinal in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sinal, signal.SIG_DFL)
+
+    if FIXAR_CPUS:
+        os.sched_setaffinity(0, nucleos_do_worker(indice))
+    api_ia.configurar_threads()
+
+    config = uvicorn.Config(api_ia.app, log_level="info", lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def iniciar_worker(indice, sock):
+    pid = os.fork()
+    if pid == 0:
+        codigo = 0
+        try:
+            executar_worker(indice, sock)
+        except BaseException:
+            logger.exception(f"❌ Worker {indice} falhou")
+            codigo = 1
+        finally:
+            os._exit(codigo)
+    nucleos = sorted(nucleos_do_worker(indice)) if FIXAR_CPUS else "todos"
+    logger.info(f"👷 Worker {indice} iniciado (pid {pid}, núcleos {nucleos}, {THREADS_POR_WORKER} threads)")
+    return pid
+
+
+def relatorio_memoria(workers):
+    """Loga a memória do mestre e de cada worker; a soma do PSS é o consumo real do pod"""
+    api_ia.METRICA_RSS.set(api_ia.rss_processo())
+    linhas = [("mestre", api_ia.memoria_processo())]
+    linhas += [(f"worker {indice}", api_ia.memoria_processo(pid)) for pid, indice in sorted(workers.items(), key=lambda w: w[1])]
+
+    total_pss = 0
+    for nome, memoria in linhas:
+        total_pss += memoria.get("pss_mb", 0)
+        logger.info(
+            f"🧠 {nome:<9} pid={memoria['pid']:<7} rss={memoria.get('rss_mb', '?')} MB  "
+            f"pss={memoria.get('pss_mb', '?')} MB  privada={memoria.get('privado_mb', '?')} MB  "
+            f"compartilhada={memoria.get('compartilhado_mb', '?')} MB"
+        )
+    logger.info(f"🧠 Total (soma do PSS): {total_pss:.1f} MB para {len(workers)} workers")
+
+
+def main():
+    logger.info(
+        f"🚀 Servindo em {HOST}:{PORT} com {WORKERS} workers x {THREADS_POR_WORKER} threads "
+        f"({len(NUCLEOS)} núcleos disponíveis)"
+    )
+
+    # Pesos compartilhados: carregados uma vez, antes do fork
+    asyncio.run(api_ia.precarregar_modelos_compartilhados())
+
+    sock = socket.socket(socket.AF_INET6 if ":" in HOST else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    workers = {iniciar_worker(indice, sock): indice for indice in range(WORKERS)}
+
+    encerrando = False
+
+    def encerrar(sinal, _frame):
+        nonlocal encerrando
+        encerrando = True
+        logger.info(f"🛑 Sinal {sinal} recebido, encerrando {len(workers)} workers...")
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+
+    proximo_relatorio = time.monotonic() + min(RELATORIO_MEMORIA, 30) if RELATORIO_MEMORIA else None
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+
+        if pid:
+            indice = workers.pop(pid)
+            multiprocess.mark_process_dead(pid)
+            if not encerrando:
+                logger.warning(f"⚠️ Worker {indice} (pid {pid}) terminou com status {status}, reiniciando")
+                workers[iniciar_worker(indice, sock)] = indice
+            continue
+
+        if proximo_relatorio and time.monotonic() >= proximo_relatorio and not encerrando:
+            relatorio_memoria(workers)
+            proximo_relatorio = time.monotonic() + RELATORIO_MEMORIA
+        time.sleep(0.5)
+
+    sock.close()
+    logger.info("✅ Todos os workers encerrados")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+"""
+Configuração comum dos testes: importa a API a partir de server-py/ com o registro de
+modelos e a fila de jobs num diretório temporário, sem downloads.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+_TEMPORARIO = tempfile.mkdtemp(prefix="dfu-testes-")
+os.environ.setdefault("MODELS_DIR", os.path.join(_TEMPORARIO, "models"))
+os.environ.setdefault("JOBS_SQLITE", os.path.join(_TEMPORARIO, "jobs.db"))
+os.environ.setdefault("MODELOS_OFFLINE", "1")
+# Checkpoints do YOLOv5 guardam o módulo inteiro (torch >= 2.6 carrega só pesos por padrão)
+os.environ.setdefault("TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD", "1")
+os.makedirs(os.environ["MODELS_DIR"], exist_ok=True)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
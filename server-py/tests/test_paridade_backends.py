@@ -0,0 +1,111 @@
+"""
+Paridade dos backends exportados (exportar_modelos.py) com os nativos: um YOLOv5n e um
+classificador Keras pequenos, de pesos aleatórios, são exportados para ONNX/TorchScript
+e devem dar as mesmas caixas e probabilidades nas mesmas entradas.
+"""
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+yolov5 = pytest.importorskip("yolov5")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+import api_ia  # noqa: E402
+import exportar_modelos  # noqa: E402
+
+CONF = 0.5
+TOL_PX, TOL_CONF, TOL_PROB = 1.0, 1e-3, 1e-4
+
+
+@pytest.fixture(scope="module")
+def imagens():
+    """Retângulos de cores sólidas sobre o cinza do letterbox (640x640)"""
+    rng = np.random.default_rng(0)
+    imagens = []
+    for _ in range(2):
+        img = np.full((640, 640, 3), 114, dtype=np.uint8)
+        for _ in range(6):
+            x, y = rng.integers(0, 560, 2)
+            w, h = rng.integers(30, 200, 2)
+            img[y:y + h, x:x + w] = rng.integers(0, 256, 3)
+        imagens.append(img)
+    return imagens
+
+
+@pytest.fixture(scope="module")
+def yolo_pequeno(tmp_path_factory, imagens):
+    """
+    YOLOv5n de pesos aleatórios. Sem treino as ativações somem ao longo da rede e todas
+    as âncoras empatam na confiança; as estatísticas do BatchNorm são calibradas nas
+    imagens e a cabeça é reinicializada para as confianças variarem com a entrada.
+    """
+    from pathlib import Path
+    from yolov5.models.yolo import Detect, Model
+
+    torch.manual_seed(0)
+    modelo = Model(str(Path(yolov5.__file__).parent / "models" / "yolov5n.yaml"), ch=3, nc=2)
+    for camada in modelo.modules():
+        if isinstance(camada, torch.nn.BatchNorm2d):
+            camada.momentum = None  # média acumulada
+    lote = torch.from_numpy(np.stack(imagens)).permute(0, 3, 1, 2).float() / 255.0
+    modelo.train()
+    with torch.no_grad():
+        for _ in range(4):
+            modelo(lote)
+    modelo.eval()
+    for conv in next(m for m in modelo.modules() if isinstance(m, Detect)).m:
+        torch.nn.init.normal_(conv.weight, std=1.0)
+        torch.nn.init.zeros_(conv.bias)
+
+    modelo.names = {0: "ulcera", 1: "calo"}
+    caminho = tmp_path_factory.mktemp("yolo") / api_ia.ARQUIVOS_MODELOS["yolo"]
+    torch.save({"model": modelo}, caminho)
+    return caminho
+
+
+@pytest.fixture(scope="module")
+def referencia_yolo(yolo_pequeno, imagens):
+    nativo = api_ia.carregar_yolo_local(yolo_pequeno)
+    nativo.conf, nativo.iou = CONF, api_ia.YOLO_IOU
+    return [r.xyxy[0] for r in api_ia.inferir_yolo_lote(imagens, nativo)]
+
+
+@pytest.mark.parametrize("formato", ["onnx", "torchscript"])
+def test_yolo_exportado_igual_ao_nativo(formato, yolo_pequeno, imagens, referencia_yolo, tmp_path):
+    destino = tmp_path / api_ia.ARQUIVOS_MODELOS[f"yolo_{formato}"]
+    exportar_modelos.exportar_yolo_arquivos(yolo_pequeno, {formato: destino})
+
+    exportado = api_ia.BackendYoloExportado(destino, formato)
+    exportado.conf = CONF
+    assert exportado.names == {0: "ulcera", 1: "calo"}
+    resultado = [r.xyxy[0] for r in api_ia.inferir_yolo_lote(imagens, exportado)]
+
+    assert sum(len(r) for r in referencia_yolo) > 0
+    for nativo, convertido in zip(referencia_yolo, resultado):
+        assert exportar_modelos.comparar_deteccoes(nativo, convertido, TOL_PX, TOL_CONF) is None
+
+
+def test_classificador_onnx_igual_ao_nativo(tmp_path):
+    tf = pytest.importorskip("tensorflow")
+    pytest.importorskip("tf2onnx")
+
+    tf.keras.utils.set_random_seed(0)
+    nativo = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(224, 224, 3)),
+        tf.keras.layers.Conv2D(8, 3, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(len(api_ia.LABEL_COLS), activation="softmax")
+    ])
+    origem = tmp_path / api_ia.ARQUIVOS_MODELOS["classificacao"]
+    nativo.save(origem)
+    destino = tmp_path / api_ia.ARQUIVOS_MODELOS["classificacao_onnx"]
+    exportar_modelos.exportar_classificacao_arquivo(origem, destino)
+
+    recortes = np.random.default_rng(1).random((5, 224, 224, 3), dtype=np.float32)
+    referencia = api_ia.classificar_recortes(recortes, nativo)
+    resultado = api_ia.classificar_recortes(recortes, api_ia.BackendClassificacaoOnnx(destino))
+
+    assert resultado.shape == referencia.shape
+    np.testing.assert_allclose(resultado, referencia, atol=TOL_PROB)
+    assert (resultado.argmax(1) == referencia.argmax(1)).all()